@@ -4,6 +4,8 @@ import numpy as np
 import re
 
 import config
+import timing_profile
+import tdr
 
 from scp import SCPClient
 from datetime import datetime
@@ -16,6 +18,11 @@ import pandas as pd
      and changed time offset to fixed -0.194uS per BCM guidance.
 
 12/09/2024.  Added support for capturing North Monitor AFE  stats (LAFE core0)
+
+Optional timing=TimingProfile argument (timing_profile.py): maxTime and the
+  post-command settle wait adapt to latencies observed on the amp.
+
+data_crunch() gets its impulse response, axes and peaks from tdr.TdrEngine (shared with ec.py).
 '''
 
 
@@ -237,8 +244,10 @@ import pandas as pd
 
 
 
-def amp_readback(channel,command,prompt='FDX-AMP>',maxTime=8.0):
+def amp_readback(channel,command,prompt='FDX-AMP>',maxTime=8.0,timing=None):
     error = False
+    if timing is not None:
+        maxTime = timing.timeout(command, maxTime)
     channel.send(f'{command}\r\n'.encode())   # type
     start_time = time.time()
     time.sleep(0.2)
@@ -264,6 +273,9 @@ def amp_readback(channel,command,prompt='FDX-AMP>',maxTime=8.0):
             print(f'ERROR: {command} failed to return prompt {prompt}')
             error=True
             print('output is: ' + output)
+            break
+    if timing is not None and not error:
+        timing.record(command, time.time() - start_time)
 
     channel.send('\r\n')  #write return one last time
     time.sleep(0.1)
@@ -325,8 +337,12 @@ def hal_gather_telemetry(channel,command):
 
 
 
-def hal_gather_telemetry_16p3(channel,command):
+def hal_gather_telemetry_16p3(channel,command,timing=None):
     maxTime=12.0
+    settleTime=1.5  # wait for the amp to finish writing the stats file
+    if timing is not None:
+        maxTime = timing.timeout(command, maxTime)
+        settleTime = timing.wait(timing_profile.ready_key(command), settleTime)
     start_time = time.time()
     channel.send(f'{command} \r\n'.encode())   # type
     time.sleep(0.2)
@@ -376,10 +392,13 @@ def hal_gather_telemetry_16p3(channel,command):
                 timeout = True
 
 
+    if timing is not None and match_check:
+        timing.record(command, time.time() - start_time)
+
     if 'ERROR EcPnmStats' in output:
         print(f'{command} returned with ERROR in response. Closing shell and stopping execution')
         channel.close()
-    time.sleep(1.5)
+    time.sleep(settleTime)
     channel.send('\r\n')
     time.sleep(0.25)
     output += channel.recv(128000).decode("utf-8")
@@ -397,20 +416,20 @@ def hal_gather_telemetry_16p3(channel,command):
     return match_check
 
 
-def triggerAmpTelemetry(ssh,statsList,subBands,command='',timeout=6000,path='"./EC"'):
+def triggerAmpTelemetry(ssh,statsList,subBands,command='',timeout=6000,path='"./EC"',timing=None):
     fafeList=[]
     channel = ssh.invoke_shell()
     channel.settimeout(timeout)
     command='setNorthPortSwitch Downstream'
-    amp_readback(channel,command,prompt='FDX-AMP>$',maxTime=8.0)
+    amp_readback(channel,command,prompt='FDX-AMP>$',maxTime=8.0,timing=timing)
     time.sleep(1.0)
     command=''
-    amp_readback(channel,command,prompt='FDX-AMP>$',maxTime=8.0)
+    amp_readback(channel,command,prompt='FDX-AMP>$',maxTime=8.0,timing=timing)
     time.sleep(0.5)
     command='hal\r\n'
-    amp_readback(channel,command,prompt='hal',maxTime=12.0)
+    amp_readback(channel,command,prompt='hal',maxTime=12.0,timing=timing)
     command='cd /'
-    amp_readback(channel,command,prompt='hal>',maxTime=8.0)
+    amp_readback(channel,command,prompt='hal>',maxTime=8.0,timing=timing)
 
     ######### gather the telemetry metrics.
     for statsType in statsList:
@@ -424,17 +443,17 @@ def triggerAmpTelemetry(ssh,statsList,subBands,command='',timeout=6000,path='"./
             print(f'Sending command: {command} to hal>')
             #hal_comm(channel,command)
             while not check_telemetry or i > 3:  # retry getting telemetry up to 3 times, with output valid check
-                check_telemetry = hal_gather_telemetry_16p3(channel, command)
+                check_telemetry = hal_gather_telemetry_16p3(channel, command, timing)
                 i +=1
                 time.sleep(.5)
     ########################
 
     if config.createFAFE:
-        fafe_core0 = amp_readback(channel,'/leap/fafe_show_status 0',prompt='NcInputPower         = ',maxTime=8.0)[0]
+        fafe_core0 = amp_readback(channel,'/leap/fafe_show_status 0',prompt='NcInputPower         = ',maxTime=8.0,timing=timing)[0]
         time.sleep(0.5)
-        fafe_core4 = amp_readback(channel,'/leap/fafe_show_status 4',prompt='NcInputPower         = ',maxTime=8.0)[0]
+        fafe_core4 = amp_readback(channel,'/leap/fafe_show_status 4',prompt='NcInputPower         = ',maxTime=8.0,timing=timing)[0]
         time.sleep(0.5)
-        lafe_core0 = amp_readback(channel,'/leap/lafe_show_status 0',prompt='RxInputPower       = ',maxTime=8.0)[0]
+        lafe_core0 = amp_readback(channel,'/leap/lafe_show_status 0',prompt='RxInputPower       = ',maxTime=8.0,timing=timing)[0]
         time.sleep(0.5)
         fafeList.append(fafe_core0)
         fafeList.append(fafe_core4)
@@ -445,19 +464,19 @@ def triggerAmpTelemetry(ssh,statsList,subBands,command='',timeout=6000,path='"./
     return fafeList
 
 
-def triggerAmpTelemetry_wJump(channel,statsList,subBands,command='',timeout=6000,path='"./EC"'):
+def triggerAmpTelemetry_wJump(channel,statsList,subBands,command='',timeout=6000,path='"./EC"',timing=None):
     fafeList=[]
 
     command='setNorthPortSwitch Downstream'
-    amp_readback(channel,command,prompt='FDX-AMP>$',maxTime=8.0)
+    amp_readback(channel,command,prompt='FDX-AMP>$',maxTime=8.0,timing=timing)
     time.sleep(1.0)
     command=''
-    amp_readback(channel,command,prompt='FDX-AMP>$',maxTime=8.0)
+    amp_readback(channel,command,prompt='FDX-AMP>$',maxTime=8.0,timing=timing)
     time.sleep(0.5)
     command='hal\r\n'
-    amp_readback(channel,command,prompt='hal',maxTime=12.0)
+    amp_readback(channel,command,prompt='hal',maxTime=12.0,timing=timing)
     command='cd /'
-    amp_readback(channel,command,prompt='hal>',maxTime=8.0)
+    amp_readback(channel,command,prompt='hal>',maxTime=8.0,timing=timing)
 
     ######### gather the telemetry metrics.
     for statsType in statsList:
@@ -471,17 +490,17 @@ def triggerAmpTelemetry_wJump(channel,statsList,subBands,command='',timeout=6000
             print(f'Sending command: {command} to hal>')
             #hal_comm(channel,command)
             while not check_telemetry or i > 3:  # retry getting telemetry up to 3 times, with output valid check
-                check_telemetry = hal_gather_telemetry_16p3(channel, command)
+                check_telemetry = hal_gather_telemetry_16p3(channel, command, timing)
                 i +=1
                 time.sleep(.5)
     ########################
 
     if config.createFAFE:
-        fafe_core0 = amp_readback(channel,'/leap/fafe_show_status 0',prompt='NcInputPower         = ',maxTime=8.0)[0]
+        fafe_core0 = amp_readback(channel,'/leap/fafe_show_status 0',prompt='NcInputPower         = ',maxTime=8.0,timing=timing)[0]
         time.sleep(0.5)
-        fafe_core4 = amp_readback(channel,'/leap/fafe_show_status 4',prompt='NcInputPower         = ',maxTime=8.0)[0]
+        fafe_core4 = amp_readback(channel,'/leap/fafe_show_status 4',prompt='NcInputPower         = ',maxTime=8.0,timing=timing)[0]
         time.sleep(0.5)
-        lafe_core0 = amp_readback(channel,'/leap/lafe_show_status 0',prompt='RxInputPower       = ',maxTime=8.0)[0]
+        lafe_core0 = amp_readback(channel,'/leap/lafe_show_status 0',prompt='RxInputPower       = ',maxTime=8.0,timing=timing)[0]
         time.sleep(0.5)
         fafeList.append(fafe_core0)
         fafeList.append(fafe_core4)
@@ -495,17 +514,11 @@ def triggerAmpTelemetry_wJump(channel,statsList,subBands,command='',timeout=6000
 
 
 def copyAmpTelemetry(ssh,statsList,subBands,path):
-    fileList=[]
-    for statsType in statsList:
-        for subband in subBands:
-            with SCPClient(ssh.get_transport()) as scp:
-                filename = f"EC_{statsType}_{subband}.dat"
-                source = f"/tmp/{filename}"
-                destination = f'{path}/{filename}'
-                print(f"SCP file from {source} to {destination}.")
-                scp.get(source, destination)
-                fileList.append(filename)
-                time.sleep(.2)
+    fileList=[f"EC_{statsType}_{subband}.dat" for statsType in statsList for subband in subBands]
+    # One SCP session for the whole set rather than a new SCPClient per file.
+    print(f"SCP {len(fileList)} files from /tmp to {path}.")
+    with SCPClient(ssh.get_transport()) as scp:
+        scp.get([f"/tmp/{filename}" for filename in fileList], path)
     return fileList
 
 
@@ -577,6 +590,7 @@ def data_crunch(path):
     VoP = .87    #Velocity of Propagation  87% for P3 hardline , 82% for RG6
     SoL = 299792458*3.28084  # Speed of light in a vaccum in feet/sec
     SolCoax = VoP*SoL  # feet/sec
+    engine = tdr.TdrEngine(vop=VoP, bin_spacing=fSamp)
     timestamp = datetime.now().strftime('%Y_%m_%d_%Hh%Mm%Ss')
     ampinfo.append(timestamp)
 
@@ -624,65 +638,41 @@ def data_crunch(path):
         freqLength = psdFreq_array.size
 
         # EC coeficients.  creates an array of complex #s from the array of number pairs
-        complex_EC_freq = np.array([complex(a, b) for a, b in EC_freq])
+        complex_EC_freq = EC_freq[:, 0] + 1j*EC_freq[:, 1]
         linMag_EC_freq = np.abs(complex_EC_freq)
-        for i,element in enumerate(linMag_EC_freq):
-            if element < 1e-6:
-                linMag_EC_freq[i]=linMag_EC_freq[i]+1e-6
+        linMag_EC_freq = np.where(linMag_EC_freq < 1e-6, linMag_EC_freq + 1e-6, linMag_EC_freq)
         EC_freq_dB = 20.0*np.log10(linMag_EC_freq)
 
 
         ###### This is using the EC filter coeficients vs Freq. to obtain the inpulse response of the South Port Network Segment + internal echo
-        complex_EC_impulse = np.fft.ifft(complex_EC_freq,norm='backward')
+        complex_EC_impulse = engine.impulse([complex_EC_freq])[0]
         tcp_impulse = np.sum(np.abs(complex_EC_impulse))
         tcp_impulse_db = 20.0*np.log10(tcp_impulse)
 
         length=len(complex_EC_impulse)
-        timeStep = (timeSpan/length)
-        timeMax = timeSpan - timeStep
-        timeArray = np.arange(0,timeMax,timeStep)  # round trip time array, starting at 0, incrementing by deltaT
-        if len(timeArray) == 955:
-            timeArray = np.append(timeArray,timeMax)
-#        timeArray.append(timeMax+timeStep)  # round trip time array, starting at 0, incrementing by deltaT.  add this for 96MHz subband
-        mag_EC_impulse =20.0*np.log10(np.abs(complex_EC_impulse)) # array of impulse response mag(dB)
+        # round trip time array, starting at 0, one bin per impulse sample (timeSpan/length)
+        timeArray = engine.rtt_us(length)*1e-6
+        mag_EC_impulse = engine.db(complex_EC_impulse) # array of impulse response mag(dB)
         timeLength = mag_EC_impulse.size
 
 
 
     ################################## finding a collection of peaks in the impulse response
-        impulse_peaks =find_peaks(mag_EC_impulse,height=minpeak)  #index[0] is location array, [1] is the values array
-        while impulse_peaks[0].size == 0:
+        impulse_peaks = find_peaks(mag_EC_impulse,height=minpeak)[0]  # peak locations
+        while impulse_peaks.size == 0:
             minpeak = minpeak - 3.0
-            impulse_peaks =find_peaks(mag_EC_impulse,height=minpeak)
-        # ampLaunchTime = timeArray[impulse_peaks[0][0]]   #1st peak in the peak location array is the amp launch
+            impulse_peaks = find_peaks(mag_EC_impulse,height=minpeak)[0]
+        # ampLaunchTime = timeArray[impulse_peaks[0]]   #1st peak in the peak location array is the amp launch
         ampLaunchTime = 0.198744769874477e-6 # fixed offset per BCM 0.194uS but set to closest time bin location
-        timeNormArray = (timeArray - ampLaunchTime)/2  # this is 1/2 the round trip time array values normalized to the Amp South Port launch time
-        distFtNormArray = timeNormArray*SolCoax
-
-        impulse_peaks_time = []
-        impulse_peaks_feet = []
-        impulse_peaks_delta_feet = []
-        impulse_peaks_dB = []
-
-
-        for i in impulse_peaks[0]:
-            impulse_peaks_time.append(timeArray[i])
-            impulse_peaks_feet.append(distFtNormArray[i])
-            impulse_peaks_dB.append(mag_EC_impulse[i])
-
-        # lists to arrays
-        impulse_peaks_time = np.asarray(impulse_peaks_time)
-        impulse_peaks_feet = np.asarray(impulse_peaks_feet)
-        impulse_peaks_dB = np.asarray(impulse_peaks_dB)
+        timeNormArray = engine.one_way_us(length, ampLaunchTime)*1e-6  # this is 1/2 the round trip time array values normalized to the Amp South Port launch time
+        distFtNormArray = engine.distance_ft(length, ampLaunchTime)
 
-        #create the list of interspan lengths then cast as array
-        for i in range(len(impulse_peaks_feet)):
-            if i == 0:
-                impulse_peaks_delta_feet.append(impulse_peaks_feet[i])
-            else:
-                impulse_peaks_delta_feet.append(impulse_peaks_feet[i] - impulse_peaks_feet[i-1])
+        impulse_peaks_time = timeArray[impulse_peaks]
+        impulse_peaks_feet = distFtNormArray[impulse_peaks]
+        impulse_peaks_dB = mag_EC_impulse[impulse_peaks]
 
-        impulse_peaks_delta_feet = np.asarray(impulse_peaks_delta_feet)
+        #interspan lengths: first peak's total distance, then the distance between consecutive peaks
+        impulse_peaks_delta_feet = np.diff(impulse_peaks_feet, prepend=0.0)
 
 
         ##### build out final time arrays and cast as dataframe record to archive as excel file.....1st Tab for this time data.
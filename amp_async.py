@@ -0,0 +1,193 @@
+# Asyncio Amplifier Driver
+# Version: 1.0
+#
+# Description:
+# Drives many amplifiers from one process. AsyncAmp exposes the same
+# operations as AmpControl (jumpbox connect, HAL/RF board commands, file
+# fetch) as coroutines; the blocking paramiko work runs in a thread pool so
+# one event loop can keep dozens of SSH sessions busy at once. run_fleet()
+# applies a concurrency limit, so a node sweep takes about as long as the
+# slowest amp instead of the sum of all of them. All amps share one pooled
+# jumpbox transport (jumpbox_pool).
+#
+# Example (one status dump per amp, eight amps at a time):
+#   python amp_async.py --image CC --ip 2001:558:6043:3f::1 --ip 2001:558:6043:3f::2
+#   python amp_async.py --image CS --amp-info --concurrency 8
+
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scp import SCPClient
+
+import amp_config_manager
+import amp_library
+import jumpbox_pool
+
+
+class AsyncAmp:
+    """asyncio front end for one amplifier.
+
+    Each coroutine runs the matching blocking call in the event loop's executor.
+    Shell commands for one amp are serialised by a lock, because they share one
+    interactive shell; different amps run in parallel.
+    """
+    def __init__(self, image, hostname, config=None, no_jump=False, name=None):
+        self.image = image
+        self.hostname = hostname
+        self.config = config or amp_config_manager.CONFIGURATIONS[image]
+        self.no_jump = no_jump
+        self.name = name or hostname
+        self.amp = amp_library.AMP_CLASSES[image]()
+        self.target_client = None
+        self.session = None
+        self._shell_lock = asyncio.Lock()
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def _run_shell(self, func, *args, **kwargs):
+        async with self._shell_lock:
+            return await self._run(func, *args, **kwargs)
+
+    def _connect(self):
+        self.target_client = jumpbox_pool.connect_target(self.config, self.hostname, self.no_jump)
+        self.session = amp_library.AmpSession(self.target_client.invoke_shell())
+        self.session.settimeout(1000)
+
+    @property
+    def transport(self):
+        return self.target_client.get_transport() if self.target_client else None
+
+    async def connect(self):
+        await self._run(self._connect)
+        logging.debug(f"[{self.name}] Connected.")
+        return self
+
+    async def hal(self, command, prompt=">", wait_time=10):
+        return await self._run_shell(self.amp.hal_comm, self.session, command, prompt, wait_time)
+
+    async def rf(self, command, prompt=None, wait_time=10):
+        if prompt is None:
+            return await self._run_shell(self.amp.rf_comm, self.session, command, wait_time=wait_time)
+        return await self._run_shell(self.amp.rf_comm, self.session, command, prompt, wait_time)
+
+    async def hal_batch(self, commands, wait_time=None):
+        return await self._run_shell(self.amp.hal_batch, self.session, commands, wait_time)
+
+    async def hal_parallel(self, commands, wait_time=10):
+        return await self._run_shell(self.amp.hal_parallel, self.transport, self.session, commands, wait_time)
+
+    async def rf_parallel(self, commands, wait_time=10):
+        return await self._run_shell(self.amp.rf_parallel, self.transport, self.session, commands, wait_time)
+
+    def _fetch(self, remote_path, local_path):
+        with SCPClient(self.transport) as scp_client:
+            scp_client.get(remote_path, local_path)
+        return local_path
+
+    async def fetch(self, remote_path, local_path):
+        """Copies one file from the amp; runs alongside shell commands on its own channel."""
+        return await self._run(self._fetch, remote_path, local_path)
+
+    def _close(self):
+        if self.session: self.session.close()
+        if self.target_client: self.target_client.close()
+
+    async def close(self):
+        await self._run(self._close)
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+async def run_fleet(amps, job, concurrency=8):
+    """Connects to each AsyncAmp, awaits job(amp) and closes it, at most `concurrency` at a time.
+
+    Returns {amp.name: result}; an amp that failed maps to its exception instead
+    of stopping the sweep.
+    """
+    loop = asyncio.get_running_loop()
+    # Each connected amp can tie up a worker thread per blocking call.
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max(concurrency * 2, 4)))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(amp):
+        async with semaphore:
+            start_time = time.time()
+            try:
+                async with amp:
+                    return await job(amp)
+            finally:
+                logging.info(f"[{amp.name}] Finished in {time.time() - start_time:.1f} s.")
+
+    try:
+        results = await asyncio.gather(*(run_one(amp) for amp in amps), return_exceptions=True)
+    finally:
+        jumpbox_pool.close_all()
+    for amp, result in zip(amps, results):
+        if isinstance(result, Exception):
+            logging.error(f"[{amp.name}] Failed: {result}")
+    return {amp.name: result for amp, result in zip(amps, results)}
+
+
+async def collect_status(amp, path):
+    """Example job: writes the amp's rfboard and HAL status dumps under path/<name>/."""
+    out_dir = os.path.join(path, amp.name.replace(":", "_"))
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for kind, commands, runner in (('rfboard', amp.config['rfboard_commands'], amp.rf_parallel),
+                                   ('hal', amp.config['hal_commands'], amp.hal_parallel)):
+        if not commands:
+            continue
+        ret = "".join(await runner(commands))
+        filename = os.path.join(out_dir, f"{kind}{amp.config['result_filename_appendix']}.txt")
+        with open(filename, 'w') as f:
+            f.write('\n'.join(line.strip() for line in ret.splitlines() if line.strip()))
+        written.append(filename)
+    return written
+
+
+def amp_info_targets():
+    """Returns (hostname, name) pairs from config.amp_info (one entry or a list of entries)."""
+    import config
+    entries = config.amp_info if config.amp_info and isinstance(config.amp_info[0], (list, tuple)) else [config.amp_info]
+    return [(entry[0], entry[-1]) for entry in entries if entry and entry[0]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a status sweep over many FDX amps from one process.')
+    parser.add_argument('--image', type=str, choices=sorted(amp_library.AMP_CLASSES), required=True,
+                        help='Image type of every amp in the sweep.')
+    parser.add_argument('--ip', action='append', default=[], help='Amp IP address. Repeat for each amp.')
+    parser.add_argument('--amp-info', action='store_true', help='Also sweep the amp_info entries in config.py.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum number of amps driven at once.')
+    parser.add_argument('--no-jump', action='store_true', help='Connect directly instead of via the jumpbox.')
+    parser.add_argument('--path', type=str, default='./out/fleet', help='Output directory.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    targets = [(ip, ip) for ip in args.ip]
+    if args.amp_info:
+        targets += amp_info_targets()
+    if not targets:
+        parser.error("No amps given; use --ip and/or --amp-info.")
+
+    amps = [AsyncAmp(args.image, hostname, no_jump=args.no_jump, name=name) for hostname, name in targets]
+    results = asyncio.run(run_fleet(amps, functools.partial(collect_status, path=args.path), args.concurrency))
+    failed = [name for name, result in results.items() if isinstance(result, Exception)]
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
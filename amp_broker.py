@@ -0,0 +1,382 @@
+# Amp Session Broker
+# Version: 1.1
+# v1.1: Forwards file_checksums (remote MD5 probe used by cal_cache.py), file_sizes and remove_files.
+#
+# Description:
+# Long-lived local process that owns authenticated amp sessions (jumpbox
+# transport, amp SSH client, interactive shell) and serves them over a Unix
+# socket. ec.py and ds.py started with --broker attach to the session instead
+# of connecting themselves, so back-to-back captures on the same amp pay the
+# jumpbox and amp login once. The broker exits after --idle-timeout seconds
+# without requests.
+#
+# Protocol: one JSON object per line in each direction.
+#   request:  {"op": "hal_comm", "session": {...}, "args": [...], "kwargs": {...}}
+#   response: {"ok": true, "result": ...} or {"ok": false, "type": "TimeoutError", "error": "..."}
+#
+# Usage:
+#   python amp_broker.py serve [--socket PATH] [--idle-timeout 600]
+#   python amp_broker.py status | stop
+
+import argparse
+import base64
+import getpass
+import json
+import logging
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from scp import SCPClient, SCPException
+
+import amp_library
+import jumpbox_pool
+import timing_profile
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f"amp_broker_{getpass.getuser()}.sock")
+IDLE_TIMEOUT = 600  # seconds
+
+# Operations forwarded to the amp object: name -> the session handles it takes before its own arguments.
+SESSION_OPS = {'hal_comm': ('channel',), 'rf_comm': ('channel',), 'hal_batch': ('channel',),
+               'hal_parallel': ('transport', 'channel'), 'rf_parallel': ('transport', 'channel'),
+               'fetch_files': ('transport',), 'read_file': ('transport',), 'file_checksums': ('transport',),
+               'file_sizes': ('transport',), 'remove_files': ('transport',)}
+# Connection settings a client sends to identify (and if needed open) a session.
+SESSION_KEYS = ('image', 'host', 'no_jump', 'jumpbox_hostname', 'jumpbox_username',
+                'target_username', 'target_password')
+# Exceptions re-raised on the client side with their original type.
+ERROR_TYPES = {'TimeoutError': TimeoutError, 'ConnectionError': ConnectionError,
+               'SCPException': SCPException, 'NotImplementedError': NotImplementedError,
+               'KeyError': KeyError, 'ValueError': ValueError, 'FileNotFoundError': FileNotFoundError}
+
+
+class BrokerSession:
+    """One authenticated amp: SSH client, tracked interactive shell and amp controller."""
+    def __init__(self, spec):
+        self.spec = spec
+        self.amp = amp_library.AMP_CLASSES[spec['image']]()
+        self.amp.timing = timing_profile.TimingProfile(image=spec['image'])
+        self.target_client = jumpbox_pool.connect_target(spec, spec['host'], spec['no_jump'])
+        self.channel = amp_library.AmpSession(self.target_client.invoke_shell())
+        self.channel.settimeout(1000)
+        self.lock = threading.Lock()
+
+    @property
+    def transport(self):
+        return self.target_client.get_transport()
+
+    def is_active(self):
+        transport = self.transport
+        return transport is not None and transport.is_active() and not self.channel.closed
+
+    def get(self, remote_path, local_path):
+        with SCPClient(self.transport) as scp_client:
+            scp_client.get(remote_path, local_path)
+        return local_path
+
+    def close(self):
+        self.channel.close()
+        self.target_client.close()
+        self.amp.timing.save()
+
+
+class AmpBroker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix-socket server keeping amp sessions alive between client scripts."""
+    daemon_threads = True
+
+    def __init__(self, socket_path, idle_timeout=IDLE_TIMEOUT):
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        self.idle_timeout = idle_timeout
+        self.last_request = time.time()
+        self.active_clients = 0
+        super().__init__(socket_path, BrokerHandler)
+
+    def server_bind(self):
+        # The socket carries amp credentials: create it owner-only, with no window before a chmod.
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+
+    def session(self, spec):
+        key = tuple(spec[k] for k in SESSION_KEYS)
+        with self.sessions_lock:
+            session = self.sessions.get(key)
+            if session is not None and not session.is_active():
+                logging.info(f"Session to {spec['host']} dropped; reconnecting.")
+                self.sessions.pop(key).close()
+                session = None
+            if session is None:
+                logging.info(f"Opening session to {spec['host']} ({spec['image']}).")
+                session = self.sessions[key] = BrokerSession(spec)
+            return session
+
+    def drop_session(self, spec):
+        key = tuple(spec[k] for k in SESSION_KEYS)
+        with self.sessions_lock:
+            session = self.sessions.pop(key, None)
+        if session:
+            session.close()
+        return session is not None
+
+    def dispatch(self, request):
+        op = request['op']
+        if op == 'ping':
+            return os.getpid()
+        if op == 'sessions':
+            with self.sessions_lock:
+                return [{'image': s.spec['image'], 'host': s.spec['host'], 'mode': s.channel.mode}
+                        for s in self.sessions.values()]
+        if op == 'shutdown':
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return True
+        if op == 'close_session':
+            return self.drop_session(request['session'])
+        if op != 'get' and op not in SESSION_OPS:
+            raise ValueError(f"Unknown broker operation '{op}'")
+        session = self.session(request['session'])
+        args, kwargs = request.get('args', []), request.get('kwargs', {})
+        with session.lock:
+            try:
+                if op == 'get':
+                    return session.get(*args, **kwargs)
+                if op == 'read_file':  # bytes travel base64-encoded
+                    return base64.b64encode(session.amp.read_file(session.transport, *args, **kwargs)).decode()
+                handles = [getattr(session, name) for name in SESSION_OPS[op]]
+                return getattr(session.amp, op)(*handles, *args, **kwargs)
+            except ConnectionError:
+                self.drop_session(request['session'])
+                raise
+
+    def watch_idle(self):
+        while True:
+            time.sleep(5)
+            if self.active_clients == 0 and time.time() - self.last_request > self.idle_timeout:
+                logging.info("Broker idle; shutting down.")
+                self.shutdown()
+                return
+
+    def close_all(self):
+        with self.sessions_lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
+        jumpbox_pool.close_all()
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.active_clients += 1
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                self.server.last_request = time.time()
+                try:
+                    response = {'ok': True, 'result': self.server.dispatch(json.loads(line))}
+                except Exception as e:
+                    logging.debug(f"Broker request failed: {e}", exc_info=True)
+                    response = {'ok': False, 'type': type(e).__name__, 'error': str(e)}
+                self.wfile.write((json.dumps(response) + "\n").encode())
+                self.wfile.flush()
+                self.server.last_request = time.time()
+        finally:
+            self.server.active_clients -= 1
+
+
+class BrokerClient:
+    """Connection to a running broker; request() returns the result or re-raises the remote error."""
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=None):
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.rfile = self.sock.makefile('rb')
+        self._lock = threading.Lock()
+
+    def request(self, op, **params):
+        # Sets (ds.py builds its command lists as sets) travel as lists.
+        payload = (json.dumps(dict(params, op=op), default=list) + "\n").encode()
+        with self._lock:
+            self.sock.sendall(payload)
+            line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("Broker closed the connection")
+        response = json.loads(line)
+        if response['ok']:
+            return response['result']
+        error_type = ERROR_TYPES.get(response['type'])
+        if error_type is None:
+            raise RuntimeError(f"{response['type']}: {response['error']}")
+        raise error_type(response['error'])
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+class BrokerSCP:
+    """SCPClient stand-in that fetches through the broker's session."""
+    def __init__(self, broker_amp):
+        self.broker_amp = broker_amp
+
+    def get(self, remote_path, local_path='', recursive=False, preserve_times=False):
+        return self.broker_amp.fetch(remote_path, local_path or os.path.basename(remote_path))
+
+    def close(self):
+        pass
+
+
+class BrokerAmp:
+    """Drop-in replacement for an AmpControl instance whose commands run in the broker.
+
+    The channel/transport arguments of the usual call signatures are accepted and
+    ignored; the broker supplies its own. Anything else (parsing helpers such as
+    complex_to_mag_db) comes from a local instance of the amp class.
+    """
+    def __init__(self, client, image, hostname, config, no_jump=False):
+        self.client = client
+        self.local = amp_library.AMP_CLASSES[image]()
+        self.session = {'image': image, 'host': hostname, 'no_jump': bool(no_jump),
+                        'jumpbox_hostname': config.get('jumpbox_hostname'),
+                        'jumpbox_username': config.get('jumpbox_username'),
+                        'target_username': config['target_username'],
+                        'target_password': config['target_password']}
+
+    def request(self, op, *args, **kwargs):
+        return self.client.request(op, session=self.session, args=list(args), kwargs=kwargs)
+
+    def hal_comm(self, channel, *args, **kwargs):
+        return self.request('hal_comm', *args, **kwargs)
+
+    def rf_comm(self, channel, *args, **kwargs):
+        return self.request('rf_comm', *args, **kwargs)
+
+    def hal_batch(self, channel, *args, **kwargs):
+        return self.request('hal_batch', *args, **kwargs)
+
+    def hal_parallel(self, transport, channel, *args, **kwargs):
+        return self.request('hal_parallel', *args, **kwargs)
+
+    def rf_parallel(self, transport, channel, *args, **kwargs):
+        return self.request('rf_parallel', *args, **kwargs)
+
+    def fetch_files(self, transport, files, *args, **kwargs):
+        files = dict(files)
+        fetched = self.request('fetch_files', {remote: os.path.abspath(local) for remote, local in files.items()},
+                               *args, **kwargs)
+        return {remote: files[remote] for remote in fetched}
+
+    def read_file(self, transport, *args, **kwargs):
+        return base64.b64decode(self.request('read_file', *args, **kwargs))
+
+    def file_checksums(self, transport, *args, **kwargs):
+        return self.request('file_checksums', *args, **kwargs)
+
+    def file_sizes(self, transport, *args, **kwargs):
+        return self.request('file_sizes', *args, **kwargs)
+
+    def remove_files(self, transport, *args, **kwargs):
+        return self.request('remove_files', *args, **kwargs)
+
+    def fetch(self, remote_path, local_path):
+        # The broker writes the file itself, so relative paths are resolved here.
+        return self.request('get', remote_path, os.path.abspath(local_path))
+
+    def scp_client(self):
+        return BrokerSCP(self)
+
+    def close_session(self):
+        return self.client.request('close_session', session=self.session)
+
+    def __getattr__(self, name):
+        return getattr(self.local, name)
+
+
+def ping(socket_path=DEFAULT_SOCKET):
+    """Returns the broker's pid, or None if no broker answers on socket_path."""
+    try:
+        client = BrokerClient(socket_path, timeout=2)
+    except OSError:
+        return None
+    try:
+        return client.request('ping')
+    except (OSError, ConnectionError):
+        return None
+    finally:
+        client.close()
+
+
+def ensure_broker(socket_path=DEFAULT_SOCKET, idle_timeout=IDLE_TIMEOUT, wait_time=10):
+    """Starts a detached broker on socket_path unless one is already running; returns its pid."""
+    pid = ping(socket_path)
+    if pid:
+        return pid
+    logging.debug(f"Starting amp broker on {socket_path}")
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', '--socket', socket_path,
+                      '--idle-timeout', str(idle_timeout)],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+    deadline = time.time() + wait_time
+    while time.time() < deadline:
+        pid = ping(socket_path)
+        if pid:
+            return pid
+        time.sleep(0.1)
+    raise TimeoutError(f"Amp broker did not start on {socket_path}")
+
+
+def serve(socket_path=DEFAULT_SOCKET, idle_timeout=IDLE_TIMEOUT):
+    if os.path.exists(socket_path):
+        if ping(socket_path):
+            logging.error(f"A broker is already running on {socket_path}")
+            sys.exit(1)
+        os.unlink(socket_path)  # Left behind by a broker that did not shut down cleanly.
+    server = AmpBroker(socket_path, idle_timeout)
+    threading.Thread(target=server.watch_idle, daemon=True).start()
+    logging.info(f"Amp broker listening on {socket_path} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.close_all()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local broker keeping amp SSH sessions open between scripts.')
+    parser.add_argument('action', choices=['serve', 'status', 'stop'])
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET, help='Unix socket path.')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help='Seconds without requests before the broker exits.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.action == 'serve':
+        serve(args.socket, args.idle_timeout)
+        return
+    if not ping(args.socket):
+        print(f"No broker running on {args.socket}")
+        sys.exit(1)
+    client = BrokerClient(args.socket)
+    if args.action == 'status':
+        for session in client.request('sessions'):
+            print(f"{session['image']} {session['host']} mode={session['mode']}")
+    else:
+        client.request('shutdown')
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,98 @@
 # Unified Amplifier Control Library
-# Version: 1.0
+# Version: 1.9
 #
 # Description:
 # This library provides a class-based structure for controlling different
 # types of amplifiers. A base class, AmpControl, defines the common interface,
 # while subclasses (CommscopeAmp, ComcastAmp, SercommAmp) implement the
 # specific SSH command sequences for each device.
+#
+# v1.1: Replaced the fixed 0.5 s sleep/poll loops in hal_comm/rf_comm with a
+#       shared expect engine. AmpControl now waits on the channel with select()
+#       and matches compiled prompt regexes against an incremental buffer, so a
+#       command returns as soon as its prompt arrives. Each subclass describes
+#       its CLI as a target prompt plus an ordered table of (prompt, reply) steps.
+# v1.2: Added AmpSession, a wrapper for the invoke_shell() channel that tracks
+#       the CLI mode (root, FDX-AMP, hal, rfboard/rf-components, clish) so that
+#       mode transitions are only issued when the next command needs them.
+# v1.3: Added hal_batch() to send several HAL commands in one write, split the
+#       response on unique echo sentinels and return per-command outputs.
+# v1.4: Added an exec-channel backend (exec_commands, rf_parallel, hal_parallel)
+#       that runs independent commands concurrently on one transport for amps
+#       with a root shell, falling back to the interactive shell otherwise.
+#       State-changing RF board commands (rf_parallel setup=) run first, in order.
+# v1.5: Added fetch_files() to retrieve many remote files in one stream: a tar
+#       archive over an exec channel on root-shell amps, otherwise a single
+#       multi-file SCP session.
+# v1.6: Added read_file() to read a remote file straight into memory (cat on an
+#       exec channel for root-shell amps, SCP otherwise), and remove_files() to
+#       delete stale remote dumps before they are rewritten.
+# v1.7: Optional TimingProfile (timing_profile.py): command latencies are
+#       recorded and timeouts are derived from observed percentiles; a command
+#       that times out is recorded too, so the learned timeout can grow back.
+# v1.8: complex_to_mag_db() is vectorised with NumPy.
+# v1.9: Added file_checksums() to probe remote files with one md5sum on an exec
+#       channel (used by cal_cache.py to skip unchanged calibration downloads),
+#       and file_sizes() (one wc -c, used by wbfft_scheduler.py to see when a
+#       capture's dump is complete).
 
 import time
 import re
+import codecs
+import select
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+import os
+import posixpath
+import shlex
+import shutil
+import tarfile
+import tempfile
 import numpy as np
+from scp import SCPClient, SCPException
 import logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class AmpControl:
+    # Bytes requested per recv() once the channel is readable.
+    RECV_SIZE = 128000
+    # Tail of the buffer that is re-scanned when new data arrives, so a prompt
+    # split across two recv() calls is still matched.
+    MATCH_OVERLAP = 256
+    # A blank line is sent if the amp has been silent this long while we wait
+    # (the old loops sent one every 0.5 s unconditionally).
+    NUDGE_INTERVAL = 0.5
+    # After a prompt matches, keep reading until the channel is quiet this long
+    # so trailing output is not left behind for the next command.
+    SETTLE_TIME = 0.05
+
+    # Whether RF board / HAL commands can run on exec channels, i.e. the login
+    # lands in a root shell rather than an interactive-only CLI. A root shell
+    # also lets fetch_files() stream files as a tar archive.
+    RF_EXEC = False
+    HAL_EXEC = False
+    # Concurrent exec channels opened by exec_commands().
+    EXEC_WORKERS = 4
+
+    # Optional timing_profile.TimingProfile. When set, command latencies are
+    # recorded and wait_time budgets shrink to what this image/firmware needs.
+    timing = None
+
+    # Per-amp CLI description, filled in by the subclasses: PROMPTS is an
+    # ordered sequence of (mode, compiled prompt), highest priority first, and
+    # the *_TRANSITIONS dicts map a mode to the reply that leads towards
+    # HAL_MODE / RF_MODE.
+    PROMPTS = ()
+    HAL_MODE = None
+    HAL_TRANSITIONS = {}
+    RF_MODE = None
+    RF_TRANSITIONS = {}
+
     def complex_to_mag_db(self, real, imag):
         """Converts complex data (real and imaginary parts) to magnitude in dB."""
-        data = []
-        for re, im in zip(real,imag):
-            # Calculate magnitude using Euclidean distance (sqrt(real^2 + imag^2))
-            magnitude = np.sqrt(re**2 + im**2)
-            # Convert magnitude to dB (20 * log10(magnitude))
-            magnitude_db = 20 * np.log10(magnitude)
-            data.append(magnitude_db)
-        return data
+        # Magnitude is the Euclidean distance sqrt(real^2 + imag^2); 20*log10 of it, over the whole array at once.
+        with np.errstate(divide='ignore'):
+            return list(20 * np.log10(np.hypot(np.asarray(real, dtype=float), np.asarray(imag, dtype=float))))
     def split_list_in_half(self, lst):
         """Splits a list into two halves."""
         midpoint = len(lst) // 2  # Use floor division to get the middle index
@@ -37,6 +106,471 @@ class AmpControl:
             time.sleep(wait_time)
         return channel.recv(4096).decode("utf-8")
 
+    # --- Expect engine ---
+    def _as_pattern(self, prompt):
+        """Accepts a literal prompt string or an already compiled regex."""
+        if hasattr(prompt, "search"):
+            return prompt
+        return re.compile(re.escape(prompt))
+
+    def _wait_readable(self, channel, timeout):
+        """Blocks until the channel has data to read or the timeout expires."""
+        if channel.recv_ready():
+            return True
+        timeout = max(timeout, 0)
+        try:
+            readable, _, _ = select.select([channel], [], [], timeout)
+        except (TypeError, ValueError, OSError):
+            # Channel-like objects without a selectable fileno() get a short poll.
+            time.sleep(min(timeout, 0.01))
+            return channel.recv_ready()
+        return bool(readable) or channel.recv_ready()
+
+    def _drain(self, channel, decoder, quiet):
+        """Reads whatever the channel still has until it stays quiet for `quiet` seconds."""
+        output = ""
+        while self._wait_readable(channel, quiet):
+            chunk = channel.recv(self.RECV_SIZE)
+            if not chunk:
+                break
+            output += decoder.decode(chunk)
+        return output
+
+    def _expect(self, channel, patterns, timeout, nudge=None, context="prompt"):
+        """Reads from the channel until one of the compiled patterns matches.
+
+        Wakes on channel events rather than sleeping on a fixed poll, and only
+        re-scans the new tail of the buffer. Returns (index of the first pattern
+        that matched, output). Raises TimeoutError if none matches in time.
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        output = ""
+        scan_from = 0
+        deadline = time.time() + timeout
+        last_activity = time.time()
+        while True:
+            now = time.time()
+            if now >= deadline:
+                raise TimeoutError(f"Timeout waiting for {context}")
+            wait = deadline - now
+            if nudge is not None:
+                wait = min(wait, max(last_activity + nudge - now, 0))
+            if self._wait_readable(channel, wait):
+                chunk = channel.recv(self.RECV_SIZE)
+                if not chunk:
+                    raise ConnectionError(f"Channel closed while waiting for {context}")
+                output += decoder.decode(chunk)
+                last_activity = time.time()
+                for index, pattern in enumerate(patterns):
+                    if pattern.search(output, scan_from):
+                        return index, output + self._drain(channel, decoder, self.SETTLE_TIME)
+                scan_from = max(0, len(output) - self.MATCH_OVERLAP)
+            elif nudge is not None and time.time() - last_activity >= nudge:
+                channel.send('\r\n')
+                last_activity = time.time()
+
+    def _set_mode(self, channel, mode):
+        """Records the CLI mode on an AmpSession; raw channels are left alone."""
+        if isinstance(channel, AmpSession):
+            channel.mode = mode
+
+    def _last_mode(self, output):
+        """Returns the mode whose prompt appears last in the output, or None."""
+        tail = output[-4 * self.MATCH_OVERLAP:]
+        last_mode, last_pos = None, -1
+        for mode, pattern in self.PROMPTS:
+            for match in pattern.finditer(tail):
+                if match.start() > last_pos:
+                    last_mode, last_pos = mode, match.start()
+        return last_mode
+
+    def _walk_to(self, channel, target_mode, transitions, deadline, command):
+        """Answers whatever prompt the CLI shows until it reaches the target mode.
+
+        `transitions` maps a mode to the reply that moves the CLI one step towards
+        the target; when several prompts are in the output, PROMPTS order decides,
+        as the old if/elif chains did. An AmpSession already in the target mode
+        skips the walk, and one in a known mode sends its reply without probing.
+        """
+        current = channel.mode if isinstance(channel, AmpSession) else None
+        if current is not None:
+            # Drop late output (e.g. prompts answering a nudge) so it is not
+            # mistaken for the reply to what we send next.
+            self._drain(channel, codecs.getincrementaldecoder("utf-8")(errors="replace"), 0)
+        if current == target_mode:
+            return ""
+        prompts = dict(self.PROMPTS)
+        target = prompts[target_mode]
+        patterns = [target] + [pattern for mode, pattern in self.PROMPTS if mode in transitions]
+        try:
+            channel.send(transitions.get(current, '\r\n'))
+            while True:
+                _, output = self._expect(channel, patterns, deadline - time.time(), nudge=self.NUDGE_INTERVAL,
+                                         context=f"prompt '{target.pattern}' before command '{command}'")
+                if target.search(output):
+                    self._set_mode(channel, target_mode)
+                    return output
+                for mode, pattern in self.PROMPTS:
+                    if mode in transitions and pattern.search(output):
+                        channel.send(transitions[mode])
+                        break
+        except Exception:
+            self._set_mode(channel, None)
+            raise
+
+    def _deadline(self, wait_time):
+        """Absolute deadline for the mode walk plus a command (wait_time, never shortened)."""
+        return time.time() + wait_time
+
+    def _send_command(self, channel, line, prompt, command, deadline, mode, nudge=None):
+        """Sends one command line and returns its output once the prompt arrives.
+
+        On an AmpSession the mode prompt must also come back before the session
+        trusts its mode; a command prompt such as "InputPower" can match before
+        the CLI has finished printing. The timing profile may shorten the wait,
+        but only for the command itself: the latency it learns from starts here,
+        after any mode walk.
+        """
+        try:
+            start_time = time.time()
+            if self.timing is not None:
+                deadline = start_time + self.timing.timeout(command, deadline - start_time)
+            channel.send(line)
+            _, output = self._expect(channel, [self._as_pattern(prompt)], deadline - time.time(), nudge=nudge,
+                                     context=f"prompt '{prompt}' after command '{command}'")
+        except Exception as e:
+            self._set_mode(channel, None)
+            if self.timing is not None and isinstance(e, TimeoutError):
+                self.timing.record_timeout(command, time.time() - start_time)
+            raise
+        if self.timing is not None:
+            self.timing.record(command, time.time() - start_time)
+        if isinstance(channel, AmpSession):
+            current = self._last_mode(output)
+            if current is None:
+                try:
+                    _, rest = self._expect(channel, [pattern for _, pattern in self.PROMPTS], deadline - time.time(),
+                                           nudge=nudge, context=f"mode prompt after command '{command}'")
+                    output += rest
+                    current = self._last_mode(output)
+                except (TimeoutError, ConnectionError):
+                    logging.debug(f"No mode prompt after command '{command}'; session mode is now unknown.")
+            self._set_mode(channel, current)
+        return output
+
+    # --- Batched HAL commands ---
+    def _hal_line(self, command):
+        """Line typed at the HAL prompt to run a command."""
+        return f'{command} \r\n'
+
+    def _sentinel_line(self, token):
+        """Line whose echo marks a boundary in a batch; the HAL CLI echoes typed input."""
+        return f'{token}\r\n'
+
+    def _split_on_sentinels(self, output, tokens):
+        """Splits a batch response into the text between consecutive sentinels."""
+        lines = output.splitlines(keepends=True)
+        segments = []
+        for opening, closing in zip(tokens, tokens[1:]):
+            # A sentinel may show up twice (echo, then an "unknown command" or
+            # echo reply), so a segment starts after its last mention.
+            first_close = next((i for i, line in enumerate(lines) if closing in line), None)
+            last_open = max((i for i, line in enumerate(lines[:first_close]) if opening in line), default=None)
+            if first_close is None or last_open is None:
+                logging.warning(f"Batch sentinel {opening}/{closing} missing from HAL output.")
+                segments.append("")
+                continue
+            segments.append("".join(lines[last_open + 1:first_close]))
+        return segments
+
+    def hal_batch(self, channel, commands, wait_time=None):
+        """Runs several HAL commands with one write and returns their outputs in order.
+
+        The commands are interleaved with unique sentinel lines and sent together;
+        the response stream is split back on the sentinels. This replaces one
+        prompt wait per command (e.g. hal_comm(..., "InputPower") for each status
+        dump) with a single round trip. wait_time defaults to 10 s per command.
+        """
+        commands = list(commands)
+        if not commands:
+            return []
+        if wait_time is None:
+            wait_time = 10 * len(commands)
+        deadline = time.time() + wait_time
+        self._walk_to(channel, self.HAL_MODE, self.HAL_TRANSITIONS, deadline, commands[0])
+
+        batch_id = uuid.uuid4().hex[:8]
+        tokens = [f"__fdx_batch_{batch_id}_{i}__" for i in range(len(commands) + 1)]
+        lines = [self._sentinel_line(tokens[0])]
+        for command, token in zip(commands, tokens[1:]):
+            lines.append(self._hal_line(command))
+            lines.append(self._sentinel_line(token))
+        context = f"end of batch starting with '{commands[0]}'"
+        mode_prompt = dict(self.PROMPTS)[self.HAL_MODE]
+        try:
+            channel.send("".join(lines))
+            _, output = self._expect(channel, [re.compile(re.escape(tokens[-1]))], deadline - time.time(),
+                                     nudge=self.NUDGE_INTERVAL, context=context)
+            # The closing sentinel is echoed before the CLI prints its prompt again.
+            if not mode_prompt.search(output, output.rfind(tokens[-1])):
+                _, rest = self._expect(channel, [mode_prompt], deadline - time.time(),
+                                       nudge=self.NUDGE_INTERVAL, context=context)
+                output += rest
+        except Exception:
+            self._set_mode(channel, None)
+            raise
+        self._set_mode(channel, self.HAL_MODE)
+        return self._split_on_sentinels(output, tokens)
+
+    # --- Exec-channel backend ---
+    def _exec(self, transport, command_line, timeout):
+        """Runs one command on its own exec channel; returns (exit status, output)."""
+        if self.timing is not None:
+            timeout = self.timing.timeout(command_line, timeout)
+        start_time = time.time()
+        exec_channel = transport.open_session(timeout=timeout)
+        try:
+            exec_channel.settimeout(timeout)
+            exec_channel.set_combine_stderr(True)
+            exec_channel.exec_command(command_line)
+            output = exec_channel.makefile('rb').read()
+            status = exec_channel.recv_exit_status()
+        finally:
+            exec_channel.close()
+        if self.timing is not None and status == 0:
+            self.timing.record(command_line, time.time() - start_time)
+        return status, output.decode("utf-8", errors="replace")
+
+    def exec_commands(self, transport, command_lines, wait_time=10, max_workers=None):
+        """Runs independent commands concurrently on exec channels of one transport.
+
+        Output and exit status come straight from each channel, with no prompt
+        scraping. Returns [(exit status, output), ...] in input order.
+        """
+        command_lines = list(command_lines)
+        with ThreadPoolExecutor(max_workers=max_workers or self.EXEC_WORKERS) as pool:
+            return list(pool.map(lambda line: self._exec(transport, line, wait_time), command_lines))
+
+    def _exec_outputs(self, transport, commands, lines, wait_time):
+        """exec_commands() with the output of each command prefixed by the command, like a shell echo."""
+        outputs = []
+        for command, (status, output) in zip(commands, self.exec_commands(transport, lines, wait_time)):
+            if status != 0:
+                logging.warning(f"Command '{command}' exited with status {status}.")
+            outputs.append(f"{command}\n{output}")
+        return outputs
+
+    def rf_parallel(self, transport, channel, commands, wait_time=10, setup=()):
+        """Runs independent RF board commands and returns their outputs in order.
+
+        Amps that log in to a root shell (RF_EXEC) run them concurrently on exec
+        channels; interactive-only amps, or a failed exec, use rf_comm on the shell.
+        setup lists commands that change RF board state (e.g. switch settings):
+        they run first, one at a time and in order, so the reads see the new state.
+        Their outputs come first in the result.
+        """
+        setup, commands = list(setup), list(commands)
+        if self.RF_EXEC and transport is not None:
+            try:
+                outputs = [self._exec_outputs(transport, [command], [command], wait_time)[0] for command in setup]
+                return outputs + self._exec_outputs(transport, commands, commands, wait_time)
+            except Exception as e:
+                logging.warning(f"Exec channel unavailable ({e}); running RF board commands on the shell.")
+        commands = setup + commands
+        return [self.rf_comm(channel, command, wait_time=wait_time) for command in commands]
+
+    def hal_parallel(self, transport, channel, commands, wait_time=10):
+        """Runs independent HAL commands and returns their outputs in order.
+
+        Uses concurrent exec channels when HAL is reachable non-interactively
+        (HAL_EXEC), otherwise a single hal_batch() on the shell.
+        """
+        commands = list(commands)
+        if self.HAL_EXEC and transport is not None:
+            try:
+                lines = [self._hal_line(command).strip() for command in commands]
+                return self._exec_outputs(transport, commands, lines, wait_time)
+            except Exception as e:
+                logging.warning(f"Exec channel unavailable ({e}); running HAL commands on the shell.")
+        return self.hal_batch(channel, commands)
+
+    # --- Bulk file retrieval ---
+    def _fetch_tar(self, transport, files, timeout):
+        """Streams the files as one tar archive over an exec channel and unpacks them locally."""
+        by_path = {posixpath.normpath(remote): remote for remote in files}
+        command_line = "tar -chf - -C / " + " ".join(shlex.quote(path.lstrip('/')) for path in by_path)
+        fetched = {}
+        exec_channel = transport.open_session(timeout=timeout)
+        try:
+            exec_channel.settimeout(timeout)
+            exec_channel.exec_command(command_line)
+            with tarfile.open(fileobj=exec_channel.makefile('rb'), mode='r|') as archive:
+                for member in archive:
+                    remote = by_path.get(posixpath.normpath('/' + member.name))
+                    if remote is None or not member.isfile():
+                        continue
+                    with archive.extractfile(member) as src, open(files[remote], 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+                    fetched[remote] = files[remote]
+            errors = exec_channel.makefile_stderr('rb').read().decode("utf-8", errors="replace").strip()
+            status = exec_channel.recv_exit_status()
+        finally:
+            exec_channel.close()
+        if status != 0:
+            logging.warning(f"tar exited with status {status}: {errors}")
+        return fetched
+
+    def _fetch_scp(self, transport, files):
+        """Fetches the files with one SCP session, falling back to per-file gets for any it missed."""
+        fetched = {}
+        # Files are staged by basename, so only one file per basename can go in the shared request.
+        batch, rest = {}, []
+        for remote in files:
+            name = posixpath.basename(remote)
+            if name in batch:
+                rest.append(remote)
+            else:
+                batch[name] = remote
+        with SCPClient(transport) as scp_client:
+            staging_dir = tempfile.mkdtemp(prefix="amp_fetch_")
+            try:
+                try:
+                    scp_client.get(list(batch.values()), staging_dir)
+                except Exception as e:  # SCPException, or a socket error/timeout mid-transfer
+                    logging.debug(f"Bulk SCP stopped early: {e}")
+                for name, remote in batch.items():
+                    staged = os.path.join(staging_dir, name)
+                    if os.path.exists(staged):
+                        shutil.move(staged, files[remote])
+                        fetched[remote] = files[remote]
+                    else:
+                        rest.append(remote)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            for remote in rest:
+                try:
+                    scp_client.get(remote, files[remote])
+                    fetched[remote] = files[remote]
+                except Exception as e:
+                    logging.warning(f"Failed to download {remote}: {e}")
+        return fetched
+
+    def fetch_files(self, transport, files, wait_time=60):
+        """Copies {remote_path: local_path} from the amp in one transfer; returns the entries fetched.
+
+        Root-shell amps (RF_EXEC) stream everything as one tar archive over an exec
+        channel; others, or a failed tar, use a single multi-file SCP session.
+        Files missing on the amp are logged and left out of the result.
+        """
+        files = dict(files)
+        if not files:
+            return {}
+        if self.RF_EXEC:
+            try:
+                fetched = self._fetch_tar(transport, files, wait_time)
+                for remote in files.keys() - fetched.keys():
+                    logging.warning(f"Failed to download {remote}: not in the tar stream.")
+                return fetched
+            except Exception as e:
+                logging.warning(f"Tar stream unavailable ({e}); fetching files over SCP.")
+        return self._fetch_scp(transport, files)
+
+    def read_file(self, transport, remote_path, wait_time=10):
+        """Returns the contents of a remote file as bytes.
+
+        Root-shell amps (RF_EXEC) cat it on an exec channel, so the data arrives
+        in memory with no local file. Other amps copy it over SCP to a temporary
+        file that is read back and removed. Raises FileNotFoundError if the amp
+        cannot read the file.
+        """
+        if self.RF_EXEC:
+            exec_channel = transport.open_session(timeout=wait_time)
+            try:
+                exec_channel.settimeout(wait_time)
+                exec_channel.exec_command(f"cat {shlex.quote(remote_path)}")
+                data = exec_channel.makefile('rb').read()
+                errors = exec_channel.makefile_stderr('rb').read().decode("utf-8", errors="replace").strip()
+                status = exec_channel.recv_exit_status()
+            finally:
+                exec_channel.close()
+            if status != 0:
+                raise FileNotFoundError(f"{remote_path}: {errors or f'cat exited with status {status}'}")
+            return data
+        fd, local_path = tempfile.mkstemp(prefix="amp_read_")
+        os.close(fd)
+        try:
+            with SCPClient(transport, socket_timeout=wait_time) as scp_client:
+                scp_client.get(remote_path, local_path)
+            with open(local_path, 'rb') as f:
+                return f.read()
+        except SCPException as e:
+            raise FileNotFoundError(f"{remote_path}: {e}") from e
+        finally:
+            os.remove(local_path)
+
+    def file_checksums(self, transport, remote_paths, wait_time=10):
+        """Returns {remote_path: md5 hex} for the remote files that exist.
+
+        Runs one md5sum on an exec channel (root-shell amps, RF_EXEC). Returns
+        None when the amp cannot be probed, so callers can tell "no probe" from
+        "no files".
+        """
+        remote_paths = list(remote_paths)
+        if not self.RF_EXEC or transport is None or not remote_paths:
+            return None
+        try:
+            _, output = self._exec(transport, "md5sum " + " ".join(shlex.quote(p) for p in remote_paths), wait_time)
+        except Exception as e:
+            logging.warning(f"Could not probe remote checksums ({e}).")
+            return None
+        wanted = set(remote_paths)
+        checksums = {}
+        for line in output.splitlines():
+            # "<md5>  <path>"; missing files only produce an error line.
+            parts = line.strip().split(None, 1)
+            if len(parts) == 2 and re.fullmatch(r'[0-9a-f]{32}', parts[0]) and parts[1] in wanted:
+                checksums[parts[1]] = parts[0]
+        return checksums
+
+    def file_sizes(self, transport, remote_paths, wait_time=10):
+        """Returns {remote_path: size in bytes} for the remote files that exist.
+
+        Runs one wc -c on an exec channel (root-shell amps, RF_EXEC). Returns None
+        when the amp cannot be probed.
+        """
+        remote_paths = list(remote_paths)
+        if not self.RF_EXEC or transport is None or not remote_paths:
+            return None
+        try:
+            _, output = self._exec(transport, "wc -c " + " ".join(shlex.quote(p) for p in remote_paths), wait_time)
+        except Exception as e:
+            logging.warning(f"Could not probe remote file sizes ({e}).")
+            return None
+        wanted = set(remote_paths)
+        sizes = {}
+        for line in output.splitlines():
+            # "<bytes> <path>"; missing files only produce an error line.
+            parts = line.strip().split(None, 1)
+            if len(parts) == 2 and parts[0].isdigit() and parts[1] in wanted:
+                sizes[parts[1]] = int(parts[0])
+        return sizes
+
+    def remove_files(self, transport, remote_paths, wait_time=10):
+        """Deletes remote files (rm -f on an exec channel); returns False if this amp cannot delete them."""
+        remote_paths = list(remote_paths)
+        if not self.RF_EXEC or transport is None:
+            return False
+        if not remote_paths:
+            return True
+        try:
+            status, output = self._exec(transport, "rm -f " + " ".join(shlex.quote(p) for p in remote_paths), wait_time)
+        except Exception as e:
+            logging.warning(f"Could not remove remote files ({e}).")
+            return False
+        if status != 0:
+            logging.warning(f"rm exited with status {status}: {output.strip()}")
+        return status == 0
+
     def hal_comm(self, channel, command, prompt=">", wait_time=10):
         """Placeholder for HAL command execution. Must be overridden by subclasses."""
         raise NotImplementedError("hal_comm method must be implemented by a subclass.")
@@ -45,287 +579,183 @@ class AmpControl:
         """Placeholder for RF board command execution. Must be overridden by subclasses."""
         raise NotImplementedError("rf_comm method must be implemented by a subclass.")
 
+class AmpSession:
+    """Persistent interactive shell that remembers which CLI mode it was left in.
+
+    Wraps the invoke_shell() channel and can be passed to hal_comm/rf_comm in its
+    place. Consecutive commands for the same mode go straight to the prompt, and
+    a change of mode starts from the known mode instead of probing with a blank
+    line. Anything not defined here is forwarded to the wrapped channel.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.mode = None
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+    def close(self):
+        self.mode = None
+        self.channel.close()
+
 class CommscopeAmp(AmpControl):
     """Handles communication with CommScope amplifiers."""
+    PROMPTS = (
+        ('rfboard', re.compile(r"FDX-AMP\(rfboard\)>")),
+        ('hal', re.compile(r"hal>")),
+        ('cli', re.compile(r"FDX-AMP>")),
+        ('cli_sub', re.compile(r"FDX-AMP\(")),
+        ('login', re.compile(r"login:")),
+        ('password', re.compile(r"Password:")),
+        ('root', re.compile(r"# ")),
+    )
+    HAL_MODE = 'hal'
+    HAL_TRANSITIONS = {
+        'cli': 'hal\n',
+        'rfboard': 'exit\n',
+        'cli_sub': 'exit\n',
+        'login': 'cli\n',
+        'password': 'cli\n',
+        'root': 'exit\n',
+    }
+    RF_MODE = 'rfboard'
+    RF_TRANSITIONS = {
+        'cli': 'rfboard\n',
+        'hal': 'exit\n',
+        'cli_sub': 'exit\n',
+        'login': 'cli\n',
+        'password': 'cli\n',
+        'root': 'exit\n',
+    }
+
     def hal_comm(self, channel, command, prompt=">", wait_time=10):
-        start_time = time.time()
-        channel.send('\r\n')
-        output = self._get_output(channel)
-        # print(output)
-        
-        while True:
-            if "hal>" in output:
-                channel.send(f'{command} \r\n')
-                full_output = ""
-                while True:
-                    time.sleep(0.5)
-                    if channel.recv_ready():
-                        full_output += channel.recv(128000).decode("utf-8")
-                    if prompt in full_output:
-                        # print(full_output)
-                        return full_output
-                    if time.time() > start_time + wait_time:
-                        raise TimeoutError(f"Timeout waiting for prompt '{prompt}' after command '{command}'")
-                    channel.send(f'\r\n')
-                    
-            elif "FDX-AMP>" in output:
-                channel.send('hal\n')
-            elif "FDX-AMP(" in output:
-                channel.send('exit\n')
-            elif "login:" in output:
-                channel.send('cli\n')
-            elif "Password:" in output:
-                channel.send('cli\n')
-            elif "# " in output:
-                channel.send('exit\n')
-            else:
-                channel.send('\r\n')
-            
-            output = self._get_output(channel)
-            # print(output)
+        deadline = self._deadline(wait_time)
+        self._walk_to(channel, self.HAL_MODE, self.HAL_TRANSITIONS, deadline, command)
+        return self._send_command(channel, f'{command} \r\n', prompt, command, deadline, self.HAL_MODE,
+                                  nudge=self.NUDGE_INTERVAL)
 
     def rf_comm(self, channel, command, prompt="FDX-AMP(rfboard)>", wait_time=10):
-        start_time = time.time()
-        channel.send('\r\n')
-        output = self._get_output(channel)
-        # print(output)
-        
-        while True:
-            if "FDX-AMP(rfboard)>" in output:
-                channel.send(f'{command} \r\n')
-                full_output = ""
-                while True:
-                    time.sleep(0.5)
-                    if channel.recv_ready():
-                        full_output += channel.recv(128000).decode("utf-8")
-                    if prompt in full_output:
-                        # print(full_output)
-                        return full_output
-                    if time.time() > start_time + wait_time:
-                        raise TimeoutError(f"Timeout waiting for prompt '{prompt}' after command '{command}'")
-                    
-            elif "FDX-AMP>" in output:
-                channel.send('rfboard\n')
-            elif "hal>" in output:
-                channel.send('exit\n')
-            elif "login:" in output:
-                channel.send('cli\n')
-            elif "Password:" in output:
-                channel.send('cli\n')
-            elif "# " in output:
-                channel.send('exit\n')
-            else:
-                channel.send('\r\n')
-            
-            output = self._get_output(channel)
-            # print(output)
+        deadline = self._deadline(wait_time)
+        self._walk_to(channel, self.RF_MODE, self.RF_TRANSITIONS, deadline, command)
+        return self._send_command(channel, f'{command} \r\n', prompt, command, deadline, self.RF_MODE)
 
 class ComcastAmp(AmpControl):
     logging.debug("Using ComcastAmp class for amplifier control.")
     """Handles communication with Comcast (RDK) amplifiers."""
-    def hal_comm(self, channel, command, prompt=">", wait_time=12):
-        start_time = time.time()
-        channel.send('\r\n')
-        output = self._get_output(channel)
-        # print(output)
+    PROMPTS = (
+        ('rfboard', re.compile(r"FDX-AMP\(rf-components\)>")),
+        ('hal', re.compile(r"hal>")),
+        ('cli', re.compile(r"FDX-AMP>")),
+        ('cli_sub', re.compile(r"FDX-AMP\(")),
+        ('login', re.compile(r"login:")),
+        ('password', re.compile(r"Password:")),
+        ('root', re.compile(r"# ")),
+    )
+    HAL_MODE = 'hal'
+    HAL_TRANSITIONS = {
+        'cli': 'debug hal\n',
+        'rfboard': 'exit\n',
+        'cli_sub': 'exit\n',
+        'login': 'admin\n',
+        'password': 'AMPadmin\n',
+        'root': 'exit\n',
+    }
+    RF_MODE = 'rfboard'
+    RF_TRANSITIONS = {
+        'cli': 'rf-components\n',
+        'hal': '\x04\n', # Ctrl+D to exit HAL
+        'cli_sub': 'exit\n',
+        'login': 'admin\n',
+        'password': 'AMPadmin\n',
+        'root': 'exit\n',
+    }
 
-        while True:
-            if "hal>" in output:
-                channel.send(f'{command} \r\n')
-                logging.debug(f"Sent HAL command: {command}")
-                full_output = ""
-                while True:
-                    time.sleep(0.5)
-                    if channel.recv_ready():
-                        logging.debug(f"Receiving output for command '{command}'...")
-                        full_output += channel.recv(128000).decode("utf-8")
-                    if prompt in full_output:
-                        logging.debug(f"Received output for command '{command}': {full_output}")
-                        return full_output
-                    if time.time() > start_time + wait_time:
-                        raise TimeoutError(f"Timeout waiting for prompt '{prompt}' after command '{command}'")
-                    channel.send(f'\r\n')
-                    
-            elif "FDX-AMP>" in output:
-                channel.send('debug hal\n')
-            elif "FDX-AMP(" in output:
-                channel.send('exit\n')
-            elif "login:" in output:
-                channel.send('admin\n')
-            elif "Password:" in output:
-                channel.send('AMPadmin\n')
-            elif "# " in output:
-                channel.send('exit\n')
-            else:
-                channel.send('\r\n')
-
-            output = self._get_output(channel)
-            # print(output)
+    def hal_comm(self, channel, command, prompt=">", wait_time=12):
+        deadline = self._deadline(wait_time)
+        self._walk_to(channel, self.HAL_MODE, self.HAL_TRANSITIONS, deadline, command)
+        logging.debug(f"Sent HAL command: {command}")
+        full_output = self._send_command(channel, f'{command} \r\n', prompt, command, deadline, self.HAL_MODE,
+                                         nudge=self.NUDGE_INTERVAL)
+        logging.debug(f"Received output for command '{command}': {full_output}")
+        return full_output
 
     def rf_comm(self, channel, command, prompt="FDX-AMP(rf-components)>", wait_time=10):
-        start_time = time.time()
-        channel.send('\r\n')
-        output = self._get_output(channel)
-        # print(output)
-
-        while True:
-            if "FDX-AMP(rf-components)>" in output:
-                channel.send(f'{command} \r\n')
-                full_output = ""
-                while True:
-                    time.sleep(0.5)
-                    if channel.recv_ready():
-                        full_output += channel.recv(128000).decode("utf-8")
-                    if prompt in full_output:
-                        # print(full_output)
-                        return full_output
-                    if time.time() > start_time + wait_time:
-                        raise TimeoutError(f"Timeout waiting for prompt '{prompt}' after command '{command}'")
-                    
-            elif "FDX-AMP>" in output:
-                channel.send('rf-components\n')
-            elif "hal>" in output:
-                channel.send('\x04\n') # Ctrl+D to exit HAL
-            elif "login:" in output:
-                channel.send('admin\n')
-            elif "Password:" in output:
-                channel.send('AMPadmin\n')
-            elif "# " in output:
-                channel.send('exit\n')
-            else:
-                channel.send('\r\n')
-
-            output = self._get_output(channel)
-            # print(output)
+        deadline = self._deadline(wait_time)
+        self._walk_to(channel, self.RF_MODE, self.RF_TRANSITIONS, deadline, command)
+        return self._send_command(channel, f'{command} \r\n', prompt, command, deadline, self.RF_MODE)
 
 class SercommAmp(AmpControl):
     """Handles communication with Sercomm amplifiers."""
-    def hal_comm(self, channel, command, prompt=">", wait_time=10):
-        start_time = time.time()
-        channel.send('\r\n')
-        output = self._get_output(channel)
-        # print(output)
-
-        while True:
-            if "hal>" in output:
-                channel.send(f'{command} \r\n')
-                full_output = ""
-                while True:
-                    time.sleep(0.5)
-                    if channel.recv_ready():
-                        full_output += channel.recv(128000).decode("utf-8")
-                    if prompt in full_output:
-                        # print(full_output)
-                        return full_output
-                    if time.time() > start_time + wait_time:
-                        raise TimeoutError(f"Timeout waiting for prompt '{prompt}' after command '{command}'")
-                    channel.send(f'\r\n')
-                    
-            elif "scamp:~# " in output:
-                channel.send('clish -x /etc/amp/cli/\n\n')
-                time.sleep(0.5) # Give it time to enter the mode
-                channel.send('debug hal\n')
-            elif "FDX-AMP>" in output:
-                channel.send('debug hal\n')
-            elif "hal/wbfft>" in output:
-                channel.send('cd ..\n')
-            else:
-                channel.send('\r\n')
+    # 'cli' is the clish shell started from the root prompt.
+    PROMPTS = (
+        ('hal_sub', re.compile(r"hal/wbfft>")),
+        ('hal', re.compile(r"hal>")),
+        ('cli', re.compile(r"FDX-AMP>")),
+        ('root', re.compile(r"scamp:~# ")),
+    )
+    HAL_MODE = 'hal'
+    HAL_TRANSITIONS = {
+        # clish comes up at FDX-AMP>, which the next step turns into 'debug hal'.
+        'root': 'clish -x /etc/amp/cli/\n\n',
+        'cli': 'debug hal\n',
+        'hal_sub': 'cd ..\n',
+    }
+    RF_MODE = 'root'
+    RF_TRANSITIONS = {
+        'hal': '\x04\n', # Ctrl+D to exit HAL
+    }
+    RF_EXEC = True
 
-            output = self._get_output(channel)
-            # print(output)
+    def hal_comm(self, channel, command, prompt=">", wait_time=10):
+        deadline = self._deadline(wait_time)
+        self._walk_to(channel, self.HAL_MODE, self.HAL_TRANSITIONS, deadline, command)
+        return self._send_command(channel, f'{command} \r\n', prompt, command, deadline, self.HAL_MODE,
+                                  nudge=self.NUDGE_INTERVAL)
 
     def rf_comm(self, channel, command, prompt="~#", wait_time=10):
-        start_time = time.time()
-        channel.send('\r\n')
-        output = self._get_output(channel)
-        # print(output)
-
-        while True:
-            if "scamp:~# " in output:
-                channel.send(f'{command} \r\n')
-                full_output = ""
-                while True:
-                    time.sleep(0.5)
-                    if channel.recv_ready():
-                        full_output += channel.recv(128000).decode("utf-8")
-                    if prompt in full_output:
-                        # print(full_output)
-                        return full_output
-                    if time.time() > start_time + wait_time:
-                        raise TimeoutError(f"Timeout waiting for prompt '{prompt}' after command '{command}'")
-                    
-            elif "hal>" in output:
-                channel.send('\x04\n') # Ctrl+D to exit HAL
-            else:
-                channel.send('\r\n')
-            
-            output = self._get_output(channel)
-            # print(output)
+        deadline = self._deadline(wait_time)
+        self._walk_to(channel, self.RF_MODE, self.RF_TRANSITIONS, deadline, command)
+        return self._send_command(channel, f'{command} \r\n', prompt, command, deadline, self.RF_MODE)
 
 class BroadcomAmp(AmpControl):
-    """Handles communication with Sercomm amplifiers."""
-    def hal_comm(self, channel, command, prompt="~#", wait_time=10):
-        start_time = time.time()
-        channel.send('\r\n')
-        output = self._get_output(channel)
-        # print(output)
+    """Handles communication with Broadcom amplifiers."""
+    PROMPTS = SercommAmp.PROMPTS
+    # HAL commands are wrapped in sc_brcmcli and run from the root shell.
+    HAL_MODE = 'root'
+    HAL_TRANSITIONS = {
+        'cli': 'debug hal\n',
+        'hal_sub': 'cd ..\n',
+        'hal': '\x04\n', # Ctrl+D to exit HAL
+    }
+    RF_MODE = 'root'
+    RF_TRANSITIONS = {
+        'hal': '\x04\n', # Ctrl+D to exit HAL
+    }
+    RF_EXEC = True
+    HAL_EXEC = True
 
-        while True:
-            if "scamp:~# " in output:
-                channel.send(f'sc_brcmcli -S amphal -c "{command}" \r\n')   # type
-                time.sleep(0.5)
-                channel.send('\r\n')
-                full_output = ""
-                while True:
-                    time.sleep(0.5)
-                    if channel.recv_ready():
-                        full_output += channel.recv(128000).decode("utf-8")
-                    if prompt in full_output:
-                        # print(full_output)
-                        return full_output
-                    if time.time() > start_time + wait_time:
-                        raise TimeoutError(f"Timeout waiting for prompt '{prompt}' after command '{command}'")
-                    channel.send(f'\r\n')
-                    
-            elif "scamp:~# " in output:
-                channel.send('clish -x /etc/amp/cli/\n\n')
-                time.sleep(0.5) # Give it time to enter the mode
-                channel.send('debug hal\n')
-            elif "FDX-AMP>" in output:
-                channel.send('debug hal\n')
-            elif "hal/wbfft>" in output:
-                channel.send('cd ..\n')
-            else:
-                channel.send('\r\n')
+    def _hal_line(self, command):
+        return f'sc_brcmcli -S amphal -c "{command}" \r\n'
 
-            output = self._get_output(channel)
-            # print(output)
+    def _sentinel_line(self, token):
+        return f'echo {token}\r\n'
+
+    def hal_comm(self, channel, command, prompt="~#", wait_time=10):
+        deadline = self._deadline(wait_time)
+        self._walk_to(channel, self.HAL_MODE, self.HAL_TRANSITIONS, deadline, command)
+        return self._send_command(channel, self._hal_line(command), prompt, command, deadline,
+                                  self.HAL_MODE, nudge=self.NUDGE_INTERVAL)
 
     def rf_comm(self, channel, command, prompt="~#", wait_time=10):
-        start_time = time.time()
-        channel.send('\r\n')
-        output = self._get_output(channel)
-        # print(output)
+        deadline = self._deadline(wait_time)
+        self._walk_to(channel, self.RF_MODE, self.RF_TRANSITIONS, deadline, command)
+        return self._send_command(channel, f'{command} \r\n', prompt, command, deadline, self.RF_MODE)
 
-        while True:
-            if "scamp:~# " in output:
-                channel.send(f'{command} \r\n')
-                full_output = ""
-                while True:
-                    time.sleep(0.5)
-                    if channel.recv_ready():
-                        full_output += channel.recv(128000).decode("utf-8")
-                    if prompt in full_output:
-                        # print(full_output)
-                        return full_output
-                    if time.time() > start_time + wait_time:
-                        raise TimeoutError(f"Timeout waiting for prompt '{prompt}' after command '{command}'")
-                    
-            elif "hal>" in output:
-                channel.send('\x04\n') # Ctrl+D to exit HAL
-            else:
-                channel.send('\r\n')
-            
-            output = self._get_output(channel)
-            # print(output)
+# Image type (the --image argument) to amp class.
+AMP_CLASSES = {
+    'CS': CommscopeAmp,
+    'CC': ComcastAmp,
+    'CCs': ComcastAmp,
+    'SC': SercommAmp,
+    'BC': BroadcomAmp,
+}
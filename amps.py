@@ -7,6 +7,7 @@ import os
 import config_manager
 import macaddress
 import amp_library
+import amp_broker
 
 # We need the date/time for creating output folders
 from datetime import datetime
@@ -141,11 +142,19 @@ def main():
 
 
 
-    cmd = [sys.executable, "ec.py", "--image", image, "--ip", ipaddr, "--mac", macaddr, "--path_date", path_date]
+    # The broker keeps the amp session open, so ec.py (and ds.py) attach instead of logging in again.
+    broker_args = []
+    try:
+        amp_broker.ensure_broker()
+        broker_args = ["--broker", amp_broker.DEFAULT_SOCKET]
+    except Exception as e:
+        logging.warning(f"Amp broker unavailable, scripts will connect directly: {e}")
+
+    cmd = [sys.executable, "ec.py", "--image", image, "--ip", ipaddr, "--mac", macaddr, "--path_date", path_date] + broker_args
     try:
         subprocess.run(cmd, check=True)
         # After successful run of ec.py, run ds.py
-        # ds_cmd = [sys.executable, "ds.py", "--image", image, "--ip", ipaddr, "--mac", macaddr, "--path_date", path_date]
+        # ds_cmd = [sys.executable, "ds.py", "--image", image, "--ip", ipaddr, "--mac", macaddr, "--path_date", path_date] + broker_args
         # logging.debug(f"Running ds.py with command: {' '.join(ds_cmd)}")
         # try:
         #     subprocess.run(ds_cmd, check=True)
@@ -0,0 +1,145 @@
+# Amp Calibration File Cache
+# Version: 1.0
+#
+# Description:
+# Local cache of the factory calibration files ds.py needs from each amp (the
+# S2P files and the additional compensation tables). Files are kept per amp
+# identity (module serial from showModuleInfo, else the eCM MAC, else the host)
+# and stored under their MD5, with the parsed, frequency-sorted arrays saved
+# beside them as .npy, so a repeat capture neither downloads nor parses them.
+#
+# An entry is reused when the amp reports the same MD5 for the remote file
+# (AmpControl.file_checksums, one md5sum on an exec channel). Amps without an
+# exec channel cannot be probed; their entries are reused for ttl seconds after
+# the download that created them.
+#
+# Layout: <root>/<identity>/manifest.json, <md5>_<name> and <md5>_<name>.cal.npy
+#
+# Usage:
+#   cache = CalibrationCache("./out/cal_cache", amp_identity(rfboard_text, mac=mac))
+#   hits, misses = cache.plan(remote_paths, amp.file_checksums(transport, remote_paths))
+#   ... download misses, then cache.store(remote, local_path) for each ...
+#   freq, mag = cache.arrays(remote, parse)    # parse(path) -> (freq, mag) or None
+
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+DEFAULT_ROOT = os.path.join(".", "out", "cal_cache")
+DEFAULT_TTL = 7 * 24 * 3600     # seconds an unprobed entry is trusted
+MANIFEST_FILE = "manifest.json"
+PARSED_SUFFIX = ".cal.npy"     # distinct from wbfft_reader's own "<file>.npy" cache
+_SERIAL_PATTERN = re.compile(r"serial\s*(?:number|num|no\.?)?\s*[:=]\s*([A-Za-z0-9_-]+)", re.IGNORECASE)
+
+
+def amp_identity(module_info=None, mac=None, host=None):
+    """Cache key of an amp: serial number from showModuleInfo output, else the MAC, else the host."""
+    if module_info and (match := _SERIAL_PATTERN.search(module_info)):
+        return f"SN_{match.group(1)}"
+    if mac:
+        return mac.replace(":", "").replace("-", "").replace(".", "").upper()
+    if host:
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', host)
+    return "unknown"
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CalibrationCache:
+    """Per-amp store of calibration files and their parsed arrays, validated by remote MD5 or age."""
+
+    def __init__(self, root=DEFAULT_ROOT, identity="unknown", ttl=DEFAULT_TTL):
+        self.directory = os.path.join(root, identity)
+        self.ttl = ttl
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def _write_manifest(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def path(self, remote_path):
+        """Local path of the cached copy of remote_path (None if not cached)."""
+        entry = self.manifest.get(remote_path)
+        if entry is None:
+            return None
+        path = os.path.join(self.directory, entry['file'])
+        return path if os.path.exists(path) else None
+
+    def valid(self, remote_path, checksums=None):
+        """True if the cached copy can be used: same remote MD5, or (unprobed) younger than ttl."""
+        if self.path(remote_path) is None:
+            return False
+        entry = self.manifest[remote_path]
+        if checksums is not None:
+            return checksums.get(remote_path) == entry['md5']
+        return time.time() - entry['fetched'] < self.ttl
+
+    def plan(self, remote_paths, checksums=None):
+        """({remote: cached path} usable now, [remote paths to download])."""
+        hits, misses = {}, []
+        for remote in remote_paths:
+            if self.valid(remote, checksums):
+                hits[remote] = self.path(remote)
+            else:
+                misses.append(remote)
+        return hits, misses
+
+    def store(self, remote_path, local_path):
+        """Copies a freshly downloaded file into the cache; returns its cached path."""
+        md5 = file_md5(local_path)
+        name = f"{md5}_{posixpath.basename(remote_path)}"
+        cached = os.path.join(self.directory, name)
+        if not os.path.exists(cached):
+            shutil.copyfile(local_path, cached)
+        self.manifest[remote_path] = {'file': name, 'md5': md5, 'fetched': time.time()}
+        self._write_manifest()
+        return cached
+
+    def arrays(self, remote_path, parse):
+        """Parsed (freq, values) of a cached file, parsing it with parse(path) only the first time.
+
+        Returns None if the file is not cached or parse() returns None.
+        """
+        path = self.path(remote_path)
+        if path is None:
+            return None
+        npy_path = path + PARSED_SUFFIX
+        try:
+            freq, values = np.load(npy_path, allow_pickle=False)
+            return freq, values
+        except (OSError, ValueError):
+            pass
+        parsed = parse(path)
+        if parsed is None:
+            return None
+        freq, values = (np.asarray(a, dtype=np.float64) for a in parsed)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.vstack([freq, values]))
+            os.replace(tmp_path, npy_path)
+        except OSError as e:
+            logging.warning(f"Could not save parsed calibration {npy_path}: {e}")
+        return freq, values
@@ -33,13 +33,15 @@ CONFIGURATIONS = {
         'endFreq': 1218000000,
         'runDuration': 1000,
         'aggrPeriod': 1000,
+        'wbfft_queue_captures': False,  # True if the firmware can queue start_capture for several ADCs
         'triggerCount': 0,
         'outputFormat': "FreqDomainDb",
         'fftSize': 16384,
         'windowMode': "Blackman-Harris",
         'averagingMode': "Time",
         'samplingRate': 1647000000,
-        'rfboard_commands': ["setNorthPortSwitch Downstream", "showModuleInfo"],
+        'rfboard_setup_commands': ["setNorthPortSwitch Downstream"],  # change RF board state: run first, in order
+        'rfboard_commands': ["showModuleInfo"],
         'hal_commands': ["/leap/lafe_show_status 0", "/leap/lafe_show_status 4", "/leap/fafe_show_status 0", "/leap/fafe_show_status 4"]
     },
     'CC': {
@@ -68,13 +70,15 @@ CONFIGURATIONS = {
         'endFreq': 1218000000,
         'runDuration': 1000,
         'aggrPeriod': 1000,
+        'wbfft_queue_captures': False,  # True if the firmware can queue start_capture for several ADCs
         'triggerCount': 0,
         'outputFormat': "FreqDomainDb",
         'fftSize': 16384,
         'windowMode': "Blackman-Harris",
         'averagingMode': "Time",
         'samplingRate': 1647000000,
-        'rfboard_commands': ["north-port-switch-path ds", "showModuleInfo"],
+        'rfboard_setup_commands': ["north-port-switch-path ds"],  # change RF board state: run first, in order
+        'rfboard_commands': ["showModuleInfo"],
         'hal_commands': ["/leap/lafe_show_status 0", "/leap/lafe_show_status 4", "/leap/lafe_show_status 5", "/leap/fafe_show_status 0", "/leap/fafe_show_status 4"]
     },
     'SC': {
@@ -106,6 +110,7 @@ CONFIGURATIONS = {
         'endFreq': 1218000000,
         'runDuration': 1000,
         'aggrPeriod': 1000,
+        'wbfft_queue_captures': False,  # True if the firmware can queue start_capture for several ADCs
         'triggerCount': 0,
         'outputFormat': "FreqDomainDb",
         'fftSize': 16384,
@@ -113,7 +118,8 @@ CONFIGURATIONS = {
         'averagingMode': "Time",
         'samplingRate': 1647000000,
         'rfboard_init_command': "tempsensor.sh init",
-        'rfboard_commands': ["tempsensor.sh read", "sc_rfboard_cli set_np_monitor_input ds", "sc_rfboard_cli get_pa_current 0", "sc_rfboard_cli get_attenuation 0", "sc_rfboard_cli get_var_tilt 0"],
+        'rfboard_setup_commands': ["sc_rfboard_cli set_np_monitor_input ds"],  # change RF board state: run first, in order
+        'rfboard_commands': ["tempsensor.sh read", "sc_rfboard_cli get_pa_current 0", "sc_rfboard_cli get_attenuation 0", "sc_rfboard_cli get_var_tilt 0"],
         'hal_commands': ["/leap/lafe_show_status 0", "/leap/lafe_show_status 4", "/leap/lafe_show_status 5", "/leap/fafe_show_status 0", "/leap/fafe_show_status 4"],
         'brcm_commands' : ['dump_avs']
     }
@@ -0,0 +1,99 @@
+# WBFFT Correction Curves
+# Version: 1.0
+#
+# Description:
+# Folds everything ds.py adds to or subtracts from a raw WBFFT trace that
+# depends only on frequency (the dBmV offset, the S2P paths and the additional
+# compensation tables, each interpolated onto the WBFFT grid) into one
+# precompiled vector per amp, measurement and frequency grid. Post-processing a
+# capture is then a single vector add (plus the scalar HAL gains, which are read
+# per capture). Curves are kept in memory for repeat or averaged captures in
+# one process, and as .npy files (e.g. in the amp's cal_cache directory) so a
+# later run on the same amp and grid loads the curve instead of rebuilding it.
+#
+# A curve is identified by a hash of the grid, the offset and each term's
+# content key (the calibration file's MD5) and sign, so a changed calibration
+# file or grid compiles a new curve. A curve missing a term that could not be
+# loaded is used for that capture only and never cached.
+#
+# Usage:
+#   compiler = CorrectionCompiler(cal_store.directory)
+#   curve = compiler.compile("north_port_input", freq, [(md5, -1.0, load_h21)], offset=59.5)
+#   corrected = amplitude + curve - gain_total
+
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+
+class CorrectionCompiler:
+    """Builds and caches offset + sum(sign * interpolated term) vectors on a frequency grid."""
+
+    def __init__(self, directory=None):
+        self.directory = directory      # None: keep curves in memory only
+        self.curves = {}
+
+    @staticmethod
+    def key(freq, terms, offset):
+        digest = hashlib.sha1()
+        digest.update(repr((float(offset), [(content, float(sign)) for content, sign, _ in terms])).encode())
+        digest.update(freq.tobytes())
+        return digest.hexdigest()
+
+    def _path(self, name, key):
+        return os.path.join(self.directory, f"correction_{name}_{key[:16]}.npy")
+
+    def _load(self, name, key, size):
+        if self.directory is None:
+            return None
+        try:
+            curve = np.load(self._path(name, key), allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        return curve if curve.shape == (size,) else None
+
+    def _save(self, name, key, curve):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, curve)
+            os.replace(tmp_path, self._path(name, key))
+        except OSError as e:
+            logging.warning(f"Could not save correction curve for {name}: {e}")
+
+    def compile(self, name, freq, terms, offset=0.0):
+        """Read-only correction vector on freq.
+
+        terms: [(content key, sign, load)], where load() returns the term's
+        frequency-sorted (freq, values) arrays, or None to leave the term out.
+        """
+        freq = np.ascontiguousarray(freq, dtype=np.float64)
+        terms = list(terms)
+        key = self.key(freq, terms, offset)
+        curve = self.curves.get(key)
+        if curve is not None:
+            return curve
+        curve = self._load(name, key, len(freq))
+        if curve is None:
+            curve = np.full(len(freq), float(offset))
+            complete = True
+            for content, sign, load in terms:
+                arrays = load()
+                if arrays is None:
+                    logging.warning(f"Correction term {content} of {name} could not be loaded; leaving it out.")
+                    complete = False
+                    continue
+                curve += sign * np.interp(freq, *arrays)
+            logging.debug(f"Compiled correction curve for {name} ({len(terms)} terms, {len(freq)} bins).")
+            if not complete:
+                # Not what the key describes: rebuild next time, when the missing term may be available.
+                curve.flags.writeable = False
+                return curve
+            if self.directory is not None:
+                self._save(name, key, curve)
+        curve.flags.writeable = False
+        self.curves[key] = curve
+        return curve
@@ -1,4 +1,19 @@
 ### WBFFT Combined Analyzer
+# v2.0.14: RF board setters (config 'rfboard_setup_commands') run in order before the parallel reads.
+# v2.0.13: WBFFT captures run through wbfft_scheduler: each dump is downloaded and post-processed
+#          while the next ADC captures; 'wbfft_queue_captures' starts all captures back to back.
+#          Calibration, download and processing failures are logged and contained: a cache or
+#          download error falls back to uncached/uncorrected data, a failed capture is skipped.
+# v2.0.12: Channel power comes from a ChannelPlan compiled once per run (channel_power.py):
+#          searchsorted edges and a cumulative linear-power sum instead of a mask per channel.
+# v2.0.11: Offset and calibration terms of each measurement are compiled once into a cached
+#          correction curve (correction.py); post-processing is one vector add.
+# v2.0.10: Calibration files (S2P, compensation tables) come from a per-amp local cache (cal_cache)
+#          while the amp reports the same MD5; --cal-cache, --cal-cache-ttl, --no-cal-cache.
+# v2.0.9: WBFFT dumps are parsed in one vectorised pass and cached as .npy next to the dump (wbfft_reader).
+# v2.0.8: Stage 3 downloads all files in one stream (amp_library fetch_files).
+# v2.0.7: Added --broker to reuse an amp session held by amp_broker.py.
+# v2.0.6: Jumpbox transport comes from jumpbox_pool (one authenticated transport per process).
 # v2.0.5: added --addr argument to specify either IP or MAC address. Validate accordingly.
 # v2.0.3: Fixed a bug where filenames would use the MAC address even when an IP was provided.
 #         Filenames now use the IP as the identifier if the --ip flag is used.
@@ -25,27 +40,30 @@ python ds.py --image 'CC' --addr '2001:0558:6043:003F:2855:D2DC:2D77:FD23'
 
 '''
 
-import paramiko
 import sys
 import os
 import csv
 import re
-import time
+import shutil
 import ipaddress
 import argparse
 import pandas as pd
-import numpy as np
 import logging
-import math
+import jumpbox_pool
 import subprocess
 import macaddress
-from paramiko import SSHClient
 from scp import SCPClient
 from itertools import zip_longest
 
 # New unified library imports
 import config_manager
 import amp_library
+import amp_broker
+import wbfft_reader
+import cal_cache
+import correction
+import channel_power
+import wbfft_scheduler
 
 # Added to auto open results
 import webbrowser
@@ -68,6 +86,14 @@ parser.add_argument('--ip', type=str, help="Optional. Target device IP address.
 parser.add_argument('--addr', type=str, help="Optional. Specify either IP or MAC address of the target device. Overrides the value in config.")
 parser.add_argument('--domain', type=str, help="Optional. CM domain for IP lookup script. Overrides the value in config.")
 parser.add_argument('--path_date', type=str, help="Optional. Date string for output path.")
+parser.add_argument('--broker', type=str, nargs='?', const=amp_broker.DEFAULT_SOCKET, default=None,
+                    help="Optional. Run amp commands through the session broker on this Unix socket (default socket if no path given).")
+parser.add_argument('--cal-cache', type=str, default=cal_cache.DEFAULT_ROOT,
+                    help=f"Directory of the per-amp calibration file cache (default: {cal_cache.DEFAULT_ROOT}).")
+parser.add_argument('--cal-cache-ttl', type=float, default=cal_cache.DEFAULT_TTL,
+                    help="Seconds a cached calibration file is trusted on amps whose files cannot be checksummed (default: 7 days).")
+parser.add_argument('--no-cal-cache', action='store_true',
+                    help="Always download and parse the calibration files.")
 
 args = parser.parse_args()
 
@@ -151,21 +177,14 @@ def parse_hal_gains(filepath, section_marker, gain_names):
         return None
 
 def parse_wbfft_data(filepath):
-    """Parses the WBFFT text file."""
-    data = []
+    """Parses the WBFFT text file (or its .npy cache, see wbfft_reader)."""
     try:
-        with open(filepath, 'r') as f:
-            for line in f:
-                if ":" in line and (parts := line.strip().split(':')) and len(parts) == 2:
-                    try:
-                        data.append({'Frequency': float(parts[0]), 'Amplitude': float(parts[1])})
-                    except ValueError:
-                        continue
-        if not data:
+        frequencies, amplitudes = wbfft_reader.load(filepath)
+        if len(frequencies) == 0:
             logging.error(f"No valid data in WBFFT file: {filepath}")
             return None
-        logging.debug(f"Parsed {len(data)} points from WBFFT file.")
-        return pd.DataFrame(data)
+        logging.debug(f"Parsed {len(frequencies)} points from WBFFT file.")
+        return pd.DataFrame({'Frequency': frequencies, 'Amplitude': amplitudes})
     except FileNotFoundError:
         logging.error(f"WBFFT file not found: {filepath}")
         return None
@@ -233,16 +252,10 @@ def parse_s21_data(filepath):
                             except ValueError:
                                 logging.warning(f"Skipping malformed data line in {filepath}: {line}")
 
-            elif file_format == 'wbfft_txt':
-                for line in f:
-                    if ":" in line and (parts := line.strip().split(':')) and len(parts) == 2:
-                        try:
-                            frequencies.append(float(parts[0]))
-                            s21_magnitudes.append(float(parts[1]))
-                        except ValueError:
-                            continue
+        if file_format == 'wbfft_txt':
+            frequencies, s21_magnitudes = wbfft_reader.load(filepath)
 
-        if not frequencies:
+        if len(frequencies) == 0:
             logging.error(f"No valid data points parsed from file: {filepath}")
             return None
 
@@ -256,6 +269,34 @@ def parse_s21_data(filepath):
         logging.error(f"Error reading S-parameter/calibration file {filepath}: {e}")
         return None
 
+def parse_s21_arrays(filepath):
+    """parse_s21_data() as (frequency, magnitude) arrays sorted by frequency."""
+    s21_df = parse_s21_data(filepath)
+    if s21_df is None:
+        return None
+    s21_df = s21_df.sort_values(by='Frequency')
+    return s21_df['Frequency'].to_numpy(), s21_df['S21_Magnitude'].to_numpy()
+
+def load_calibration(cal_store, remote_path, local_path):
+    """Sorted (frequency, magnitude) of a calibration file, pre-parsed from the cache when it holds the file."""
+    if cal_store is not None and (arrays := cal_store.arrays(remote_path, parse_s21_arrays)) is not None:
+        return arrays
+    return parse_s21_arrays(local_path)
+
+CAL_SIGNS = {'add': 1.0, 'subtract': -1.0}
+WBFFT_DBMV_OFFSET = 59.5
+
+def correction_terms(cal_store, operations, paths):
+    """[(content key, sign, load)] of the calibration files a measurement adds or subtracts."""
+    terms = []
+    for key, operation in operations.items():
+        if key not in paths or operation not in CAL_SIGNS: continue
+        remote_path, local_path = paths[key]
+        content = cal_cache.file_md5(local_path) if os.path.exists(local_path) else f"missing:{remote_path}"
+        terms.append((content, CAL_SIGNS[operation],
+                      lambda r=remote_path, l=local_path: load_calibration(cal_store, r, l)))
+    return terms
+
 def parse_freq_string(s):
     """Converts a frequency string like '111M' or '6k' to float in Hz."""
     s = s.strip().upper()
@@ -292,27 +333,6 @@ def parse_channel_definitions(channels_str):
             logging.warning(f"Could not parse channel definition: '{definition}'")
     return final_channels
 
-def calculate_channel_power(df, channels_to_calculate, power_column_name):
-    """Calculates power for specified channels from the results DataFrame."""
-    power_results = []
-    if df.empty:
-        logging.error("Input DataFrame is empty, cannot calculate channel power.")
-        return power_results
-    for channel in channels_to_calculate:
-        cf_hz, bw_hz = channel['cf_hz'], channel['bw_hz']
-        start_freq, end_freq = cf_hz - (bw_hz / 2.0), cf_hz + (bw_hz / 2.0)
-        channel_df = df[(df['Frequency'] >= start_freq) & (df['Frequency'] < end_freq)]
-        if channel_df.empty:
-            power_dBmV = -math.inf
-        else:
-            linear_power = 10**(channel_df[power_column_name] / 10)
-            total_linear_power = linear_power.sum()
-            power_dBmV = 10 * math.log10(total_linear_power) if total_linear_power > 0 else -math.inf
-        power_results.append({
-            'CenterFrequency_MHz': f"{cf_hz/1e6:.3f}", 'Bandwidth_MHz': f"{bw_hz/1e6:.3f}", 'Channel_Power_dBmV': f"{power_dBmV:.2f}"
-        })
-    return power_results
-
 # --- Main Logic ---
 def main():
     # Load configuration based on --image flag
@@ -418,76 +438,56 @@ def main():
     }
 
     processed_data_frames = []
-    all_power_results = []
+    power_columns = {}  # '<prefix>_Power_dBmV' -> power of each channel_plan channel
+    channel_plan = None
+    if args.channels:
+        channel_plan = channel_power.ChannelPlan.from_channels(parse_channel_definitions(args.channels))
 
-    jumpbox_client, target_client, channel = None, None, None
+    target_client, channel, broker_client = None, None, None
     try:
         # --- SSH Connection Logic ---
-        if not args.no_jump:
-            logging.debug("Connecting to jumpbox and target device...")
-            jumpbox_client = paramiko.SSHClient(); jumpbox_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            jumpbox_client.connect(config['jumpbox_hostname'], username=config['jumpbox_username'])
-            transport = jumpbox_client.get_transport()
-            dest_addr = (target_hostname, 22)
-            logging.debug("Target info: ")
-            logging.debug(target_hostname)
-            jumpbox_channel = transport.open_channel("direct-tcpip", dest_addr, ('', 0))
-            target_client = paramiko.SSHClient(); target_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            logging.debug("Establishing SSH connection to target via jumpbox...")
-            target_client.connect(target_hostname, username=config['target_username'], password=config['target_password'], sock=jumpbox_channel)
-            logging.debug("SSH connection established via jumpbox.")
+        if args.broker:
+            # The session (and its jumpbox transport) lives in amp_broker.py and is reused across runs.
+            broker_client = amp_broker.BrokerClient(args.broker)
+            amp = amp_broker.BrokerAmp(broker_client, args.image, target_hostname, config, args.no_jump)
+            transport = None
+            target_scp_client = amp.scp_client()
         else:
-            logging.debug("Connecting directly to target device...")
-            target_client = paramiko.SSHClient(); target_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            logging.debug("Establishing direct SSH connection to target...")
-            logging.debug(target_hostname)
-            logging.debug(config['target_username'])
-            target_client.connect(target_hostname, username=config['target_username'], password=config['target_password'])
-
-        channel = target_client.invoke_shell(); channel.settimeout(1000)
-        target_scp_client = SCPClient(target_client.get_transport())
+            # The jumpbox transport is pooled; the amp gets its own direct-tcpip channel over it.
+            logging.debug(f"Connecting to target device {target_hostname}{'' if args.no_jump else ' via jumpbox'}...")
+            target_client = jumpbox_pool.connect_target(config, target_hostname, args.no_jump)
+            transport = target_client.get_transport()
+
+            channel = amp_library.AmpSession(target_client.invoke_shell()); channel.settimeout(1000)
+            target_scp_client = SCPClient(transport)
         logging.debug("SSH connection established.")
 
         # --- Stage 1: Run unique remote commands ---
         logging.debug("--- Stage 1: Running unique remote commands ---")
-        all_rfboard_cmds = set(cmd for m_name in args.measurement for cmd in measurement_configs[m_name]['rfboard_commands'])
+        # Ordered: setters (rfboard_setup_commands) must run before the reads that depend on them.
+        rfboard_setup_cmds = list(dict.fromkeys(config.get('rfboard_setup_commands', [])))
+        all_rfboard_cmds = list(dict.fromkeys(cmd for m_name in args.measurement for cmd in measurement_configs[m_name]['rfboard_commands']))
         all_hal_cmds = set(cmd for m_name in args.measurement for cmd in measurement_configs[m_name]['hal_commands'])
 
         consolidated_rfboard_file = os.path.join(path, f"rfboard_all{identifier_suffix}{appendix}.txt")
         consolidated_hal_file = os.path.join(path, f"hal_all{identifier_suffix}{appendix}.txt")
 
-        if all_rfboard_cmds:
-            logging.debug(f"Running RFboard commands: {list(all_rfboard_cmds)}")
-            ret = "".join(amp.rf_comm(channel, cmd) for cmd in all_rfboard_cmds)
+        if all_rfboard_cmds or rfboard_setup_cmds:
+            logging.debug(f"Running RFboard commands: {rfboard_setup_cmds + all_rfboard_cmds}")
+            ret = "".join(amp.rf_parallel(transport, channel, all_rfboard_cmds, setup=rfboard_setup_cmds))
             with open(consolidated_rfboard_file, 'w') as f:
                 f.write('\n'.join(line.strip() for line in ret.splitlines() if line.strip()))
 
         if all_hal_cmds:
             logging.debug(f"Running HAL commands: {list(all_hal_cmds)}")
-            ret = "".join(amp.hal_comm(channel, cmd, "InputPower") for cmd in all_hal_cmds)
+            ret = "".join(amp.hal_parallel(transport, channel, all_hal_cmds))
             with open(consolidated_hal_file, 'w') as f:
                 f.write('\n'.join(line.strip() for line in ret.splitlines() if line.strip()))
 
-        # --- Stage 2: Run WBFFT captures and gather file list ---
-        logging.info("--- Stage 2: Running WBFFT captures & building file list ---")
-        remote_files_to_get = {}
-        local_wbfft_paths = {}
-
-        for measurement_name in args.measurement:
-            m_config = measurement_configs[measurement_name]
-            wbfft_config_cmd = f"/wbfft/configuration startFreq {config['startFreq']} endFreq {config['endFreq']} outputFormat {config['outputFormat']} fftSize {config['fftSize']} windowMode {config['windowMode']} averagingMode {config['averagingMode']} samplingRate {config['samplingRate']} adcSelect {m_config['adcSelect']} runDuration {config['runDuration']} triggerCount {config['triggerCount']} aggrPeriod {config['aggrPeriod']}"
-            logging.debug(f"Configuring WBFFT for {measurement_name} with command: {wbfft_config_cmd}")
-            amp.hal_comm(channel, wbfft_config_cmd, "Success.")
-            remote_wbfft_base = f"/tmp/WBFFT_{measurement_name}"
-            logging.debug(f"Starting WBFFT capture for {measurement_name}...")
-            amp.hal_comm(channel, f"/wbfft/start_capture 0 {remote_wbfft_base}", "Success.")
-            time.sleep(1)
-
-            local_wbfft_base = os.path.join(path, f"WBFFT_{m_config['output_prefix']}")
-            local_wbfft_paths[measurement_name] = local_wbfft_base
-            remote_files_to_get[remote_wbfft_base] = local_wbfft_base
-            remote_files_to_get[f"{remote_wbfft_base}.config"] = f"{local_wbfft_base}.config"
-
+        # --- Stage 2: Calibration files (cache lookup and download run in the background) ---
+        logging.info("--- Stage 2: Building calibration file list ---")
+        cal_files = {}  # calibration files: remote path -> local path
+        s2p_paths, comp_paths = {}, {}  # key -> (remote path, local path)
         all_s2p_keys = set(key for m_name in args.measurement for key in measurement_configs[m_name]['s2p_keys'])
         for s2p_key in all_s2p_keys:
             s2p_file_with_path = s2p_filenames.get(s2p_key)
@@ -496,7 +496,8 @@ def main():
                 continue
             full_remote_path = os.path.join(s2p_remote_path, s2p_file_with_path).replace("\\", "/")
             local_filename = os.path.basename(s2p_file_with_path)
-            remote_files_to_get[full_remote_path] = os.path.join(path, local_filename)
+            s2p_paths[s2p_key] = (full_remote_path, os.path.join(path, local_filename))
+            cal_files[full_remote_path] = s2p_paths[s2p_key][1]
 
         all_add_comp_keys = set(key for m_name in args.measurement for key in measurement_configs[m_name].get('add_comp_keys', {}))
         for comp_key in all_add_comp_keys:
@@ -506,75 +507,103 @@ def main():
                 continue
             full_remote_path = os.path.join(additional_comp_remote_path, comp_file_with_path).replace("\\", "/")
             local_filename = os.path.basename(comp_file_with_path)
-            remote_files_to_get[full_remote_path] = os.path.join(path, local_filename)
-
-        # --- Stage 3: Download all unique files ---
-        logging.debug("--- Stage 3: Downloading all required files ---")
-        for remote, local in remote_files_to_get.items():
-            try:
-                logging.debug(f"Downloading {remote} to {local}")
-                target_scp_client.get(remote, local)
-            except Exception as e:
-                logging.error(f"Failed to download {remote}: {e}")
-        logging.debug("All downloads complete.")
-
-        # --- Stage 4: Post-process each measurement ---
-        logging.debug("--- Stage 4: Post-processing all measurements ---")
-        for measurement_name in args.measurement:
+            comp_paths[comp_key] = (full_remote_path, os.path.join(path, local_filename))
+            cal_files[full_remote_path] = comp_paths[comp_key][1]
+
+        def prepare_calibration():
+            """Copies still-cached calibration files and downloads the rest; returns (cal_store, correction compiler).
+
+            Never raises: if the cache fails the files are downloaded uncached, and files
+            that cannot be downloaded are left out of the corrections (logged).
+            """
+            cal_store = None
+            cal_misses = list(cal_files)
+            if cal_files and not args.no_cal_cache:
+                try:
+                    module_info = None
+                    if os.path.exists(consolidated_rfboard_file):
+                        with open(consolidated_rfboard_file, 'r') as f:
+                            module_info = f.read()
+                    identity = cal_cache.amp_identity(module_info, target_cm_mac, target_hostname)
+                    cal_store = cal_cache.CalibrationCache(args.cal_cache, identity, args.cal_cache_ttl)
+                    checksums = amp.file_checksums(transport, list(cal_files))
+                    cal_hits, cal_misses = cal_store.plan(cal_files, checksums)
+                    for remote, cached in cal_hits.items():
+                        shutil.copyfile(cached, cal_files[remote])
+                    logging.debug(f"Calibration cache ({identity}, {'md5 probe' if checksums is not None else 'ttl'}): "
+                                  f"{len(cal_hits)} cached, {len(cal_misses)} to download.")
+                except Exception as e:
+                    logging.error(f"Calibration cache unavailable ({e}); downloading the calibration files uncached.")
+                    cal_store, cal_misses = None, list(cal_files)
+            if cal_misses:
+                # One tar/SCP stream for all of them instead of a round trip per file.
+                files_to_get = {remote: cal_files[remote] for remote in cal_misses}
+                try:
+                    fetched = amp.fetch_files(transport, files_to_get)
+                except Exception as e:
+                    logging.error(f"Calibration download failed ({e}); measurements are processed without those corrections.")
+                    fetched = {}
+                for remote in files_to_get:
+                    if remote not in fetched:
+                        logging.error(f"Failed to download {remote}")
+                        continue
+                    if cal_store is not None:
+                        try:
+                            cal_store.store(remote, fetched[remote])
+                        except Exception as e:
+                            logging.warning(f"Could not cache {remote}: {e}")
+            return cal_store, correction.CorrectionCompiler(cal_store.directory if cal_store is not None else None)
+
+        def process_measurement(capture, fetched):
+            """Stage 4 for one measurement, run on the scheduler's worker once its dump is downloaded."""
+            measurement_name = capture.name
             logging.debug(f"--- Processing: {measurement_name} ---")
             m_config = measurement_configs[measurement_name]
+            cal_store, corrections = calibration.result()
 
             wbfft_df = parse_wbfft_data(local_wbfft_paths[measurement_name])
             gains = parse_hal_gains(consolidated_hal_file, m_config['hal_gain_section'], m_config['hal_gain_names'])
 
             if wbfft_df is None or gains is None:
                 logging.error(f"Cannot process {measurement_name} due to missing data.")
-                continue
+                return
 
-            result_series = wbfft_df['Amplitude'].copy() + 59.5
-
-            for s2p_key, operation in m_config['s2p_keys'].items():
-                s2p_file_with_path = s2p_filenames.get(s2p_key)
-                if not s2p_file_with_path: continue
-                local_filename = os.path.basename(s2p_file_with_path)
-                local_s2p_path = os.path.join(path, local_filename)
-                s21_df = parse_s21_data(local_s2p_path)
-                if s21_df is not None:
-                    s21_df = s21_df.sort_values(by='Frequency')
-                    interpolated_s21_mag = np.interp(wbfft_df['Frequency'], s21_df['Frequency'], s21_df['S21_Magnitude'])
-                    if operation == 'subtract': result_series -= interpolated_s21_mag
-                    elif operation == 'add': result_series += interpolated_s21_mag
-
-            for comp_key, operation in m_config.get('add_comp_keys', {}).items():
-                comp_file_with_path = additional_comp_filenames.get(comp_key)
-                if not comp_file_with_path: continue
-                local_filename = os.path.basename(comp_file_with_path)
-                local_comp_path = os.path.join(path, local_filename)
-                comp_df = parse_s21_data(local_comp_path)
-                if comp_df is not None:
-                    comp_df = comp_df.sort_values(by='Frequency')
-                    interpolated_comp_mag = np.interp(wbfft_df['Frequency'], comp_df['Frequency'], comp_df['S21_Magnitude'])
-                    if operation == 'subtract': result_series -= interpolated_comp_mag
-                    elif operation == 'add': result_series += interpolated_comp_mag
-
-            if measurement_name in ['north_port_input', 'south_port_output']:
-                result_series -= gains.get('PreAdcRxGain', 0)
-                result_series -= gains.get('PostAdcRxGain', 0)
-            elif measurement_name == 'ds_afe_input':
-                result_series -= gains.get('PreAdcNcGain', 0)
-                result_series -= gains.get('PostAdcNcGain', 0)
-
-            wbfft_df[m_config['output_prefix']] = result_series
+            # Offset, S2P paths and compensation tables: one curve per amp, measurement and grid.
+            terms = (correction_terms(cal_store, m_config['s2p_keys'], s2p_paths)
+                     + correction_terms(cal_store, m_config.get('add_comp_keys', {}), comp_paths))
+            curve = corrections.compile(measurement_name, wbfft_df['Frequency'].to_numpy(), terms,
+                                        offset=WBFFT_DBMV_OFFSET)
+            gain_total = sum(gains.get(name, 0) for name in m_config['hal_gain_names'])
+
+            wbfft_df[m_config['output_prefix']] = wbfft_df['Amplitude'].to_numpy() + (curve - gain_total)
             processed_data_frames.append(wbfft_df[['Frequency', m_config['output_prefix']]].copy())
 
-            if args.channels:
-                channels_to_process = parse_channel_definitions(args.channels)
-                if channels_to_process:
-                    power_results = calculate_channel_power(wbfft_df, channels_to_process, m_config['output_prefix'])
-                    if power_results:
-                        power_df = pd.DataFrame(power_results)
-                        power_df = power_df.rename(columns={'Channel_Power_dBmV': f"{m_config['output_prefix']}_Power_dBmV"})
-                        all_power_results.append(power_df)
+            if channel_plan is not None and len(channel_plan):
+                power_columns[f"{m_config['output_prefix']}_Power_dBmV"] = channel_plan.power_dbmv(
+                    wbfft_df['Frequency'].to_numpy(), wbfft_df[m_config['output_prefix']].to_numpy())
+
+        # --- Stage 3/4: WBFFT captures, each downloaded and post-processed while the next one runs ---
+        queue_captures = config.get('wbfft_queue_captures', False)
+        logging.info(f"--- Stage 3: Running WBFFT captures ({'queued' if queue_captures else 'overlapped with downloads'}) ---")
+        captures = []
+        local_wbfft_paths = {}
+        for measurement_name in args.measurement:
+            m_config = measurement_configs[measurement_name]
+            wbfft_config_cmd = f"/wbfft/configuration startFreq {config['startFreq']} endFreq {config['endFreq']} outputFormat {config['outputFormat']} fftSize {config['fftSize']} windowMode {config['windowMode']} averagingMode {config['averagingMode']} samplingRate {config['samplingRate']} adcSelect {m_config['adcSelect']} runDuration {config['runDuration']} triggerCount {config['triggerCount']} aggrPeriod {config['aggrPeriod']}"
+            remote_wbfft_base = f"/tmp/WBFFT_{measurement_name}"
+            local_wbfft_base = os.path.join(path, f"WBFFT_{m_config['output_prefix']}")
+            local_wbfft_paths[measurement_name] = local_wbfft_base
+            captures.append(wbfft_scheduler.WbfftCapture(measurement_name, wbfft_config_cmd, remote_wbfft_base, {
+                remote_wbfft_base: local_wbfft_base,
+                f"{remote_wbfft_base}.config": f"{local_wbfft_base}.config"}))
+
+        scheduler = wbfft_scheduler.CaptureScheduler(amp, channel, transport, queue_captures=queue_captures)
+        try:
+            calibration = scheduler.submit(prepare_calibration)
+            scheduler.run(captures, process_measurement)
+        finally:
+            scheduler.close()
+        logging.debug("All captures downloaded and processed.")
 
         # --- Stage 5: Consolidate and save final results ---
         logging.debug("--- Stage 5: Consolidating final results ---")
@@ -642,13 +671,12 @@ def main():
             
             # --- End Plotly Section ---
 
-            if all_power_results:
-                final_power_df = all_power_results[0]
-                for i in range(1, len(all_power_results)):
-                    final_power_df = pd.merge(final_power_df, all_power_results[i], on=['CenterFrequency_MHz', 'Bandwidth_MHz'], how='outer')
-
-                final_power_df['CF_sort_key'] = pd.to_numeric(final_power_df['CenterFrequency_MHz'])
-                final_power_df = final_power_df.sort_values(by='CF_sort_key').drop(columns=['CF_sort_key'])
+            if power_columns:
+                final_power_df = pd.DataFrame({'CenterFrequency_MHz': channel_plan.cf_hz / 1e6,
+                                               'Bandwidth_MHz': channel_plan.bw_hz / 1e6, **power_columns})
+                final_power_df = final_power_df.sort_values(by='CenterFrequency_MHz', kind='stable')
+                for column in ('CenterFrequency_MHz', 'Bandwidth_MHz'):
+                    final_power_df[column] = final_power_df[column].map('{:.3f}'.format)
 
                 final_power_csv_path = os.path.join(path, f"WBFFT_Combined_ChannelPower{identifier_suffix}{appendix}.csv")
                 final_power_df.to_csv(final_power_csv_path, index=False, float_format='%.2f')
@@ -660,7 +688,8 @@ def main():
         logging.debug("Closing connections...")
         if channel: channel.close()
         if target_client: target_client.close()
-        if not args.no_jump and jumpbox_client: jumpbox_client.close()
+        if broker_client: broker_client.close()
+        jumpbox_pool.close_all()
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,29 @@
 ### EC info collector - console (CLI) + GE (SCP) + Display
+# v6.0.22: The remote EC dat files are deleted before each cycle's ec_pnm_stats, so a reader can no longer
+#          take the previous cycle's complete dump for this cycle's; amps that cannot delete them (CS/CC)
+#          read what each file holds before its first command (and again after an incomplete read) and
+#          reject a dump identical to that baseline. Stream-mode polls back off up to 1 s.
+# v6.0.21: Continuous mode keeps the last --ring-capacity cycles in ec_ring (memory-mapped float32 ring
+#          shared with viewers; older cycles spill to disk segments).
+# v6.0.20: --change-threshold: in continuous mode only traces that changed (RMS dB delta or peak set) since
+#          they were last saved are rendered and stored, plus a keyframe every --keyframe-every cycles.
+# v6.0.19: High-resolution TDR options: --tdr-window, --tdr-pad and --tdr-interp (peaks located between bins).
+# v6.0.18: Time-domain coefficients come from tdr.TdrEngine (batched IFFT, cached axes); --vop sets the
+#          velocity of propagation of the distance axis.
+# v6.0.17: Pipelined collection: the shell issues the next ec_pnm_stats while --fetch-workers threads
+#          download and decode earlier dumps.
+# v6.0.16: Continuous mode appends each cycle to ec_history (npz segments + index) instead of rewriting
+#          the wide CSVs every cycle; the CSVs are exported from the history when the run ends.
+#          After a run that was killed: python ec_history.py <path>/history<suffix> exports them.
+# v6.0.15: Plot HTML/JSON is written by ec_render.RenderWorker (background thread, coalesced, rate-limited,
+#          shared plotly.min.js) instead of after every dat file; --render-interval sets the rate.
+# v6.0.14: Per-cycle data lives in ec_cycle.EcCycle (preallocated arrays, zero-copy full-band views).
+# v6.0.13: EC dat files are decoded by ec_parser (header once, body in one NumPy call).
+# v6.0.12: Waits and command timeouts adapt to observed latencies (timing_profile.py).
+# v6.0.11: EC dat files are read into memory over the SSH session (--transfer stream, default)
+#          instead of sleep + SCP + local re-read; --save-dat keeps the raw files.
+# v6.0.10: Added --broker to reuse an amp session held by amp_broker.py.
+# v6.0.9: Jumpbox transport comes from jumpbox_pool (one authenticated transport per process).
 # v6.0.7: Fixed bug where filenames used MAC when an IP was provided.
 # v6.0.6: Added --ip, --mac, and --domain command-line arguments to override config values.
 # v6.0.5: Added validation to check if the 'ec_pnm_stats' command executed successfully
@@ -17,9 +42,7 @@ python ec.py --image 'CC' --ip '2001:0558:6043:003F:2855:D2DC:2D77:FD23'
 
 
 
-import paramiko
 import sys
-from paramiko import SSHClient
 from scp import SCPClient, SCPException
 import os
 import csv
@@ -28,19 +51,29 @@ import subprocess
 import time
 import ipaddress
 import argparse
-import numpy as np
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 import macaddress
 from itertools import zip_longest
-from scipy.signal import find_peaks
 import plotly.graph_objects as go
 import plotly.io as pio
 from plotly.subplots import make_subplots
 import logging
+import jumpbox_pool
 
 
 # New unified library imports
 import amp_config_manager
 import amp_library
+import amp_broker
+import timing_profile
+import ec_parser
+import ec_cycle
+import ec_render
+import ec_history
+import tdr
+import ec_change
+import ec_ring
 
 # --- Command-line argument parsing and conditional imports ---
 parser = argparse.ArgumentParser(description='FDX-AMP Echo Cancellation Data Collector.')
@@ -59,6 +92,33 @@ parser.add_argument('--domain', type=str, help="Optional. CM domain for IP looku
 parser.add_argument('--show-cancellation-depth', action='store_true', default=False,
                     help="Include Cancellation Depth in plots and CSVs (default: not shown).")
 parser.add_argument('--path_date', type=str, help="Optional. Date string for output path.")
+parser.add_argument('--transfer', type=str, choices=['stream', 'scp'], default='stream',
+                    help="How EC dat files are retrieved: stream (read into memory as soon as complete) or scp (fixed wait, then SCP to disk).")
+parser.add_argument('--save-dat', action='store_true', default=False,
+                    help="With --transfer stream, also write the raw EC dat files to the output directory.")
+parser.add_argument('--broker', type=str, nargs='?', const=amp_broker.DEFAULT_SOCKET, default=None,
+                    help="Optional. Run amp commands through the session broker on this Unix socket (default socket if no path given).")
+parser.add_argument('--vop', type=float, default=tdr.DEFAULT_VOP,
+                    help="Velocity of propagation for the distance axis (default: %(default)s; 0.82 for RG6).")
+parser.add_argument('--tdr-window', type=str, choices=tdr.WINDOWS, default='none',
+                    help="Window applied to the EC coefficients before the IFFT (default: none).")
+parser.add_argument('--tdr-kaiser-beta', type=float, default=tdr.DEFAULT_KAISER_BETA,
+                    help="Kaiser window beta for --tdr-window kaiser (default: %(default)s).")
+parser.add_argument('--tdr-pad', type=int, default=1,
+                    help="Zero-padding factor of the IFFT; N gives an N times finer time/distance grid (default: 1).")
+parser.add_argument('--tdr-interp', type=str, choices=tdr.INTERPOLATIONS, default='none',
+                    help="Sub-bin peak interpolation for the detected peaks: parabolic or sinc (default: none).")
+parser.add_argument('--fetch-workers', type=int, default=4,
+                    help="Threads that download and decode EC dat files while the next one is requested (default: %(default)s).")
+parser.add_argument('--change-threshold', type=float, default=None,
+                    help="Continuous mode: only render/store traces whose RMS change since last stored exceeds this many dB "
+                         "(or whose peaks moved). Default: store every cycle.")
+parser.add_argument('--keyframe-every', type=int, default=ec_change.DEFAULT_KEYFRAME_EVERY,
+                    help="With --change-threshold, store and render everything every N cycles (default: %(default)s).")
+parser.add_argument('--ring-capacity', type=int, default=ec_ring.DEFAULT_CAPACITY,
+                    help="Continuous mode: cycles kept in the live ring buffer for waterfall/trend viewers; 0 disables (default: %(default)s).")
+parser.add_argument('--render-interval', type=float, default=ec_render.DEFAULT_MIN_INTERVAL,
+                    help="Minimum seconds between rewrites of the live plot HTML/JSON files (default: %(default)s).")
 args = parser.parse_args()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -143,55 +203,67 @@ def scp_get_with_retry(scp_client, remote_path, local_path, retries=3, delay=3):
 
     return False
 
-def save_trace_to_csv(filepath, headers, x_data, y_data, run_single):
-    logging.debug("save_trace_to_csv called.")
-    logging.debug(f"Saving trace to CSV at '{filepath}' with headers {headers}. Run single: {run_single}")
-    """Saves trace data to a CSV file.
-    In single-run mode, it creates a new file.
-    In continuous mode, it appends the new y_data as a new column.
+EC_DAT_HEADER = re.compile(r"StatType:|NumBins:|StartFreq:|PerBin")
+
+def ec_dat_complete(text):
+    """True once an ec_pnm_stats dump holds as many data rows as its NumBins header announces."""
+    match_bins = re.search(r"NumBins:(\d+)", text)
+    if not match_bins:
+        return False
+    rows = sum(1 for line in text.splitlines() if line.strip() and not EC_DAT_HEADER.search(line))
+    return rows >= int(match_bins.group(1))
+
+def read_ec_dat(amp, transport, remote_path, wait_time=3, poll_interval=0.1, max_poll_interval=1.0, timing=None,
+                command=None, start_time=None, stale=None):
+    """Reads an ec_pnm_stats dump straight off the amp, re-reading until the amp has finished writing it.
+
+    Replaces the fixed sleep + SCP + local re-read. Returns the file text, or None if it
+    cannot be read; after wait_time an incomplete file is returned as-is. With a timing
+    profile, the time until the file was complete is recorded against the command.
+    start_time is when the dump was requested (default: now); wait_time counts from it.
+    The interval between reads doubles from poll_interval up to max_poll_interval, since
+    each read opens a channel (an SCP session on amps without an exec channel).
+    stale is what the path held before the command, for amps where the old file could not
+    be deleted first: the same text is not accepted as the new dump (None at wait_time).
     """
-    if not y_data:
-        return
-
-    file_exists = os.path.exists(filepath)
-
-    if run_single or not file_exists:
-        if not x_data:
-             # print(f"Warning: Cannot create new CSV {filepath} without x_data.")
-             return
+    start_time = time.time() if start_time is None else start_time
+    deadline = start_time + wait_time
+    while True:
         try:
-            with open(filepath, 'w', newline='') as f:
-                writer = csv.writer(f)
-                timestamp_header = f"{headers[1]}_{time.strftime('%Y%m%d_%H%M%S')}"
-                writer.writerow([headers[0], timestamp_header])
-                writer.writerows(zip(x_data, y_data))
-        except Exception as e:
-            print(f"Error writing new CSV to {filepath}: {e}")
+            text = amp.read_file(transport, remote_path).decode("utf-8", errors="replace")
+        except FileNotFoundError as e:
+            text = None
+            logging.debug(f"Could not read {remote_path}: {e}")
+        if text is not None and stale is not None and text == stale:
+            text = None     # still the previous cycle's dump
+        elif text is not None and ec_dat_complete(text):
+            if timing is not None and command:
+                timing.record(command, time.time() - start_time, key=timing_profile.ready_key(command))
+            return text
+        if time.time() >= deadline:
+            if timing is not None and command:
+                timing.record_timeout(command, time.time() - start_time, key=timing_profile.ready_key(command))
+            return text
+        time.sleep(min(poll_interval, max(0.0, deadline - time.time())))
+        poll_interval = min(poll_interval * 2, max_poll_interval)
+
+def save_trace_to_csv(filepath, headers, x_data, y_data):
+    """Writes one trace to a new two-column CSV (single-run mode).
+
+    Continuous mode does not come here: its traces go to ec_history, which
+    exports the wide one-column-per-cycle CSVs.
+    """
+    logging.debug(f"Saving trace to CSV at '{filepath}' with headers {headers}.")
+    if len(y_data) == 0 or len(x_data) == 0:
         return
-
     try:
-        with open(filepath, 'r', newline='') as f:
-            reader = csv.reader(f)
-            existing_rows = list(reader)
-
-        if not existing_rows:
-             save_trace_to_csv(filepath, headers, x_data, y_data, True)
-             return
-
-        new_y_header = f"{headers[1]}_{time.strftime('%Y%m%d_%H%M%S')}"
-        existing_rows[0].append(new_y_header)
-
-        num_data_rows = len(existing_rows) - 1
-        for i in range(num_data_rows):
-            new_value = y_data[i] if i < len(y_data) else ''
-            existing_rows[i+1].append(new_value)
-
         with open(filepath, 'w', newline='') as f:
             writer = csv.writer(f)
-            writer.writerows(existing_rows)
-
+            timestamp_header = f"{headers[1]}_{time.strftime('%Y%m%d_%H%M%S')}"
+            writer.writerow([headers[0], timestamp_header])
+            writer.writerows(zip(x_data, y_data))
     except Exception as e:
-        print(f"Error updating CSV {filepath} by adding a column: {e}")
+        print(f"Error writing new CSV to {filepath}: {e}")
 
 # --- Modified Section: Override config with command-line arguments ---
 # Config parameters (defaults from config file)
@@ -377,43 +449,220 @@ if plot_psd_window:
 # If you want responsive resizing, use pio.show(fig, config={"responsive": True}) when displaying,
 # but do NOT set a 'responsive' property on the layout object itself.
 
+# --- Plot rendering runs in the background; the collection loop only queues trace data ---
+renderer = ec_render.RenderWorker(min_interval=args.render_interval)
+renderer.add_figure('coef', fig_coef, html_path=f"{path}/EC_Coefficients{identifier_suffix}.html",
+                    json_path=f"{path}/EC_Coefficients{identifier_suffix}.json")
+renderer.add_figure('psd', fig_psd, html_path=f"{path}/EC_PSD_Metrics{identifier_suffix}.html",
+                    json_path=f"{path}/EC_PSD_Metrics{identifier_suffix}.json")
+renderer.start()
+# Latest data sent to each fig_coef trace (the figures themselves belong to the renderer).
+coef_traces = {}
+# Continuous-mode traces accumulate here (constant cost per cycle) and are exported to the wide CSVs at the end.
+history = None if run_single else ec_history.HistoryStore(f"{path}/history{identifier_suffix}")
+if history is not None:
+    logging.info(f"Trace history: {history.directory}. The wide CSVs are written when the run ends; "
+                 f"if it is killed, run: python ec_history.py {history.directory}")
+# Continuous mode with --change-threshold: plot updates are held until the cycle ends and only changed traces go out.
+detector = None
+if not run_single and args.change_threshold is not None:
+    detector = ec_change.ChangeDetector(args.change_threshold, keyframe_every=args.keyframe_every)
+deferred_updates = {}
+# Continuous mode: recent cycles for live waterfall/trend views (fixed RAM; older cycles spill to disk).
+ring = None
+if not run_single and args.ring_capacity > 0:
+    ring = ec_ring.EcRing(f"{path}/ring{identifier_suffix}", capacity=args.ring_capacity)
+# Peak positions (raw IFFT bins) of each time coef trace, for the change detector.
+coef_peaks = {}
+
+# Latencies observed on this image/firmware set the waits and timeouts (defaults until enough samples exist).
+timing = timing_profile.TimingProfile(timing_profile.DEFAULT_PATH, image=args.image)
+
 # --- SSH Connection Logic ---
-if not args.no_jump:
-    logging.debug("--- Starting Data Collection Cycle (via Jump Server) ---")
-    jumpbox_client = paramiko.SSHClient()
-    jumpbox_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+# With --broker the session (and its jumpbox transport) lives in amp_broker.py and is reused across runs.
+if args.broker:
+    broker_client = amp_broker.BrokerClient(args.broker)
+    amp = amp_broker.BrokerAmp(broker_client, args.image, target_hostname, config, args.no_jump)
+    channel, transport = None, None
+    target_scp_client = amp.scp_client()
+else:
+    # The jumpbox transport is pooled; each amp gets its own direct-tcpip channel over it.
+    if not args.no_jump:
+        logging.debug("--- Starting Data Collection Cycle (via Jump Server) ---")
+        try:
+            jumpbox_pool.get_pool(config['jumpbox_hostname'], config['jumpbox_username']).transport
+        except Exception as e:
+            print("\a")  # Play beep sound
+            # print("\nJumpbox Connect Failed, make sure you are freshly authenticated!\n")
+            logging.error(f"Error details: {e}")
+            sys.exit(1)
+    target_client = jumpbox_pool.connect_target(config, target_hostname, args.no_jump)
+    transport = target_client.get_transport()
+
+    channel = amp_library.AmpSession(target_client.invoke_shell()); channel.settimeout(1000)
+    target_scp_client = SCPClient(transport)
+    amp.timing = timing
+
+def fetch_ec_stats(statsType, filename, command, issued_at):
+    """Pipeline worker: retrieves one ec_pnm_stats dump and parses it. Returns an EcStats record, or None."""
+    source = f"/tmp/{filename}"
+    destination = f'{path}/{filename}'
+    # Until a complete dump is read, the remote contents are unknown: the next cycle takes a new baseline.
+    stale = None if dat_removed else previous_dat.pop(filename, None)
+
+    if args.transfer == 'stream':
+        # Parse straight from memory as soon as the amp has written every bin.
+        dat_text = read_ec_dat(amp, transport, source, wait_time=3 if statsType == 8 else 2,
+                               timing=timing, command=command, start_time=issued_at, stale=stale)
+        if dat_text is None:
+            logging.warning(f"No new {filename} from the amp this cycle; skipping it.")
+            return None
+        if args.save_dat:
+            with open(destination, 'w') as f:
+                f.write(dat_text)
+    else:
+        # Learned from stream-mode runs; the old fixed waits until then (counted from when the command returned).
+        time.sleep(max(0.0, issued_at + timing.wait(timing_profile.ready_key(command), 2 if statsType == 8 else 1) - time.time()))
+
+        # SCPClient is not thread-safe, so each fetch opens its own on the shared transport.
+        scp_client = target_scp_client if args.broker else SCPClient(transport)
+        if not scp_get_with_retry(scp_client, source, destination):
+            # print(f"Could not retrieve {filename}. Skipping this file.")
+            return None
+        with open(destination, 'r') as file:
+            dat_text = file.read()
+        if stale is not None and dat_text == stale:
+            logging.warning(f"{filename} is unchanged since the last cycle; skipping it.")
+            return None
+
+    if ec_dat_complete(dat_text):
+        previous_dat[filename] = dat_text
+    # print(f"Decoding file: {destination}")
+    return ec_parser.parse_ec_dat(dat_text)
+
+def render_update(fig_name, trace_idx, x, y):
+    if detector is not None:
+        deferred_updates[(fig_name, trace_idx)] = (x, y)
+    else:
+        renderer.update(fig_name, trace_idx, x, y)
+
+def update_coef_trace(trace_idx, x, y):
+    coef_traces[trace_idx] = (x, y)
+    render_update('coef', trace_idx, x, y)
+
+def render_changed_traces():
+    """End of cycle with change detection: sends only the traces that changed (all of them on a keyframe)."""
+    channels_changed = False
+    for (fig_name, trace_idx), (x, y) in deferred_updates.items():
+        if (fig_name, trace_idx) == ('coef', 6):
+            continue
+        peaks = coef_peaks.get(trace_idx) if fig_name == 'coef' and trace_idx < 6 else None
+        if detector.changed(f"{fig_name}:{trace_idx}", y, peaks):
+            renderer.update(fig_name, trace_idx, x, y)
+            channels_changed |= fig_name == 'coef' and trace_idx < 6
+    # The peak markers follow the time coef channels.
+    if ('coef', 6) in deferred_updates and (channels_changed or detector.keyframe):
+        renderer.update('coef', 6, *deferred_updates[('coef', 6)])
+    deferred_updates.clear()
+
+def add_ec_stats(statsType, stats):
+    """Adds a decoded dump to the current cycle and queues the live plot updates (collection thread only)."""
+    if stats is None:
+        return
+    # if not stats.complete:
+    #     print(f"  WARNING: Incomplete file. Expected {stats.num_bins} bins, found {len(stats.values)}.")
+    cycle.add(stats, floor=-60 if stats.stat_type == 8 else None)
+
+    # --- Live Plot Updates ---
+    # print("Updating plots...")
+    if plot_coef_window:
+        # Time Coef traces (ch0-ch5) are traces 0-5 in col=1
+        if statsType == 1 and cycle.count(1) > 0:
+            channel_freq_data = []
+            channel_indices = []
+            for i in range(num_of_subband):
+                subband_data = cycle.coef_subband(i)
+                actual_bins = len(subband_data)
+                if actual_bins == 0: continue
+                if actual_bins < (cycle.num_bins[i] * 0.75):
+                    channel_freq_data.append(subband_data)
+                    channel_indices.append(i * 2)
+                else:
+                    midpoint = actual_bins // 2
+                    channel_freq_data += [subband_data[:midpoint], subband_data[midpoint:]]
+                    channel_indices += [i * 2, i * 2 + 1]
+            channels = [(data, index) for data, index in zip(channel_freq_data, channel_indices) if len(data) > 0 and index < 6]
+            # One batched IFFT for all channels; the first half of each impulse is plotted.
+            traces = tdr_engine.analyze([data for data, _ in channels], half=True, floor=-100,
+                                        height=-50, prominence=1, max_peaks=12)
+            for (_, channel_index), trace in zip(channels, traces):
+                xtime = trace.distance_ft if args.time_axis == 'distance' else trace.one_way_us
+                y_data = trace.db
+                xtime_shifted = xtime
+                if len(trace.peaks) > 0:
+                    # Shift so the earliest of the prominent peaks sits at zero (sub-bin with --tdr-interp).
+                    peak_x = trace.peak_x(xtime)
+                    time_shift = peak_x.min()
+                    xtime_shifted = xtime - time_shift
+                    all_peak_x.extend(peak_x - time_shift)
+                    all_peak_y.extend(trace.peak_db)
+                coef_peaks[channel_index] = trace.peak_index / tdr_engine.pad
+                update_coef_trace(channel_index, xtime_shifted, y_data)
+        # Peak marker trace is trace 6 in col=1
+        update_coef_trace(6, all_peak_x, all_peak_y)
+        # Frequency Coef (all sub-bands) is trace 7 in col=2
+        x1, y1 = cycle.full(1)
+        update_coef_trace(7, x1, y1)
+
+    if plot_psd_window:
+        trace_offset = 0
+        if plot_cancellation_depth:
+            # Cancellation Depth
+            x3, y3 = cycle.full(3)
+            render_update('psd', 0, x3, y3)
+            trace_offset = 1
+        # Echo PSD
+        x5, y5 = cycle.full(5)
+        render_update('psd', trace_offset + 0, x5, y5)
+        # Residual Echo PSD
+        x6, y6 = cycle.full(6)
+        render_update('psd', trace_offset + 1, x6, y6)
+        # Downstream PSD
+        x7, y7 = cycle.full(7)
+        render_update('psd', trace_offset + 2, x7, y7)
+        # Upstream PSD
+        x8, y8 = cycle.full(8)
+        render_update('psd', trace_offset + 3, x8, y8)
+        # RL and RxSNR traces if enabled
+        if plot_rl_trace:
+            render_update('psd', trace_offset + 4, x7, cycle.return_loss())
+        if plot_rxsnr_trace:
+            render_update('psd', trace_offset + 5, x8, cycle.rx_snr())
+
+tdr_engine = tdr.TdrEngine(vop=args.vop, window=args.tdr_window, kaiser_beta=args.tdr_kaiser_beta,
+                           pad=args.tdr_pad, interpolation=args.tdr_interp)
+previous_dat = {}   # dat file name -> text the remote file holds (None: absent), when the amp cannot delete it
+dat_removed = False
+
+def read_dat_baseline(filename):
+    """What /tmp/<filename> holds before its ec_pnm_stats (None if absent), for amps that cannot delete it."""
     try:
-        jumpbox_client.connect(config['jumpbox_hostname'], username=config['jumpbox_username'])
+        return amp.read_file(transport, f"/tmp/{filename}").decode("utf-8", errors="replace")
+    except FileNotFoundError:
+        return None
     except Exception as e:
-        print("\a")  # Play beep sound
-        # print("\nJumpbox Connect Failed, make sure you are freshly authenticated!\n")
-        logging.error(f"Error details: {e}")
-        sys.exit(1)
-    transport = jumpbox_client.get_transport()
-    dest_addr = (target_hostname, 22)
-    jumpbox_channel = transport.open_channel("direct-tcpip", dest_addr, ('', 0))
-    target_client = paramiko.SSHClient()
-    target_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    target_client.connect(target_hostname, username=config['target_username'], password=config['target_password'], sock=jumpbox_channel)
-else:
-    # print("--- Starting Data Collection Cycle (Direct Connection) ---")
-    target_client = paramiko.SSHClient()
-    target_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    target_client.connect(target_hostname, username=config['target_username'], password=config['target_password'])
-
-channel = target_client.invoke_shell(); channel.settimeout(1000)
-target_scp_client = SCPClient(target_client.get_transport())
+        logging.warning(f"Could not read the previous /tmp/{filename} ({e}); accepting the next complete dump.")
+        return None
+fetch_pool = ThreadPoolExecutor(max_workers=max(1, args.fetch_workers), thread_name_prefix="ec-fetch")
 
 while True:
-    num_of_stattype = 11
-    num_of_subband = 3
-    data = [[[] for _ in range(num_of_subband)] for _ in range(num_of_stattype)]
-    freq = [[[] for _ in range(num_of_subband)] for _ in range(num_of_stattype)]
-    freq_coef_complex = [[] for _ in range(num_of_subband)]
-    num_bins_per_subband = [0] * num_of_subband
+    num_of_subband = ec_cycle.NUM_SUBBANDS
+    cycle = ec_cycle.EcCycle()
     # Initialize lists to hold peak data for the current cycle
     all_peak_x = []
     all_peak_y = []
+    if detector is not None:
+        detector.start_cycle()
 
     try:
         if config['rfboard_commands']:
@@ -421,8 +670,9 @@ while True:
             filename = f"rfboard{identifier_suffix}{config['result_filename_appendix']}.txt"
             # print(f"Filename: {filename}")
             with open(os.path.join(path, filename), 'w') as f:
-                for command in config['rfboard_commands']:
-                    ret += amp.rf_comm(channel, command)
+                ret += "".join(amp.rf_parallel(transport, channel, config['rfboard_commands'],
+                                               setup=config.get('rfboard_setup_commands', [])))
+                timing.set_firmware(timing_profile.firmware_from_output(ret))
                 lines = ret.splitlines()
                 lines = [line.strip() for line in lines if line.strip()]
                 cleaned_string = '\n'.join(lines)
@@ -434,14 +684,24 @@ while True:
             filename = f"hal{identifier_suffix}{config['result_filename_appendix']}.txt"
             # print(f"Filename: {filename}")
             with open(os.path.join(path, filename), 'w') as f:
-                for command in config['hal_commands']:
-                    ret += amp.hal_comm(channel, command, "InputPower")
+                ret += "".join(amp.hal_parallel(transport, channel, config['hal_commands']))
                 lines = ret.splitlines()
                 lines = [line.strip() for line in lines if line.strip()]
                 cleaned_string = '\n'.join(lines)
                 f.write(cleaned_string)
                 # print(f"Successfully wrote to {filename}")
 
+        # Pipeline: this (shell) thread issues the next ec_pnm_stats while fetch_pool workers
+        # download and decode the dumps already requested; results are added to the cycle here.
+        # Every cycle writes the same remote paths: delete last cycle's dumps first, so a finished old
+        # file is never read as this cycle's (amps without an exec channel fall back to previous_dat).
+        dat_removed = amp.remove_files(transport, [f"/tmp/EC_{s}_{sb}.dat" for s in lstatType for sb in lsubBandId])
+        if not dat_removed:
+            # Files whose remote contents are unknown (first cycle, or an incomplete read last cycle).
+            for filename in [f"EC_{s}_{sb}.dat" for s in lstatType for sb in lsubBandId]:
+                if filename not in previous_dat:
+                    previous_dat[filename] = read_dat_baseline(filename)
+        pending = {}
         for statsType in lstatType:
             for subBandId in lsubBandId:
                 filename = f"EC_{statsType}_{subBandId}.dat"
@@ -455,199 +715,8 @@ while True:
 
                 if info_count >= 2 and not fail_present:
                     # print(f"Command '{command}' executed successfully.")
-
-                    if statsType == 8:
-                        time.sleep(2)
-                    else:
-                        time.sleep(1)
-
-                    source = f"/tmp/{filename}"
-                    destination = f'{path}/{filename}'
-
-                    if not scp_get_with_retry(target_scp_client, source, destination):
-                        # print(f"Could not retrieve {filename}. Skipping this file.")
-                        continue
-
-                    # print(f"Decoding file: {destination}")
-                    with open(destination, 'r') as file:
-                        reader = csv.reader(file)
-                        temp_statType, temp_numBins, temp_startFreq, temp_subBand = -1, 0, 0, -1
-                        real, imag = [], []
-                        temp_data = []
-
-                        for row in reader:
-                            match_stat = re.search(r"StatType:(\d+)", str(row));
-                            if match_stat: temp_statType = int(match_stat.group(1)); continue
-
-                            match_bins = re.search(r"NumBins:(\d+)", str(row))
-                            if match_bins: temp_numBins = int(match_bins.group(1)); continue
-
-                            match_freq = re.search(r"StartFreq:(\d+)", str(row))
-                            if match_freq: temp_startFreq = int(match_freq.group(1)); continue
-
-                            if "PerBin" in str(row): continue
-
-                            if temp_subBand == -1 and temp_startFreq > 0:
-                                 temp_subBand = 0 if temp_startFreq < 150e6 else 2 if temp_startFreq > 450e6 else 1
-                                 num_bins_per_subband[temp_subBand] = temp_numBins
-
-                            temp_data.append(row)
-
-                        if temp_subBand != -1:
-                            actual_num_bins = len(temp_data)
-                            if actual_num_bins < temp_numBins:
-                                # print(f"  WARNING: Incomplete file '{filename}'. Expected {temp_numBins} bins, found {actual_num_bins}.")
-                                temp_numBins = actual_num_bins
-
-                            for row in temp_data:
-                                if temp_statType == 1:
-                                    r_val, i_val = float(row[0]), float(row[1])
-                                    real.append(r_val); imag.append(i_val)
-                                else:
-                                    value = float(row[0])
-                                    data[temp_statType][temp_subBand].append(max(value, -60) if temp_statType == 8 else value)
-
-                            if temp_statType == 1:
-                                data[temp_statType][temp_subBand] = amp.complex_to_mag_db(real, imag)
-                                freq_coef_complex[temp_subBand] = [complex(r, i) for r, i in zip(real, imag)]
-
-                            for i in range(temp_numBins):
-                                freq[temp_statType][temp_subBand].append(temp_startFreq / 1e6 + i / 10)
-
-                    # --- Live Plot Updates ---
-                    # print("Updating plots...")
-
-                    def safe_plotly_update(fig, trace_idx, x, y, row=None, col=None):
-                        if fig is None or len(fig.data) <= trace_idx:
-                            return
-                        # For subplots, use update_traces with selector and row/col
-                        if row is not None and col is not None and hasattr(fig, "update_traces"):
-                            fig.update_traces(
-                                selector=dict(name=fig.data[trace_idx].name),
-                                x=x, y=y, row=row, col=col
-                            )
-                        else:
-                            fig.data[trace_idx].x = x
-                            fig.data[trace_idx].y = y
-
-                    if plot_coef_window:
-                        # Time Coef traces (ch0-ch5) are traces 0-5 in col=1
-                        if statsType == 1 and any(freq_coef_complex):
-                            for i in range(num_of_subband):
-                                if not freq_coef_complex[i]: continue
-                                subband_data = freq_coef_complex[i]
-                                expected_bins = num_bins_per_subband[i]
-                                actual_bins = len(subband_data)
-                                channel_freq_data = []
-                                channel_indices = []
-                                if actual_bins < (expected_bins * 0.75) and actual_bins > 0:
-                                    channel_freq_data = [subband_data]
-                                    channel_indices = [i * 2]
-                                elif actual_bins > 0:
-                                    midpoint = actual_bins // 2
-                                    channel_freq_data = [subband_data[:midpoint], subband_data[midpoint:]]
-                                    channel_indices = [i * 2, i * 2 + 1]
-                                for j, channel_data in enumerate(channel_freq_data):
-                                    if not channel_data: continue
-                                    channel_index = channel_indices[j]
-                                    if channel_index >= 6: continue
-                                    time_domain = np.fft.ifft(channel_data)
-                                    with np.errstate(divide='ignore'):
-                                        time_domain_db = 20 * np.log10(np.abs(time_domain))
-                                    time_domain_db[np.isneginf(time_domain_db)] = -100
-                                    plot_len = len(channel_data) // 2
-                                    round_trip_time_us = np.array([k * (5 / plot_len) for k in range(plot_len)]) if plot_len > 0 else np.array([])
-                                    one_way_time_us = round_trip_time_us / 2.0
-                                    if args.time_axis == 'distance':
-                                        velocity_of_propagation = 0.87
-                                        speed_of_light_ft_per_ns = 0.983571056
-                                        one_way_time_ns = one_way_time_us * 1000
-                                        xtime = one_way_time_ns * velocity_of_propagation * speed_of_light_ft_per_ns
-                                    else:
-                                        xtime = one_way_time_us
-                                    y_data = time_domain_db[:plot_len]
-                                    xtime_shifted = xtime
-                                    if len(y_data) > 0:
-                                        peaks, _ = find_peaks(y_data, height=-50, prominence=1)
-                                        if len(peaks) > 0:
-                                            prominent_peaks = sorted(peaks, key=lambda p: y_data[p], reverse=True)[:12]
-                                            first_prominent_peak = sorted(prominent_peaks)[0]
-                                            time_shift = xtime[first_prominent_peak]
-                                            xtime_shifted = xtime - time_shift
-                                            all_peak_x.extend(xtime_shifted[prominent_peaks])
-                                            all_peak_y.extend(y_data[prominent_peaks])
-                                    safe_plotly_update(fig_coef, channel_index, xtime_shifted, y_data)
-                        # Peak marker trace is trace 6 in col=1
-                        safe_plotly_update(fig_coef, 6, all_peak_x, all_peak_y)
-                        # Frequency Coef (all sub-bands) is trace 7 in col=2
-                        x1 = []
-                        y1 = []
-                        for i in range(num_of_subband):
-                            if len(freq[1][i]) == len(data[1][i]) and freq[1][i]:
-                                x1 += freq[1][i]
-                                y1 += data[1][i]
-                        safe_plotly_update(fig_coef, 7, x1, y1)
-
-                    if plot_psd_window:
-                        trace_offset = 0
-                        if plot_cancellation_depth:
-                            # Cancellation Depth
-                            x3 = []
-                            y3 = []
-                            for i in range(num_of_subband):
-                                if len(freq[3][i]) == len(data[3][i]) and freq[3][i]:
-                                    x3 += freq[3][i]
-                                    y3 += data[3][i]
-                            safe_plotly_update(fig_psd, 0, x3, y3)
-                            trace_offset = 1
-                        # Echo PSD
-                        x5 = []
-                        y5 = []
-                        for i in range(num_of_subband):
-                            if len(freq[5][i]) == len(data[5][i]) and freq[5][i]:
-                                x5 += freq[5][i]
-                                y5 += data[5][i]
-                        safe_plotly_update(fig_psd, trace_offset + 0, x5, y5)
-                        # Residual Echo PSD
-                        x6 = []
-                        y6 = []
-                        for i in range(num_of_subband):
-                            if len(freq[6][i]) == len(data[6][i]) and freq[6][i]:
-                                x6 += freq[6][i]
-                                y6 += data[6][i]
-                        safe_plotly_update(fig_psd, trace_offset + 1, x6, y6)
-                        # Downstream PSD
-                        x7 = []
-                        y7 = []
-                        for i in range(num_of_subband):
-                            if len(freq[7][i]) == len(data[7][i]) and freq[7][i]:
-                                x7 += freq[7][i]
-                                y7 += data[7][i]
-                        safe_plotly_update(fig_psd, trace_offset + 2, x7, y7)
-                        # Upstream PSD
-                        x8 = []
-                        y8 = []
-                        for i in range(num_of_subband):
-                            if len(freq[8][i]) == len(data[8][i]) and freq[8][i]:
-                                x8 += freq[8][i]
-                                y8 += data[8][i]
-                        safe_plotly_update(fig_psd, trace_offset + 3, x8, y8)
-                        # RL and RxSNR traces if enabled
-                        if plot_rl_trace:
-                            y9 = [(a - b) * -1 for a, b in zip(y7, y5)] if (y7 and y5 and len(y7) == len(y5)) else []
-                            safe_plotly_update(fig_psd, trace_offset + 4, x7, y9)
-                        if plot_rxsnr_trace:
-                            y10 = [(a - b) for a, b in zip(y8, y6)] if (y8 and y6 and len(y8) == len(y6)) else []
-                            safe_plotly_update(fig_psd, trace_offset + 5, x8, y10)
-
-                    # --- Save HTML after each .dat file collection ---
-                    if fig_coef: fig_coef.write_html(f"{path}/EC_Coefficients{identifier_suffix}.html")
-                    if fig_psd: fig_psd.write_html(f"{path}/EC_PSD_Metrics{identifier_suffix}.html")
-                    # --- Save JSON for live Dash viewing ---
-                    if fig_coef: fig_coef.write_json(f"{path}/EC_Coefficients{identifier_suffix}.json")
-                    if fig_psd: fig_psd.write_json(f"{path}/EC_PSD_Metrics{identifier_suffix}.json")
-                    # --- End HTML/JSON save ---
-
+                    future = fetch_pool.submit(fetch_ec_stats, statsType, filename, command, time.time())
+                    pending[future] = statsType
                 else:
                     # This block runs if the command validation fails
                     print(f"Command '{command}' FAILED or did not return expected output.")
@@ -656,37 +725,53 @@ while True:
                         print(line)
                     # print("--------------------------------------")
                     print(f"Skipping processing for {filename}.")
-                    continue
+
+                # Decode whatever finished while the amp was busy with this command.
+                for future in [f for f in pending if f.done()]:
+                    add_ec_stats(pending.pop(future), future.result())
+
+        for future in concurrent.futures.as_completed(pending):
+            add_ec_stats(pending[future], future.result())
 
         # print("\n--- Cycle complete. Saving final plots and CSVs. ---")
-        # Save plots as HTML using Plotly
-        if fig_coef: fig_coef.write_html(f"{path}/EC_Coefficients{identifier_suffix}.html")
-        if fig_psd: fig_psd.write_html(f"{path}/EC_PSD_Metrics{identifier_suffix}.html")
+        # Save plots as HTML/JSON using Plotly (written by the renderer; does not wait)
+        if detector is not None:
+            render_changed_traces()
+        renderer.commit()
         # print("Plots saved.")
 
         # Optionally, display the plots in the browser (uncomment if desired)
         #if fig_coef: pio.show(fig_coef)
         #if fig_psd: pio.show(fig_psd)
 
-        x1 = freq[1][0] + freq[1][1] + freq[1][2]; y1 = data[1][0] + data[1][1] + data[1][2]
-        x3 = freq[3][0] + freq[3][1] + freq[3][2]; y3 = data[3][0] + data[3][1] + data[3][2]
-        x5 = freq[5][0] + freq[5][1] + freq[5][2]; y5 = data[5][0] + data[5][1] + data[5][2]
-        x6 = freq[6][0] + freq[6][1] + freq[6][2]; y6 = data[6][0] + data[6][1] + data[6][2]
-        x7 = freq[7][0] + freq[7][1] + freq[7][2]; y7 = data[7][0] + data[7][1] + data[7][2]
-        x8 = freq[8][0] + freq[8][1] + freq[8][2]; y8 = data[8][0] + data[8][1] + data[8][2]
-        y9 = [(a - b) * -1 for a, b in zip(y7, y5)] if (y7 and y5 and len(y7) == len(y5)) else []
-        y10 = [(a - b) for a, b in zip(y8, y6)] if (y8 and y6 and len(y8) == len(y6)) else []
+        x1, y1 = cycle.full(1)
+        x3, y3 = cycle.full(3)
+        x5, y5 = cycle.full(5)
+        x6, y6 = cycle.full(6)
+        x7, y7 = cycle.full(7)
+        x8, y8 = cycle.full(8)
+        y9 = cycle.return_loss()
+        y10 = cycle.rx_snr()
 
-        save_trace_to_csv(f'{path}/FreqCoef{identifier_suffix}.csv', ["Frequency(MHz)", "Magnitude(dB)"], x1, y1, run_single)
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
+        # (csv name, statType, headers, x, y)
+        csv_traces = [(f'FreqCoef{identifier_suffix}.csv', 1, ["Frequency(MHz)", "Magnitude(dB)"], x1, y1)]
         # Only save cancellation depth CSV if enabled
         if plot_cancellation_depth:
-            save_trace_to_csv(f'{path}/Cancellation_Depth{identifier_suffix}.csv', ["Frequency(MHz)", "Power(dB)"], x3, y3, run_single)
-        save_trace_to_csv(f'{path}/Echo_PSD{identifier_suffix}.csv', ["Frequency(MHz)", "Power(dBmV/100kHz)"], x5, y5, run_single)
-        save_trace_to_csv(f'{path}/Residual_Echo_PSD{identifier_suffix}.csv', ["Frequency(MHz)", "Power(dBmV/100kHz)"], x6, y6, run_single)
-        save_trace_to_csv(f'{path}/Downstream_PSD{identifier_suffix}.csv', ["Frequency(MHz)", "Power(dBmV/100kHz)"], x7, y7, run_single)
-        save_trace_to_csv(f'{path}/Upstream_PSD{identifier_suffix}.csv', ["Frequency(MHz)", "Power(dBmV/100kHz)"], x8, y8, run_single)
-        if plot_rl_trace: save_trace_to_csv(f'{path}/Return_Loss{identifier_suffix}.csv', ["Frequency(MHz)", "Power(dB)"], x7, y9, run_single)
-        if plot_rxsnr_trace: save_trace_to_csv(f'{path}/Upstream_Rx_SNR{identifier_suffix}.csv', ["Frequency(MHz)", "Power(dB)"], x8, y10, run_single)
+            csv_traces.append((f'Cancellation_Depth{identifier_suffix}.csv', 3, ["Frequency(MHz)", "Power(dB)"], x3, y3))
+        csv_traces.append((f'Echo_PSD{identifier_suffix}.csv', 5, ["Frequency(MHz)", "Power(dBmV/100kHz)"], x5, y5))
+        csv_traces.append((f'Residual_Echo_PSD{identifier_suffix}.csv', 6, ["Frequency(MHz)", "Power(dBmV/100kHz)"], x6, y6))
+        csv_traces.append((f'Downstream_PSD{identifier_suffix}.csv', 7, ["Frequency(MHz)", "Power(dBmV/100kHz)"], x7, y7))
+        csv_traces.append((f'Upstream_PSD{identifier_suffix}.csv', 8, ["Frequency(MHz)", "Power(dBmV/100kHz)"], x8, y8))
+        if plot_rl_trace: csv_traces.append((f'Return_Loss{identifier_suffix}.csv', 7, ["Frequency(MHz)", "Power(dB)"], x7, y9))
+        if plot_rxsnr_trace: csv_traces.append((f'Upstream_Rx_SNR{identifier_suffix}.csv', 8, ["Frequency(MHz)", "Power(dB)"], x8, y10))
+
+        history_traces = []
+        for csv_name, stat, headers, x_data, y_data in csv_traces:
+            if run_single:
+                save_trace_to_csv(f'{path}/{csv_name}', headers, x_data, y_data)
+            elif detector is None or detector.changed(csv_name, y_data):
+                history_traces.append(ec_history.HistoryTrace(csv_name, x_data, y_data, headers[0], headers[1], stat_type=stat))
 
         # --- Replace this block ---
         # all_channels_x_data = {}
@@ -701,21 +786,17 @@ while True:
         # --- With this Plotly-based extraction ---
         all_channels_x_data = {}
         all_channels_y_data = {}
-        # In fig_coef, traces 1-6 are the time coef channels ch0-ch5
+        # In fig_coef, traces 0-5 are the time coef channels ch0-ch5 (coef_traces is keyed by trace index)
         if fig_coef:
             for i in range(6):
-                trace = fig_coef.data[1 + i]
-                x_data = list(trace.x) if trace.x is not None else []
-                y_data = list(trace.y) if trace.y is not None else []
+                x_data, y_data = (list(v) for v in coef_traces.get(i, ([], [])))
                 if len(y_data) > 0:
                     all_channels_x_data[i] = x_data
                     all_channels_y_data[i] = y_data
 
         time_coef_filepath = f'{path}/TimeCoef_IFFT_per_channel{identifier_suffix}_{args.time_axis}.csv'
-        file_exists = os.path.exists(time_coef_filepath)
-        timestamp = time.strftime('%Y%m%d_%H%M%S')
 
-        if run_single or not file_exists:
+        if run_single:
             csv_header = []
             if args.time_axis == 'distance':
                 csv_header.append("Distance(ft)")
@@ -745,41 +826,36 @@ while True:
                 rows = zip_longest(*csv_data_columns, fillvalue='')
                 writer.writerows(rows)
         else:
+            # Continuous mode: one history segment per cycle; the wide CSVs are exported at the end of the run.
+            x_header = "Distance(ft)" if args.time_axis == 'distance' else "Time(us)"
+            time_coef_name = os.path.basename(time_coef_filepath)
+            # The six channels are stored together (one column each per stored cycle) if any of them changed.
+            channels_changed = detector is None or any([
+                detector.changed(f"{time_coef_name}:ch{i}", all_channels_y_data.get(i, []), coef_peaks.get(i))
+                for i in range(6)])
+            if channels_changed:
+                for i in range(6):
+                    history_traces.append(ec_history.HistoryTrace(
+                        time_coef_name, all_channels_x_data.get(i, []), all_channels_y_data.get(i, []),
+                        x_header, "dB", stat_type=1, subband=i // 2, channel=i))
+            if detector is not None:
+                logging.info(f"Cycle {detector.cycle}: storing {len(history_traces)} changed traces"
+                             f"{' (keyframe)' if detector.keyframe else ''}.")
             try:
-                with open(time_coef_filepath, 'r', newline='') as f:
-                    reader = csv.reader(f)
-                    existing_rows = list(reader)
-
-                if not existing_rows:
-                    # print(f"Warning: {time_coef_filepath} exists but is empty. Overwriting.")
-                    pass
-                else:
-                    for i in range(6):
-                        existing_rows[0].append(f"ch{i}_dB_{timestamp}")
-
-                    max_new_rows = max(len(d) for d in all_channels_y_data.values()) if all_channels_y_data else 0
-
-                    while len(existing_rows) -1 < max_new_rows:
-                         existing_rows.append([''] * len(existing_rows[0]))
-
-                    for ch_idx in range(6):
-                        y_data_for_ch = all_channels_y_data.get(ch_idx, [])
-                        for i in range(max_new_rows):
-                             new_value = y_data_for_ch[i] if i < len(y_data_for_ch) else ''
-                             existing_rows[i+1].append(new_value)
-
-                    with open(time_coef_filepath, 'w', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerows(existing_rows)
+                history.append(timestamp, history_traces)
             except Exception as e:
-                print(f"Error updating Time Coef CSV {time_coef_filepath}: {e}")
+                print(f"Error appending cycle to history {history.directory}: {e}")
+            if ring is not None:
+                try:
+                    ring.append(cycle)
+                except Exception as e:
+                    print(f"Error appending cycle to ring buffer {ring.directory}: {e}")
 
         # print("All CSVs saved.")
 
         # --- Show plots after each data cycle ---
         # Use auto_open=False to avoid opening new browser tabs/windows each time
-        if fig_coef: pio.show(fig_coef, auto_open=False)
-        if fig_psd: pio.show(fig_psd, auto_open=False)
+        renderer.show()
 
         if run_single: 
             # print("Single run complete.")
@@ -792,9 +868,17 @@ while True:
         print("KeyboardInterrupt detected. Exiting."); break
 
 # print("Closing connections...")
+fetch_pool.shutdown(wait=True)
+renderer.close()
+if history is not None:
+    history.export(path)
+if ring is not None:
+    ring.close()
 if 'target_client' in locals() and target_client.get_transport().is_active(): target_client.close()
-if not args.no_jump and 'jumpbox_client' in locals() and jumpbox_client.get_transport().is_active(): jumpbox_client.close()
+jumpbox_pool.close_all()
+timing.save()
 if 'target_scp_client' in locals(): target_scp_client.close()
+if 'broker_client' in locals(): broker_client.close()
 if not run_single: time.sleep(1)
 
 # print("Script finished.")
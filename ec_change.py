@@ -0,0 +1,74 @@
+# EC Change Detection
+# Version: 1.0
+#
+# Description:
+# Decides which traces of a continuous-mode cycle are worth persisting or
+# re-rendering. Each trace is compared with the last version that was let
+# through: it counts as changed when the RMS difference of its dB values
+# exceeds a threshold, when its length changes, or when its set of peaks
+# (count, or any position moving by more than a tolerance) changes. Every
+# keyframe_every cycles everything is let through regardless, so outputs never
+# go stale for long. Because the reference only moves when a trace is let
+# through, slow drift still accumulates until it crosses the threshold.
+#
+# Usage:
+#   detector = ChangeDetector(rms_threshold_db=0.5, keyframe_every=30)
+#   detector.start_cycle()
+#   if detector.changed("Echo_PSD", y): persist(y)
+#   if detector.changed("coef:0", y, peaks=peak_bins): render(y)
+
+import numpy as np
+
+DEFAULT_KEYFRAME_EVERY = 30
+DEFAULT_PEAK_TOLERANCE = 1.0    # in the units of the peaks passed (ec.py passes raw IFFT bins)
+
+
+class ChangeDetector:
+    """Per-trace change test against the last state that was let through, with periodic keyframes."""
+
+    def __init__(self, rms_threshold_db, keyframe_every=DEFAULT_KEYFRAME_EVERY, peak_tolerance=DEFAULT_PEAK_TOLERANCE):
+        self.rms_threshold_db = rms_threshold_db
+        self.keyframe_every = keyframe_every
+        self.peak_tolerance = peak_tolerance
+        self.cycle = 0
+        self.state = {}
+
+    @property
+    def keyframe(self):
+        """True on the first cycle and every keyframe_every cycles after it (never, if keyframe_every <= 0)."""
+        if self.cycle <= 1:
+            return True
+        return self.keyframe_every > 0 and (self.cycle - 1) % self.keyframe_every == 0
+
+    def start_cycle(self):
+        self.cycle += 1
+
+    def rms_delta(self, previous, current):
+        """RMS difference (dB) over the bins finite in both traces; inf if the traces cannot be compared."""
+        if len(previous) != len(current):
+            return np.inf
+        if len(current) == 0:
+            return 0.0
+        finite = np.isfinite(previous) & np.isfinite(current)
+        if not finite.any():
+            return 0.0 if np.array_equal(previous, current, equal_nan=True) else np.inf
+        return float(np.sqrt(np.mean((current[finite] - previous[finite]) ** 2)))
+
+    def peaks_changed(self, previous, current):
+        if previous is None or current is None:
+            return previous is not current
+        if len(previous) != len(current):
+            return True
+        return bool(len(current)) and float(np.max(np.abs(np.sort(current) - np.sort(previous)))) > self.peak_tolerance
+
+    def changed(self, key, values, peaks=None):
+        """True if the trace should be persisted/rendered; the trace then becomes the new reference."""
+        values = np.asarray(values, dtype=np.float64)
+        peaks = None if peaks is None else np.asarray(peaks, dtype=np.float64)
+        previous = self.state.get(key)
+        changed = (self.keyframe or previous is None
+                   or self.rms_delta(previous[0], values) > self.rms_threshold_db
+                   or self.peaks_changed(previous[1], peaks))
+        if changed:
+            self.state[key] = (values.copy(), None if peaks is None else peaks.copy())
+        return changed
@@ -0,0 +1,116 @@
+# EC Cycle Data Model
+# Version: 1.0
+#
+# Description:
+# Holds one collection cycle of EC statistics (all stat types, all three
+# sub-bands) in preallocated NumPy arrays. Each stat type keeps its sub-bands
+# packed back to back in sub-band order, with per-sub-band bin counts, so the
+# full-band trace is a zero-copy slice of one array and adding a sub-band is a
+# single array assignment (plus a shift of any later sub-bands when they
+# arrived first). Return loss and RxSNR are computed as array differences.
+
+import numpy as np
+
+NUM_SUBBANDS = 3
+STAT_TYPES = (1, 3, 5, 6, 7, 8)
+COEF_STAT_TYPE = 1
+# Bins reserved per sub-band; arrays grow if a sub-band is larger.
+DEFAULT_SUBBAND_BINS = 2048
+
+
+class EcCycle:
+    """Per-cycle EC data: freq (MHz) and value arrays per stat type, complex coefficients for stat 1."""
+    __slots__ = ('freq', 'values', 'coef', 'counts', 'num_bins')
+
+    def __init__(self, stat_types=STAT_TYPES, subband_bins=DEFAULT_SUBBAND_BINS):
+        capacity = NUM_SUBBANDS * subband_bins
+        self.freq = {stat: np.empty(capacity) for stat in stat_types}
+        self.values = {stat: np.empty(capacity) for stat in stat_types}
+        self.coef = np.empty(capacity, dtype=np.complex128)
+        self.counts = {stat: np.zeros(NUM_SUBBANDS, dtype=np.intp) for stat in stat_types}
+        # NumBins announced by the last dump of each sub-band (may exceed the bins received).
+        self.num_bins = [0] * NUM_SUBBANDS
+
+    def _arrays(self, stat):
+        arrays = [self.freq[stat], self.values[stat]]
+        if stat == COEF_STAT_TYPE:
+            arrays.append(self.coef)
+        return arrays
+
+    def _grow(self, stat, needed):
+        capacity = max(needed, 2 * len(self.values[stat]))
+        for name in ('freq', 'values'):
+            table = getattr(self, name)
+            grown = np.empty(capacity, dtype=table[stat].dtype)
+            grown[:len(table[stat])] = table[stat]
+            table[stat] = grown
+        if stat == COEF_STAT_TYPE:
+            grown = np.empty(capacity, dtype=self.coef.dtype)
+            grown[:len(self.coef)] = self.coef
+            self.coef = grown
+
+    def offset(self, stat, subband):
+        return int(self.counts[stat][:subband].sum())
+
+    def count(self, stat):
+        """Bins stored for a stat type over all sub-bands."""
+        return int(self.counts[stat].sum())
+
+    def add(self, stats, floor=None):
+        """Stores a parsed ec_parser.EcStats record in its sub-band, replacing any earlier one.
+
+        `floor` clips the values from below (statType 8 is floored at -60 dB).
+        """
+        stat, subband, n = stats.stat_type, stats.subband, len(stats.values)
+        if stat not in self.values or subband < 0:
+            return
+        self.num_bins[subband] = stats.num_bins
+        start = self.offset(stat, subband)
+        old = int(self.counts[stat][subband])
+        total = self.count(stat)
+        if total - old + n > len(self.values[stat]):
+            self._grow(stat, total - old + n)
+        tail = slice(start + old, total)
+        for array in self._arrays(stat):
+            # Later sub-bands that arrived first move to make room (overlapping copies are safe in NumPy).
+            array[start + n:total - old + n] = array[tail]
+        self.freq[stat][start:start + n] = stats.freq_mhz()
+        if stat == COEF_STAT_TYPE:
+            self.coef[start:start + n] = stats.values
+            self.values[stat][start:start + n] = stats.mag_db()
+        elif floor is not None:
+            np.maximum(stats.values, floor, out=self.values[stat][start:start + n])
+        else:
+            self.values[stat][start:start + n] = stats.values
+        self.counts[stat][subband] = n
+
+    def full(self, stat):
+        """(freq, values) over all sub-bands received so far; views, not copies."""
+        n = self.count(stat)
+        return self.freq[stat][:n], self.values[stat][:n]
+
+    def subband(self, stat, subband):
+        """(freq, values) of one sub-band; views, not copies."""
+        start = self.offset(stat, subband)
+        end = start + int(self.counts[stat][subband])
+        return self.freq[stat][start:end], self.values[stat][start:end]
+
+    def coef_subband(self, subband):
+        """Complex frequency-domain EC coefficients of one sub-band (view)."""
+        start = self.offset(COEF_STAT_TYPE, subband)
+        return self.coef[start:start + int(self.counts[COEF_STAT_TYPE][subband])]
+
+    def _difference(self, a, b):
+        _, ya = self.full(a)
+        _, yb = self.full(b)
+        if len(ya) == 0 or len(ya) != len(yb):
+            return np.empty(0)
+        return ya - yb
+
+    def return_loss(self):
+        """Return loss (dB) on the downstream frequency axis, -(DS PSD - Echo PSD) as plotted so far."""
+        return self._difference(5, 7)
+
+    def rx_snr(self):
+        """Upstream RxSNR (dB) on the upstream frequency axis: US PSD - Residual Echo PSD."""
+        return self._difference(8, 6)
@@ -0,0 +1,188 @@
+# EC Trace History Store
+# Version: 1.0
+#
+# Description:
+# Append-only history of continuous-mode EC traces. Each cycle is written as
+# one .npz segment (x/y arrays of every trace) plus one index.csv row per
+# trace giving the segment, timestamp, stat type, sub-band and target CSV, so
+# the per-cycle cost is constant no matter how long the soak runs. The wide
+# CSVs ec.py used to rewrite every cycle (one y column per cycle, and six
+# chN_dB columns per cycle for TimeCoef) are produced on demand by export().
+#
+# Usage:
+#   history = HistoryStore("./out/<mac>/<date>/ec/history")
+#   history.append("20250101_120000", [HistoryTrace("Echo_PSD.csv", x, y, "Frequency(MHz)", "Power(dBmV/100kHz)", stat_type=5)])
+#   history.export("./out/<mac>/<date>/ec")       # or: python ec_history.py <history dir> --out <dir>
+#   rows = history.select(stat_type=5, start="20250101_000000")
+
+import argparse
+import csv
+import logging
+import os
+from itertools import zip_longest
+
+import numpy as np
+
+INDEX_FILE = "index.csv"
+INDEX_FIELDS = ['segment', 'key', 'timestamp', 'csv', 'stat_type', 'subband', 'channel', 'bins', 'x_header', 'y_header']
+# subband of traces that span all sub-bands; channel of traces that are not per-channel.
+ALL_SUBBANDS = -1
+NO_CHANNEL = -1
+
+
+class HistoryTrace:
+    """One trace of one cycle. Traces with channel >= 0 export in the TimeCoef layout (chN_dB_<timestamp>)."""
+    __slots__ = ('csv', 'x', 'y', 'x_header', 'y_header', 'stat_type', 'subband', 'channel')
+
+    def __init__(self, csv, x, y, x_header, y_header, stat_type=-1, subband=ALL_SUBBANDS, channel=NO_CHANNEL):
+        self.csv = csv
+        self.x = x
+        self.y = y
+        self.x_header = x_header
+        self.y_header = y_header
+        self.stat_type = stat_type
+        self.subband = subband
+        self.channel = channel
+
+
+class HistoryStore:
+    """Directory of per-cycle .npz segments with a CSV index; appends never rewrite earlier data."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.rows = self._load_index()
+        self.next_segment = max((int(row['segment']) for row in self.rows), default=-1) + 1
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, 'r', newline='') as f:
+            rows = list(csv.DictReader(f))
+        for row in rows:
+            for field in ('segment', 'key', 'stat_type', 'subband', 'channel', 'bins'):
+                row[field] = int(row[field])
+        return rows
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"seg_{segment:06d}.npz")
+
+    def append(self, timestamp, traces):
+        """Stores one cycle: a new segment file, then its index rows (a segment without rows is ignored)."""
+        traces = list(traces)
+        if not traces:
+            return
+        segment = self.next_segment
+        arrays = {}
+        rows = []
+        for key, trace in enumerate(traces):
+            arrays[f"x{key}"] = np.asarray(trace.x, dtype=np.float64)
+            arrays[f"y{key}"] = np.asarray(trace.y, dtype=np.float64)
+            rows.append({'segment': segment, 'key': key, 'timestamp': timestamp, 'csv': trace.csv,
+                         'stat_type': trace.stat_type, 'subband': trace.subband, 'channel': trace.channel,
+                         'bins': len(arrays[f"y{key}"]), 'x_header': trace.x_header, 'y_header': trace.y_header})
+        np.savez(self._segment_path(segment), **arrays)
+        write_header = not os.path.exists(self.index_path)
+        with open(self.index_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(rows)
+        self.rows.extend(rows)
+        self.next_segment = segment + 1
+
+    def select(self, csv=None, stat_type=None, subband=None, channel=None, start=None, end=None):
+        """Index rows matching every given filter; start/end bound the timestamp (inclusive)."""
+        return [row for row in self.rows
+                if (csv is None or row['csv'] == csv)
+                and (stat_type is None or row['stat_type'] == stat_type)
+                and (subband is None or row['subband'] == subband)
+                and (channel is None or row['channel'] == channel)
+                and (start is None or row['timestamp'] >= start)
+                and (end is None or row['timestamp'] <= end)]
+
+    def load(self, rows):
+        """(x, y) arrays for each index row, opening each segment once."""
+        segments = {}
+        result = []
+        for row in rows:
+            segment = row['segment']
+            if segment not in segments:
+                with np.load(self._segment_path(segment)) as data:
+                    segments[segment] = dict(data)
+            data = segments[segment]
+            result.append((data[f"x{row['key']}"], data[f"y{row['key']}"]))
+        return result
+
+    def csv_names(self):
+        return list(dict.fromkeys(row['csv'] for row in self.rows))
+
+    def export(self, out_dir, names=None):
+        """Writes the wide CSV of every trace (or only `names`) into out_dir; returns the paths written."""
+        written = []
+        for name in names or self.csv_names():
+            rows = self.select(csv=name)
+            if not rows:
+                continue
+            filepath = os.path.join(out_dir, name)
+            try:
+                export = export_channels_csv if rows[0]['channel'] >= 0 else export_trace_csv
+                if export(self, rows, filepath):
+                    written.append(filepath)
+            except Exception as e:
+                logging.error(f"Error exporting history to {filepath}: {e}")
+        return written
+
+
+def export_trace_csv(store, rows, filepath):
+    """One x column from the first cycle, then one y column per cycle, cut or padded to that x axis."""
+    rows = [row for row in rows if row['bins'] > 0]
+    if not rows:
+        return False
+    data = store.load(rows)
+    x = data[0][0]
+    header = [rows[0]['x_header']] + [f"{row['y_header']}_{row['timestamp']}" for row in rows]
+    columns = [list(x)] + [list(y[:len(x)]) for _, y in data]
+    with open(filepath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(zip_longest(*columns, fillvalue=''))
+    return True
+
+
+def export_channels_csv(store, rows, filepath):
+    """TimeCoef layout: x from the longest channel of the first cycle, then chN_dB_<timestamp> for every channel of every cycle."""
+    data = dict(zip(((row['segment'], row['channel']) for row in rows), store.load(rows)))
+    channels = sorted({row['channel'] for row in rows})
+    segments = list(dict.fromkeys(row['segment'] for row in rows))
+    timestamps = {row['segment']: row['timestamp'] for row in rows}
+    first = [data[(segments[0], ch)] for ch in channels if (segments[0], ch) in data]
+    x = max((x for x, _ in first), key=len, default=[])
+    header = [rows[0]['x_header']]
+    columns = [list(x)]
+    for segment in segments:
+        for ch in channels:
+            header.append(f"ch{ch}_dB_{timestamps[segment]}")
+            columns.append(list(data.get((segment, ch), ([], []))[1]))
+    with open(filepath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(zip_longest(*columns, fillvalue=''))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export an EC trace history to wide CSV files.")
+    parser.add_argument('history', help="History directory written by ec.py in continuous mode.")
+    parser.add_argument('--out', help="Output directory (default: the history directory's parent).")
+    parser.add_argument('--csv', action='append', help="Only export this CSV (repeatable).")
+    args = parser.parse_args()
+    store = HistoryStore(args.history)
+    out_dir = args.out or os.path.dirname(os.path.abspath(args.history))
+    for filepath in store.export(out_dir, args.csv):
+        print(filepath)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# EC PNM Stats Parser
+# Version: 1.0
+#
+# Description:
+# Parses the dump written by `ec_pnm_stats {statsType} {subBandId} {file}`:
+# a short header (StatType:, NumBins:, StartFreq:, a PerBin column caption)
+# followed by one CSV row per bin. The header is read once and the body is
+# converted with a single NumPy call, giving a float64 array (or complex128
+# for statType 1, the frequency-domain EC coefficients).
+
+import re
+
+import numpy as np
+
+# statType whose rows are "real,imag" pairs.
+COMPLEX_STAT_TYPE = 1
+# Bin spacing of every EC statistic (the old decoder used i / 10 MHz).
+BIN_SPACING_HZ = 100e3
+
+HEADER_FIELDS = re.compile(r"(StatType|NumBins|StartFreq):(\d+)")
+
+
+def subband_for_start_freq(start_freq):
+    """Sub-band index of a dump from its start frequency in Hz (-1 if unknown)."""
+    if start_freq <= 0:
+        return -1
+    return 0 if start_freq < 150e6 else 2 if start_freq > 450e6 else 1
+
+
+class EcStats:
+    """One parsed EC dump. values holds the bins actually present (len(values) may be < num_bins)."""
+    __slots__ = ('stat_type', 'num_bins', 'start_freq', 'bin_spacing', 'subband', 'values')
+
+    def __init__(self, stat_type, num_bins, start_freq, values, bin_spacing=BIN_SPACING_HZ):
+        self.stat_type = stat_type
+        self.num_bins = num_bins
+        self.start_freq = start_freq
+        self.bin_spacing = bin_spacing
+        self.subband = subband_for_start_freq(start_freq)
+        self.values = values
+
+    @property
+    def complete(self):
+        return len(self.values) >= self.num_bins
+
+    def freq_mhz(self):
+        """Bin centre frequencies in MHz."""
+        return (self.start_freq + np.arange(len(self.values)) * self.bin_spacing) / 1e6
+
+    def mag_db(self):
+        """20*log10|values|, for complex or real data."""
+        with np.errstate(divide='ignore'):
+            return 20 * np.log10(np.abs(self.values))
+
+    def __repr__(self):
+        return (f"EcStats(stat_type={self.stat_type}, subband={self.subband}, start_freq={self.start_freq}, "
+                f"bins={len(self.values)}/{self.num_bins}, dtype={self.values.dtype})")
+
+
+def _split_header(text):
+    """Returns (header fields, body text); the header ends at the first line that is not a header line."""
+    fields = {}
+    pos = 0
+    length = len(text)
+    while pos < length:
+        end = text.find('\n', pos)
+        end = length if end == -1 else end + 1
+        line = text[pos:end]
+        matches = HEADER_FIELDS.findall(line)
+        if matches:
+            fields.update((name, int(value)) for name, value in matches)
+        elif line.strip() and "PerBin" not in line:
+            break
+        pos = end
+    return fields, text[pos:]
+
+
+def _parse_body(body, columns):
+    """Converts the CSV body to a (rows, columns) float64 array with one NumPy call."""
+    first_line = body.lstrip().split('\n', 1)[0].strip().rstrip(',')
+    if not first_line:
+        return np.empty((0, columns))
+    width = first_line.count(',') + 1
+    try:
+        flat = np.array(body.replace(',', ' ').split(), dtype=np.float64)
+    except ValueError:
+        # Stray text in the body: fall back to a tolerant row-by-row parse.
+        rows = np.genfromtxt(body.splitlines(), delimiter=',', usecols=range(columns), invalid_raise=False, ndmin=2)
+        return rows[~np.isnan(rows).any(axis=1)] if rows.size else np.empty((0, columns))
+    # A dump read while the amp is still writing can end mid-row.
+    usable = len(flat) - len(flat) % width
+    return flat[:usable].reshape(-1, width)[:, :columns]
+
+
+def parse_ec_dat(text):
+    """Parses an EC dump (str or bytes) into an EcStats record."""
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", errors="replace")
+    fields, body = _split_header(text)
+    stat_type = fields.get('StatType', -1)
+    if stat_type == COMPLEX_STAT_TYPE:
+        pairs = _parse_body(body, 2)
+        values = pairs[:, 0] + 1j * pairs[:, 1] if pairs.shape[1] == 2 else np.empty(0, dtype=np.complex128)
+    else:
+        values = _parse_body(body, 1)[:, 0]
+    return EcStats(stat_type, fields.get('NumBins', len(values)), fields.get('StartFreq', 0), values)
+
+
+def load_ec_dat(path):
+    """Reads and parses an EC dump from disk."""
+    with open(path, 'r') as f:
+        return parse_ec_dat(f.read())
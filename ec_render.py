@@ -0,0 +1,141 @@
+# EC Plot Rendering Worker
+# Version: 1.0
+#
+# Description:
+# Writes the live EC figures (HTML for browsers, JSON for the html_plot_viewer.py
+# Dash app) from a background thread so the collection loop never waits on
+# Plotly serialisation. The collection loop only queues trace updates; the
+# worker keeps the latest update per trace, applies it to the figures it owns
+# and rewrites the artefacts of changed figures at most once per interval.
+# HTML files reference one shared plotly.min.js next to them instead of
+# embedding the ~3.5 MB bundle in every write. Files are written to a temporary
+# name and renamed, so readers never see a half-written plot.
+#
+# Usage:
+#   renderer = RenderWorker(min_interval=2.0)
+#   renderer.add_figure('coef', fig_coef, html_path=".../EC_Coefficients.html", json_path=".../EC_Coefficients.json")
+#   renderer.start()
+#   renderer.update('coef', 7, x, y)     # cheap: copies the data and queues it
+#   renderer.commit()                    # end of cycle: write pending changes now
+#   renderer.close()                     # write anything pending and stop
+
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import plotly.io as pio
+
+# Written once per output directory by write_html; every HTML file points at it.
+PLOTLYJS_MODE = 'directory'
+DEFAULT_MIN_INTERVAL = 2.0
+
+
+class RenderWorker(threading.Thread):
+    """Owns a set of Plotly figures and writes them to disk at a bounded rate."""
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL):
+        super().__init__(name="ec-render", daemon=True)
+        self.min_interval = min_interval
+        self.figures = {}
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._dirty = set()
+        self._last_write = 0.0
+
+    def add_figure(self, name, fig, html_path=None, json_path=None):
+        """Hands a figure to the worker; only the worker touches it after start()."""
+        if fig is not None:
+            self.figures[name] = (fig, html_path, json_path)
+
+    def update(self, name, trace_idx, x, y):
+        """Queues new data for one trace. The data is copied, so callers may pass views they will overwrite."""
+        if name in self.figures:
+            self._queue.put(('update', (name, trace_idx), (np.array(x), np.array(y))))
+
+    def commit(self):
+        """Writes pending changes without waiting for the rate limit (does not block the caller)."""
+        self._queue.put(('commit', None, None))
+
+    def show(self):
+        """Displays every figure with pio.show once pending changes are written."""
+        self._queue.put(('show', None, None))
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far has been applied and written."""
+        done = threading.Event()
+        self._queue.put(('flush', done, None))
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Writes anything pending and stops the worker."""
+        if self.is_alive():
+            self._queue.put(('stop', None, None))
+            self.join(timeout)
+
+    def run(self):
+        while True:
+            wait = None
+            if self._pending:
+                wait = max(0.0, self._last_write + self.min_interval - time.monotonic())
+            try:
+                op, key, value = self._queue.get(timeout=wait)
+            except queue.Empty:
+                self._write()
+                continue
+            if op == 'update':
+                # Coalesce: only the newest data per trace is ever rendered.
+                self._pending[key] = value
+                if self._queue.empty():
+                    self._write()
+                continue
+            self._write(force=True)
+            if op == 'flush':
+                key.set()
+            elif op == 'show':
+                self._show()
+            elif op == 'stop':
+                return
+
+    def _apply(self):
+        for (name, trace_idx), (x, y) in self._pending.items():
+            fig = self.figures[name][0]
+            if len(fig.data) <= trace_idx:
+                continue
+            with fig.batch_update():
+                fig.data[trace_idx].x = x
+                fig.data[trace_idx].y = y
+            self._dirty.add(name)
+        self._pending.clear()
+
+    def _write(self, force=False):
+        if not force and time.monotonic() - self._last_write < self.min_interval:
+            return
+        self._apply()
+        for name in sorted(self._dirty):
+            fig, html_path, json_path = self.figures[name]
+            try:
+                if html_path:
+                    _replace(html_path, lambda tmp: fig.write_html(tmp, include_plotlyjs=PLOTLYJS_MODE))
+                if json_path:
+                    _replace(json_path, fig.write_json)
+            except Exception as e:
+                logging.error(f"Failed to write plot '{name}': {e}")
+        self._dirty.clear()
+        self._last_write = time.monotonic()
+
+    def _show(self):
+        for fig, _, _ in self.figures.values():
+            try:
+                pio.show(fig, auto_open=False)
+            except Exception as e:
+                logging.error(f"Failed to show plot: {e}")
+
+
+def _replace(path, write):
+    """Writes via a temporary file in the same directory, then renames it over path."""
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
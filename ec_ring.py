@@ -0,0 +1,282 @@
+# EC Cycle Ring Buffer
+# Version: 1.1
+# v1.1: Every entry records the frequency axis it was stored with (axis ids in the index, one
+#       axis_<stat>_<id>.npy per axis), so spill segments and waterfalls never pair data with a
+#       later axis.
+#
+# Description:
+# Fixed-capacity history of recent EC cycles for live waterfall and trend
+# views. Each cycle's full-band traces (statType 1 as dB, 3, 5, 6, 7, 8) are
+# stored as float32 rows in a memory-mapped ring, so RAM use is set by the
+# capacity, and a viewer process that maps the same files reads them straight
+# from the shared page cache. When the ring wraps, the oldest entries are
+# written out as compressed .npz spill segments (segment_entries at a time,
+# just before the first of them is overwritten), so nothing is lost and the
+# ring never grows.
+#
+# Files in the ring directory:
+#   meta.json               capacity, width, stat types, head (last sequence written), current axis ids
+#   data.f32                (capacity, traces, width) values, NaN past each trace's length
+#   index.f64               (capacity, 2 + 2 * traces): sequence, unix time, length and axis id of each trace
+#   axis_<stat>_<id>.npy    frequency axis (MHz) of a stat type; the id is the sequence that introduced it
+#   spill_<seq>.npz         evicted entries: data, index and the axes they were recorded with
+#
+# A slot's sequence number is set to -1 while the slot is rewritten, so readers
+# can tell a torn read (see EcRingReader.entries).
+#
+# Usage:
+#   ring = EcRing("./out/<mac>/<date>/ec/ring", capacity=256)
+#   ring.append(cycle)                        # once per cycle
+#   reader = EcRingReader("./out/<mac>/<date>/ec/ring")
+#   freq, times, waterfall = reader.waterfall(7, count=100)
+
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+import ec_cycle
+
+DEFAULT_CAPACITY = 256
+DEFAULT_WIDTH = ec_cycle.NUM_SUBBANDS * ec_cycle.DEFAULT_SUBBAND_BINS
+DEFAULT_SEGMENT_ENTRIES = 64
+META_FILE = "meta.json"
+RING_VERSION = 2
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_meta(directory):
+    with open(os.path.join(directory, META_FILE)) as f:
+        return json.load(f)
+
+
+def _open_arrays(directory, meta, mode):
+    capacity, width, traces = meta['capacity'], meta['width'], len(meta['stat_types'])
+    data = np.memmap(os.path.join(directory, "data.f32"), dtype=np.float32, mode=mode, shape=(capacity, traces, width))
+    index = np.memmap(os.path.join(directory, "index.f64"), dtype=np.float64, mode=mode, shape=(capacity, 2 + 2 * traces))
+    return data, index
+
+
+def _axis_path(directory, stat, axis_id):
+    return os.path.join(directory, f"axis_{stat}_{axis_id:08d}.npy")
+
+
+def _load_axis(directory, stat, axis_id):
+    """Frequency axis `axis_id` of a stat type (empty if it was never recorded)."""
+    if axis_id < 0:
+        return np.empty(0, dtype=np.float32)
+    try:
+        return np.load(_axis_path(directory, stat, axis_id), allow_pickle=False)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Missing EC ring axis {_axis_path(directory, stat, axis_id)}: {e}")
+        return np.empty(0, dtype=np.float32)
+
+
+class EcRing:
+    """Writer side: appends EcCycle snapshots, spilling overwritten entries to disk segments."""
+
+    def __init__(self, directory, capacity=DEFAULT_CAPACITY, width=DEFAULT_WIDTH, stat_types=ec_cycle.STAT_TYPES,
+                 segment_entries=DEFAULT_SEGMENT_ENTRIES):
+        self.directory = directory
+        self.segment_entries = max(1, min(segment_entries, capacity))
+        os.makedirs(directory, exist_ok=True)
+        self.meta = {'version': RING_VERSION, 'capacity': capacity, 'width': width,
+                     'stat_types': list(stat_types), 'head': -1, 'axis_ids': [-1] * len(stat_types)}
+        try:
+            existing = _read_meta(directory)
+        except (OSError, ValueError):
+            existing = None
+        if existing and all(existing.get(k) == self.meta[k] for k in ('version', 'capacity', 'width', 'stat_types')):
+            # Same layout: keep the entries already there and continue after them.
+            self.meta = existing
+            mode = 'r+'
+        else:
+            mode = 'w+'
+        self.data, self.index = _open_arrays(directory, self.meta, mode)
+        # (row, axis id) -> axis, for the current axes and those of entries still to be spilled.
+        self.axes = {(row, axis_id): _load_axis(directory, stat, axis_id)
+                     for row, (stat, axis_id) in enumerate(zip(self.stat_types, self.meta['axis_ids']))}
+        if mode == 'w+':
+            self.index[:, 0] = -1
+            self.data[:] = np.nan
+            self._write_meta()
+
+    @property
+    def stat_types(self):
+        return self.meta['stat_types']
+
+    def _write_meta(self):
+        _write_json(os.path.join(self.directory, META_FILE), self.meta)
+
+    def _set_axis(self, row, axis_id, freq):
+        """Makes freq the current axis of a row; it is saved before any entry refers to it."""
+        path = _axis_path(self.directory, self.stat_types[row], axis_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, freq)
+        os.replace(tmp_path, path)
+        self.axes[(row, axis_id)] = freq
+        self.meta['axis_ids'][row] = axis_id
+
+    def _axis(self, row, axis_id):
+        if (row, axis_id) not in self.axes:
+            self.axes[(row, axis_id)] = _load_axis(self.directory, self.stat_types[row], axis_id)
+        return self.axes[(row, axis_id)]
+
+    def append(self, cycle, timestamp=None):
+        """Stores one EcCycle; returns its sequence number."""
+        seq = self.meta['head'] + 1
+        slot = seq % self.meta['capacity']
+        width = self.meta['width']
+        oldest = seq - self.meta['capacity']
+        if oldest >= 0 and oldest % self.segment_entries == 0:
+            self.spill(oldest, min(oldest + self.segment_entries, seq))
+        self.index[slot, 0] = -1
+        lengths, axis_ids = [], []
+        for row, stat in enumerate(self.stat_types):
+            freq, values = cycle.full(stat)
+            n = min(len(values), width)
+            self.data[slot, row, :n] = values[:n]
+            self.data[slot, row, n:] = np.nan
+            lengths.append(n)
+            freq = np.asarray(freq[:n], dtype=np.float32)
+            if not np.array_equal(self._axis(row, self.meta['axis_ids'][row]), freq):
+                self._set_axis(row, seq, freq)
+            axis_ids.append(self.meta['axis_ids'][row])
+        traces = len(self.stat_types)
+        self.index[slot, 2:2 + traces] = lengths
+        self.index[slot, 2 + traces:] = axis_ids
+        self.index[slot, 1] = time.time() if timestamp is None else timestamp
+        self.index[slot, 0] = seq
+        self.meta['head'] = seq
+        self._write_meta()
+        return seq
+
+    def spill(self, first, end):
+        """Writes entries first..end-1 (still in the ring) to a spill segment.
+
+        append() spills at every multiple of segment_entries, so the segments cover each
+        sequence exactly once whether or not capacity is a multiple of segment_entries.
+        """
+        slots = np.arange(first, end) % self.meta['capacity']
+        valid = self.index[slots, 0] >= 0
+        if not valid.any():
+            return
+        index = np.array(self.index[slots[valid]])
+        traces = len(self.stat_types)
+        # The axes these entries were recorded with, stored once each; axis_ref[entry, row] indexes them.
+        keys = {}
+        axis_ref = np.empty((len(index), traces), dtype=np.int32)
+        for row in range(traces):
+            for i, axis_id in enumerate(index[:, 2 + traces + row].astype(np.int64)):
+                axis_ref[i, row] = keys.setdefault((row, int(axis_id)), len(keys))
+        axes = np.full((len(keys), self.meta['width']), np.nan, dtype=np.float32)
+        for (row, axis_id), k in keys.items():
+            freq = self._axis(row, axis_id)
+            axes[k, :len(freq)] = freq
+        path = os.path.join(self.directory, f"spill_{first:08d}.npz")
+        try:
+            np.savez_compressed(path, data=self.data[slots[valid]], index=index, axes=axes, axis_ref=axis_ref)
+        except OSError as e:
+            logging.error(f"Could not spill EC ring entries to {path}: {e}")
+        # Axes no longer current and no longer used by an entry in the ring can leave memory.
+        in_ring = {(row, int(axis_id)) for row in range(traces)
+                   for axis_id in np.asarray(self.index[:, 2 + traces + row])[np.asarray(self.index[:, 0]) >= 0]}
+        for key in [key for key in self.axes if key not in in_ring and self.meta['axis_ids'][key[0]] != key[1]]:
+            del self.axes[key]
+
+    def close(self):
+        self.data.flush()
+        self.index.flush()
+
+
+class EcRingReader:
+    """Viewer side: read-only view of a ring written by another process."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta = None
+        self.data = self.index = None
+        self.axes = {}
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads meta.json; returns the head sequence (-1 when empty)."""
+        meta = _read_meta(self.directory)
+        if self.meta is None or any(meta[k] != self.meta[k] for k in ('capacity', 'width', 'stat_types')):
+            self.data, self.index = _open_arrays(self.directory, meta, 'r')
+            self.axes = {}
+        self.meta = meta
+        return meta['head']
+
+    @property
+    def head(self):
+        return self.meta['head']
+
+    def row(self, stat):
+        return self.meta['stat_types'].index(stat)
+
+    def freq(self, stat, axis_id=None):
+        """Frequency axis (MHz) of a stat type: the current one, or the one with the given id."""
+        row = self.row(stat)
+        axis_id = self.meta['axis_ids'][row] if axis_id is None else axis_id
+        if (row, axis_id) not in self.axes:
+            self.axes[(row, axis_id)] = _load_axis(self.directory, stat, axis_id)
+        return self.axes[(row, axis_id)]
+
+    def _snapshot(self, count):
+        head, capacity = self.meta['head'], self.meta['capacity']
+        if head < 0:
+            return (np.empty(0, dtype=np.int64), np.empty((0,) + self.index.shape[1:]),
+                    np.empty((0,) + self.data.shape[1:], dtype=np.float32))
+        available = min(head + 1, capacity)
+        count = available if count is None else min(count, available)
+        seqs = np.arange(head - count + 1, head + 1)
+        slots = seqs % capacity
+        data = np.array(self.data[slots])
+        index = np.array(self.index[slots])
+        # Keep only slots that held the expected entry before and after the copy (the writer may have moved on).
+        valid = (index[:, 0] == seqs) & (np.asarray(self.index[slots, 0]) == seqs)
+        return seqs[valid], index[valid], data[valid]
+
+    def entries(self, count=None):
+        """(sequences, times, data) of the newest `count` entries still in the ring, oldest first (copies)."""
+        seqs, index, data = self._snapshot(count)
+        return seqs, index[:, 1], data
+
+    def waterfall(self, stat, count=None):
+        """(freq, times, values[entries, bins]) of one stat type for a waterfall plot.
+
+        Only entries recorded on the current frequency axis of the stat type are included.
+        """
+        row = self.row(stat)
+        axis_id = self.meta['axis_ids'][row]
+        freq = self.freq(stat, axis_id)
+        _, index, data = self._snapshot(count)
+        current = index[:, 2 + len(self.meta['stat_types']) + row] == axis_id
+        return freq, index[current, 1], data[current, row, :len(freq)]
+
+    def trend(self, stat, count=None, reduce=np.nanmean):
+        """(times, one value per entry) of one stat type, e.g. mean PSD level over time."""
+        _, times, data = self.entries(count)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)     # entries without this stat are all-NaN
+            return times, reduce(data[:, self.row(stat), :], axis=1)
+
+    def spilled(self):
+        """(data, index, axes) of each spill segment, oldest first; axes[i, row] is the axis entry i was recorded with."""
+        for path in sorted(glob.glob(os.path.join(self.directory, "spill_*.npz"))):
+            with np.load(path) as segment:
+                yield segment['data'], segment['index'], segment['axes'][segment['axis_ref']]
@@ -1,17 +1,39 @@
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash import dcc, html, Patch, no_update
+from dash.dependencies import Input, Output, State
 import os
+import json
 import argparse
+import threading
+import time
+import glob
+import warnings
+from datetime import datetime
 import webbrowser
+import numpy as np
 import config_manager
+import ec_cycle
+import ec_ring
 import sys
 from flask import request
 
-parser = argparse.ArgumentParser(description="View EC HTML Plots")
+# Live EC plot viewer.
+# ec.py (via ec_render) writes EC_Coefficients_<id>.json and EC_PSD_Metrics_<id>.json.
+# A watcher thread notices when either file changes, reloads it once on the server
+# and gives every trace a version number. Each browser asks once a second which
+# versions it is missing: unchanged figures answer with no_update (no payload),
+# changed ones send a Patch with only the x/y of the traces that changed. The
+# whole figure is only sent on the first load or when the trace list changes.
+# The waterfall and trend views read ec.py's cycle ring (ec_ring, continuous mode)
+# straight from its memory-mapped files; they are rebuilt only when a new cycle
+# has been appended or another stat type is selected.
+
+parser = argparse.ArgumentParser(description="View EC Plots")
 parser.add_argument('--id_string', type=str, default="No --id_string <id_string>", help="Identifier string for plot file suffix (default: empty)")
 parser.add_argument('--image', type=str, choices=['CS', 'CC', 'SC', 'BC', 'CCs'], default='CC',
                     help='Specify the image type: CS (CommScope), CC (Comcast), SC (Sercomm), or BC (Broadcom).')
+parser.add_argument('--ring', type=str, default=None,
+                    help="ec.py cycle ring directory (default: the newest <path>/<mac>/<date>/ec/ring_<id_string>).")
 args = parser.parse_args()
 config = config_manager.CONFIGURATIONS.get(getattr(args, "image", None), None)
 
@@ -22,51 +44,205 @@ plot_subdir=config.get("path", "").strip("./")
 subdir_list = os.listdir(current_dir)
 
 PLOT_DIR = os.path.join(current_dir, plot_subdir)
-COEF_HTML_PATH = os.path.join(PLOT_DIR, f"EC_Coefficients_{args.id_string}.html")
-PSD_HTML_PATH = os.path.join(PLOT_DIR, f"EC_PSD_Metrics_{args.id_string}.html")
+COEF_JSON_PATH = os.path.join(PLOT_DIR, f"EC_Coefficients_{args.id_string}.json")
+PSD_JSON_PATH = os.path.join(PLOT_DIR, f"EC_PSD_Metrics_{args.id_string}.json")
 
-app = dash.Dash(__name__)
+WATCH_INTERVAL = 0.5    # seconds between checks of the JSON files (server side, a stat() each)
+POLL_INTERVAL_MS = 1000  # browser check for new trace versions (empty response when nothing changed)
+WATERFALL_ENTRIES = 100  # newest ring cycles shown in the waterfall
+WATERFALL_BINS = 1024    # waterfall columns sent to the browser (block means of the full-band bins)
+
+
+def find_ring_dir():
+    """ec.py's ring for this --id_string: <plot dir>/ring_<id>, else the newest <plot dir>/<mac>/<date>/ec/ring_<id>."""
+    name = f"ring_{args.id_string}"
+    candidates = glob.glob(os.path.join(PLOT_DIR, name)) + glob.glob(os.path.join(PLOT_DIR, "*", "*", "ec", name))
+    return max(candidates, key=os.path.getmtime) if candidates else os.path.join(PLOT_DIR, name)
+
+
+RING_DIR = args.ring or find_ring_dir()
+
+
+class FigureWatcher:
+    """Reloads a Plotly figure JSON when the file changes and versions each trace so clients get only deltas."""
+    def __init__(self, path):
+        self.path = path
+        self.file_key = None
+        self.figure = None
+        self.generation = 0     # bumped when the trace list or layout changes: clients need the whole figure
+        self.versions = []
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def poll(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        file_key = (stat.st_mtime_ns, stat.st_size)
+        if file_key == self.file_key:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                figure = json.load(f)
+        except (OSError, ValueError):
+            return  # try again on the next check
+        self.file_key = file_key
+        with self.lock:
+            old = self.figure
+            self.figure = figure
+            data = figure.get('data', [])
+            if old is None or len(old.get('data', [])) != len(data) or old.get('layout') != figure.get('layout'):
+                self.generation += 1
+                self.versions = [0] * len(data)
+                return
+            for i, (old_trace, trace) in enumerate(zip(old['data'], data)):
+                if old_trace.get('x') != trace.get('x') or old_trace.get('y') != trace.get('y'):
+                    self.counter += 1
+                    self.versions[i] = self.counter
+
+    def update_for(self, client):
+        """(figure or Patch or no_update, new client state) for a client that has seen `client` state."""
+        with self.lock:
+            if self.figure is None:
+                return no_update, client
+            state = {'generation': self.generation, 'versions': list(self.versions)}
+            if not client or client.get('generation') != self.generation:
+                return self.figure, state
+            seen = client.get('versions', [])
+            changed = [i for i, version in enumerate(self.versions) if i >= len(seen) or version > seen[i]]
+            if not changed:
+                return no_update, client
+            patch = Patch()
+            for i in changed:
+                trace = self.figure['data'][i]
+                patch['data'][i]['x'] = trace.get('x', [])
+                patch['data'][i]['y'] = trace.get('y', [])
+            return patch, state
+
+
+def _decimate(freq, values, bins):
+    """Block means of the waterfall columns so at most `bins` of them reach the browser."""
+    step = -(-len(freq) // bins)
+    if step <= 1:
+        return freq, values
+    n = len(freq) // step * step
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)     # all-NaN blocks stay NaN
+        return (freq[:n].reshape(-1, step).mean(axis=1),
+                np.nanmean(values[:, :n].reshape(len(values), -1, step), axis=2))
+
+
+class RingView:
+    """Waterfall and trend figures served from ec.py's memory-mapped cycle ring."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def _refresh(self):
+        """Head sequence of the ring (-1 while it does not exist)."""
+        try:
+            if self.reader is None:
+                self.reader = ec_ring.EcRingReader(self.directory)
+                return self.reader.head
+            return self.reader.refresh()
+        except (OSError, ValueError, KeyError):
+            return -1
 
-def read_html_file(filepath):
-    if os.path.exists(filepath):
-        with open(filepath, "r", encoding="utf-8") as f:
-            return f.read()
-    return "<div style='color:red;'>File not found: {}</div>".format(filepath)
+    def update_for(self, stat, client):
+        """(waterfall, trend, new client state); no_update for both while the ring has no new cycle."""
+        with self.lock:
+            head = self._refresh()
+            state = {'head': head, 'stat': stat}
+            if client == state:
+                return no_update, no_update, client
+            if head < 0 or stat not in self.reader.meta['stat_types']:
+                empty = {'data': [], 'layout': {'title': {'text': f"No EC ring cycles in {self.directory} yet"}}}
+                return empty, empty, state
+            freq, times, values = self.reader.waterfall(stat, count=WATERFALL_ENTRIES)
+            freq, values = _decimate(freq, values, WATERFALL_BINS)
+            trend_times, trend = self.reader.trend(stat)
+        label = f"statType {stat}"
+        waterfall = {
+            'data': [{'type': 'heatmap', 'x': freq, 'y': [datetime.fromtimestamp(t).isoformat() for t in times],
+                      'z': values, 'colorscale': 'Viridis'}],
+            'layout': {'title': {'text': f"{label} waterfall (last {len(times)} cycles)"},
+                       'xaxis': {'title': {'text': "Frequency (MHz)"}}, 'yaxis': {'title': {'text': "Time"}}}}
+        trend_figure = {
+            'data': [{'type': 'scatter', 'mode': 'lines+markers', 'name': label,
+                      'x': [datetime.fromtimestamp(t).isoformat() for t in trend_times], 'y': trend}],
+            'layout': {'title': {'text': f"{label} mean level per cycle"},
+                       'xaxis': {'title': {'text': "Time"}}, 'yaxis': {'title': {'text': "Mean"}}}}
+        return waterfall, trend_figure, state
+
+
+watchers = {'coef': FigureWatcher(COEF_JSON_PATH), 'psd': FigureWatcher(PSD_JSON_PATH)}
+ring_view = RingView(RING_DIR)
+
+
+def watch_files():
+    while True:
+        for watcher in watchers.values():
+            watcher.poll()
+        time.sleep(WATCH_INTERVAL)
+
+
+app = dash.Dash(__name__)
 
 app.layout = html.Div([
-    html.H2(f"EC HTML Plot Viewer: --id_string={args.id_string}"),
+    html.H2(f"EC Plot Viewer: --id_string={args.id_string}"),
     html.Div([
         html.H4("Coefficients Plot"),
-        html.Iframe(
-            id="coef-html",
-            srcDoc=read_html_file(COEF_HTML_PATH),
-            style={"width": "100%", "height": "600px", "border": "1px solid #ccc"}
-        ),
+        dcc.Graph(id="coef-graph", style={"width": "100%", "height": "800px"}),
+        dcc.Store(id="coef-state"),
     ]),
     html.Div([
         html.H4("PSD Plot"),
-        html.Iframe(
-            id="psd-html",
-            srcDoc=read_html_file(PSD_HTML_PATH),
-            style={"width": "100%", "height": "600px", "border": "1px solid #ccc"}
-        ),
+        dcc.Graph(id="psd-graph", style={"width": "100%", "height": "900px"}),
+        dcc.Store(id="psd-state"),
+    ]),
+    html.Div([
+        html.H4(f"Cycle Ring: {RING_DIR}"),
+        dcc.Dropdown(id="ring-stat", options=[{'label': f"statType {stat}", 'value': stat} for stat in ec_cycle.STAT_TYPES],
+                     value=ec_cycle.STAT_TYPES[0], clearable=False),
+        dcc.Graph(id="ring-waterfall", style={"width": "100%", "height": "700px"}),
+        dcc.Graph(id="ring-trend", style={"width": "100%", "height": "400px"}),
+        dcc.Store(id="ring-state"),
     ]),
     dcc.Interval(
         id='interval-component',
-        interval=5*1000,  # Refresh every 5 seconds
+        interval=POLL_INTERVAL_MS,
         n_intervals=0
     )
 ])
 
+
+def register_figure(name):
+    @app.callback(
+        Output(f'{name}-graph', 'figure'),
+        Output(f'{name}-state', 'data'),
+        Input('interval-component', 'n_intervals'),
+        State(f'{name}-state', 'data')
+    )
+    def update_figure(n, client_state):
+        return watchers[name].update_for(client_state)
+
+
+for figure_name in watchers:
+    register_figure(figure_name)
+
+
 @app.callback(
-    Output('coef-html', 'srcDoc'),
-    Output('psd-html', 'srcDoc'),
-    Input('interval-component', 'n_intervals')
+    Output('ring-waterfall', 'figure'),
+    Output('ring-trend', 'figure'),
+    Output('ring-state', 'data'),
+    Input('interval-component', 'n_intervals'),
+    Input('ring-stat', 'value'),
+    State('ring-state', 'data')
 )
-def update_htmls(n):
-    coef_html = read_html_file(COEF_HTML_PATH)
-    psd_html = read_html_file(PSD_HTML_PATH)
-    return coef_html, psd_html
+def update_ring(n, stat, client_state):
+    return ring_view.update_for(stat, client_state)
 
 def shutdown_server():
     func = request.environ.get('werkzeug.server.shutdown')
@@ -80,9 +256,10 @@ def shutdown():
     return 'Server shutting down...'
 
 if __name__ == '__main__':
+    threading.Thread(target=watch_files, name="figure-watch", daemon=True).start()
     webbrowser.open_new_tab("http://localhost:8051/")
     app.run(debug=True, port=8051)
 
 # To trigger shutdown, send a POST request to http://localhost:8051/shutdown
-# For example, from another terminal: 
+# For example, from another terminal:
 #   curl -X POST http://localhost:8051/shutdown
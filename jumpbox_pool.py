@@ -0,0 +1,120 @@
+# Jumpbox Connection Pool
+# Version: 1.0
+#
+# Description:
+# Keeps one authenticated SSH transport per jumpbox and hands out direct-tcpip
+# channels to any number of amps over it. The transport is kept alive with
+# SSH keepalives and health-checked before each use, so a dropped jumpbox
+# connection is re-established transparently on the next request. Fleet runs
+# pay the jumpbox authentication cost once per process instead of once per amp.
+
+import logging
+import threading
+
+import paramiko
+
+
+class JumpboxPool:
+    """One shared transport to a jumpbox, multiplexing direct-tcpip channels to targets."""
+    KEEPALIVE_INTERVAL = 30  # seconds between SSH keepalive packets
+    CONNECT_RETRIES = 1      # reconnect attempts when opening a channel fails
+
+    def __init__(self, hostname, username, keepalive=None):
+        self.hostname = hostname
+        self.username = username
+        self.keepalive = self.KEEPALIVE_INTERVAL if keepalive is None else keepalive
+        self.client = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.client:
+            self.client.close()
+        logging.debug(f"Connecting to jumpbox {self.hostname}...")
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(self.hostname, username=self.username)
+        client.get_transport().set_keepalive(self.keepalive)
+        self.client = client
+
+    def is_healthy(self):
+        """True when the transport is up and accepts a no-op packet."""
+        transport = self.client.get_transport() if self.client else None
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception as e:
+            logging.debug(f"Jumpbox {self.hostname} health check failed: {e}")
+            return False
+        return True
+
+    @property
+    def transport(self):
+        """The shared jumpbox transport, (re)connecting if it is missing or unhealthy."""
+        with self._lock:
+            if not self.is_healthy():
+                self._connect()
+            return self.client.get_transport()
+
+    def open_channel(self, target_hostname, port=22, timeout=None):
+        """Opens a direct-tcpip channel to target_hostname:port over the shared transport."""
+        for attempt in range(self.CONNECT_RETRIES + 1):
+            transport = self.transport
+            try:
+                return transport.open_channel("direct-tcpip", (target_hostname, port), ('', 0), timeout=timeout)
+            except paramiko.ChannelException:
+                raise  # The jumpbox refused the target; reconnecting will not help.
+            except (paramiko.SSHException, EOFError, OSError) as e:
+                if attempt == self.CONNECT_RETRIES:
+                    raise
+                logging.warning(f"Jumpbox channel to {target_hostname} failed ({e}); reconnecting.")
+                with self._lock:
+                    if self.client and self.client.get_transport() is transport:
+                        self._connect()
+
+    def connect_target(self, target_hostname, username, password):
+        """Returns an SSHClient logged in to the target through a pooled channel."""
+        target_client = paramiko.SSHClient()
+        target_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        target_client.connect(target_hostname, username=username, password=password,
+                              sock=self.open_channel(target_hostname))
+        return target_client
+
+    def close(self):
+        with self._lock:
+            if self.client:
+                self.client.close()
+                self.client = None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(hostname, username):
+    """Returns the process-wide JumpboxPool for (hostname, username), creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get((hostname, username))
+        if pool is None:
+            pool = _pools[(hostname, username)] = JumpboxPool(hostname, username)
+        return pool
+
+
+def connect_target(config, target_hostname, no_jump=False):
+    """Opens an SSHClient to the amp described by config, via the pooled jumpbox unless no_jump is set."""
+    if no_jump:
+        target_client = paramiko.SSHClient()
+        target_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        target_client.connect(target_hostname, username=config['target_username'], password=config['target_password'])
+        return target_client
+    pool = get_pool(config['jumpbox_hostname'], config['jumpbox_username'])
+    return pool.connect_target(target_hostname, config['target_username'], config['target_password'])
+
+
+def close_all():
+    """Closes every pooled jumpbox transport."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
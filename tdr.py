@@ -0,0 +1,242 @@
+# EC Coefficient TDR Engine
+# Version: 1.1
+# v1.1: High-resolution mode: spectral window (Kaiser, Blackman-Harris), zero-padding
+#       and sub-bin peak interpolation (parabolic on dB, or band-limited sinc).
+#
+# Description:
+# Turns frequency-domain EC coefficients into time-domain (TDR) responses for
+# ec.py's live plot and ampUtils_v2.data_crunch's Excel reports. All channel
+# vectors of a cycle go through one batched scipy.fft.ifft per vector length
+# (normally one call for all six channels), using worker threads; dB
+# conversion, time/distance axes and peak selection are array operations.
+# scipy.fft keeps its own plan cache, and the axes for each length are built
+# once and reused.
+#
+# High-resolution mode trades nothing on the amp side: the coefficients are
+# windowed (cutting sidelobes that hide small echoes next to big ones) and
+# zero-padded before the IFFT (a finer time grid), and each peak is refined
+# between samples. Windows, axes and sinc interpolation matrices are cached per
+# vector length, so the extra analysis costs milliseconds per cycle.
+#
+# Usage:
+#   engine = TdrEngine(vop=0.87)
+#   for trace in engine.analyze([ch0, ch1, ...], floor=-100, height=-50, prominence=1, max_peaks=12):
+#       plot(trace.distance_ft, trace.db); mark(trace.peak_x(trace.distance_ft), trace.peak_db)
+#   hires = TdrEngine(window='kaiser', pad=4, interpolation='sinc')
+
+import numpy as np
+import scipy.fft
+from scipy.signal import find_peaks, get_window
+
+SPEED_OF_LIGHT_FT_PER_S = 299792458 * 3.28084
+DEFAULT_VOP = 0.87          # velocity of propagation: 87% for P3 hardline, 82% for RG6
+BIN_SPACING_HZ = 100e3      # EC coefficient bin spacing; the impulse spans 1 / bin spacing
+
+WINDOWS = ('none', 'kaiser', 'blackmanharris')
+INTERPOLATIONS = ('none', 'parabolic', 'sinc')
+DEFAULT_KAISER_BETA = 8.6   # ~ Blackman sidelobes with a narrower main lobe
+SINC_GRID_POINTS = 33       # sinc interpolation samples across +/-1 output sample around a peak
+
+
+class TdrTrace:
+    """TDR response of one channel.
+
+    peaks holds indices into db, strongest first; peak_index and peak_db are the
+    same peaks refined between samples (equal to peaks and db[peaks] without interpolation).
+    """
+    __slots__ = ('impulse', 'db', 'rtt_us', 'one_way_us', 'distance_ft', 'peaks', 'peak_index', 'peak_db')
+
+    def __init__(self, impulse, db, rtt_us, one_way_us, distance_ft, peaks, peak_index=None, peak_db=None):
+        self.impulse = impulse
+        self.db = db
+        self.rtt_us = rtt_us
+        self.one_way_us = one_way_us
+        self.distance_ft = distance_ft
+        self.peaks = peaks
+        self.peak_index = peaks.astype(np.float64) if peak_index is None else peak_index
+        self.peak_db = db[peaks] if peak_db is None else peak_db
+
+    def peak_x(self, axis):
+        """Positions of the (refined) peaks on one of this trace's axes."""
+        return np.interp(self.peak_index, np.arange(len(axis)), axis)
+
+
+class TdrEngine:
+    """Batched IFFT, dB conversion, time/distance axes and peak extraction for EC coefficient vectors."""
+
+    def __init__(self, vop=DEFAULT_VOP, bin_spacing=BIN_SPACING_HZ, workers=-1,
+                 window='none', kaiser_beta=DEFAULT_KAISER_BETA, pad=1, interpolation='none'):
+        if window not in WINDOWS:
+            raise ValueError(f"Unknown TDR window '{window}' (expected one of {', '.join(WINDOWS)})")
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unknown peak interpolation '{interpolation}' (expected one of {', '.join(INTERPOLATIONS)})")
+        self.vop = vop
+        self.bin_spacing = bin_spacing
+        self.workers = workers      # scipy.fft worker threads (-1: one per CPU)
+        self.window = window
+        self.kaiser_beta = kaiser_beta
+        self.pad = max(1, int(pad))
+        self.interpolation = interpolation
+        self._axes = {}
+        self._windows = {}
+        self._sinc = {}
+
+    def _window(self, n):
+        """Spectral window for n bins, scaled to unit mean so peak levels stay comparable (None: no window)."""
+        if self.window == 'none':
+            return None
+        window = self._windows.get(n)
+        if window is None:
+            spec = ('kaiser', self.kaiser_beta) if self.window == 'kaiser' else self.window
+            window = get_window(spec, n, fftbins=False)
+            window *= n / window.sum()
+            window.flags.writeable = False
+            self._windows[n] = window
+        return window
+
+    def _ifft(self, batch):
+        """Windowed, zero-padded IFFT along the last axis, scaled so padding does not change levels."""
+        n = batch.shape[-1]
+        window = self._window(n)
+        if window is not None:
+            batch = batch * window
+        result = scipy.fft.ifft(batch, n=n * self.pad, axis=-1, workers=self.workers)
+        if self.pad > 1:
+            result *= self.pad
+        return result
+
+    def impulse(self, channels):
+        """IFFT of each coefficient vector; vectors of equal length share one batched call."""
+        if isinstance(channels, np.ndarray) and channels.ndim == 2:
+            return list(self._ifft(channels))
+        channels = [np.asarray(c) for c in channels]
+        result = [None] * len(channels)
+        by_length = {}
+        for i, c in enumerate(channels):
+            by_length.setdefault(len(c), []).append(i)
+        for n, indices in by_length.items():
+            if n == 0:
+                for i in indices:
+                    result[i] = np.empty(0, dtype=np.complex128)
+                continue
+            batch = self._ifft(np.stack([channels[i] for i in indices]))
+            for row, i in enumerate(indices):
+                result[i] = batch[row]
+        return result
+
+    @staticmethod
+    def db(values, floor=None):
+        """20*log10|values|; with a floor, zero magnitudes (-inf dB) become the floor."""
+        with np.errstate(divide='ignore'):
+            result = 20 * np.log10(np.abs(values))
+        if floor is not None:
+            result[np.isneginf(result)] = floor
+        return result
+
+    def _axis(self, n, launch_time):
+        key = (n, launch_time)
+        axis = self._axes.get(key)
+        if axis is None:
+            rtt_s = np.arange(n) / (n * self.bin_spacing)   # round-trip time of each bin
+            one_way_s = (rtt_s - launch_time) / 2
+            axis = (rtt_s * 1e6, one_way_s * 1e6, one_way_s * self.vop * SPEED_OF_LIGHT_FT_PER_S)
+            for a in axis:
+                a.flags.writeable = False
+            self._axes[key] = axis
+        return axis
+
+    def rtt_us(self, n):
+        """Round-trip time (us) of each of n impulse bins."""
+        return self._axis(n, 0.0)[0]
+
+    def one_way_us(self, n, launch_time=0.0):
+        """One-way time (us) after launch_time (seconds of round-trip time)."""
+        return self._axis(n, launch_time)[1]
+
+    def distance_ft(self, n, launch_time=0.0):
+        """One-way distance (ft) after launch_time at this engine's velocity of propagation."""
+        return self._axis(n, launch_time)[2]
+
+    @staticmethod
+    def peaks(rows, height=None, prominence=None, max_peaks=None):
+        """Peak indices of each dB row, strongest first (ties keep index order), at most max_peaks per row."""
+        result = []
+        for row in rows:
+            found, _ = find_peaks(row, height=height, prominence=prominence)
+            order = np.argsort(-row[found], kind='stable')
+            result.append(found[order[:max_peaks]])
+        return result
+
+    @staticmethod
+    def _vertex(a, b, c):
+        """Offset (in samples) and level of the vertex of the parabola through (-1, a), (0, b), (1, c)."""
+        curvature = a - 2 * b + c
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = np.where(curvature < 0, 0.5 * (a - c) / curvature, 0.0)
+        return delta, b - 0.25 * (a - c) * delta
+
+    @classmethod
+    def parabolic(cls, db, peaks):
+        """Sub-sample peak positions and levels from a parabola through each peak and its neighbours."""
+        peaks = np.asarray(peaks, dtype=np.intp)
+        index = peaks.astype(np.float64)
+        level = db[peaks].astype(np.float64)
+        inner = (peaks > 0) & (peaks < len(db) - 1)
+        p = peaks[inner]
+        delta, level[inner] = cls._vertex(db[p - 1], db[p], db[p + 1])
+        index[inner] += delta
+        return index, level
+
+    def _sinc_matrix(self, n, size):
+        """exp(j*2*pi*k*d/size) for bins k < n and offsets d across +/-1 output sample (cached per length)."""
+        key = (n, size)
+        matrix = self._sinc.get(key)
+        if matrix is None:
+            offsets = np.linspace(-1.0, 1.0, SINC_GRID_POINTS)
+            matrix = np.exp(2j * np.pi * np.outer(np.arange(n), offsets) / size)
+            self._sinc[key] = matrix
+        return matrix
+
+    def sinc(self, spectrum, peaks):
+        """Peak positions and levels from the band-limited (sinc) interpolation of the impulse between samples."""
+        peaks = np.asarray(peaks, dtype=np.intp)
+        if len(peaks) == 0:
+            return np.empty(0), np.empty(0)
+        spectrum = np.asarray(spectrum)
+        n = len(spectrum)
+        size = n * self.pad
+        window = self._window(n)
+        if window is not None:
+            spectrum = spectrum * window
+        # Row i: the spectrum rotated to peak i; times the offset matrix it gives the impulse around that peak.
+        rotated = spectrum * np.exp(2j * np.pi * np.outer(peaks, np.arange(n)) / size)
+        grid = self.db(rotated @ self._sinc_matrix(n, size) * (self.pad / size))
+        # Best grid point, refined with a parabola through its neighbours.
+        rows = np.arange(len(peaks))
+        best = np.clip(np.argmax(grid, axis=1), 1, SINC_GRID_POINTS - 2)
+        delta, level = self._vertex(grid[rows, best - 1], grid[rows, best], grid[rows, best + 1])
+        step = 2.0 / (SINC_GRID_POINTS - 1)
+        return peaks + (best + delta - (SINC_GRID_POINTS - 1) / 2) * step, level
+
+    def analyze(self, channels, half=True, floor=None, launch_time=0.0, height=None, prominence=None, max_peaks=None):
+        """Full TDR of each channel. half keeps the first half of the impulse (the unaliased span)."""
+        traces = []
+        channels = list(channels)
+        impulses = self.impulse(channels)
+        dbs = []
+        for impulse in impulses:
+            n = len(impulse)
+            length = n // 2 if half else n
+            dbs.append(self.db(impulse[:length], floor))
+        for channel, impulse, db, peaks in zip(channels, impulses, dbs, self.peaks(dbs, height, prominence, max_peaks)):
+            n = len(impulse)
+            length = len(db)
+            rtt_us, one_way_us, distance_ft = self._axis(n, launch_time)
+            peak_index = peak_db = None
+            if self.interpolation == 'parabolic':
+                peak_index, peak_db = self.parabolic(db, peaks)
+            elif self.interpolation == 'sinc':
+                peak_index, peak_db = self.sinc(channel, peaks)
+            traces.append(TdrTrace(impulse, db, rtt_us[:length], one_way_us[:length], distance_ft[:length],
+                                   peaks, peak_index, peak_db))
+        return traces
@@ -0,0 +1,164 @@
+# Adaptive Timing Profiles
+# Version: 1.1
+# v1.1: Timeouts are recorded as censored samples and relax the command's timeout to the default for
+#       the rest of the run; a learned timeout is never below TIMEOUT_DEFAULT_FRACTION of the default.
+#
+# Description:
+# Records how long amp commands actually take, keyed by image (CS/CC/SC/BC),
+# firmware and command, and persists the samples as JSON between runs.
+# Timeouts and readiness waits are then derived from the observed percentiles
+# instead of the worst-case constants, so a fast amp is not held to the budget
+# of the slowest firmware. Until enough samples exist for a key the caller's
+# default is used unchanged. A command that times out is recorded at the time it
+# was given (its latency is at least that), so the profile can grow back when the
+# amp or firmware gets slower.
+#
+# Usage:
+#   timing = TimingProfile("./out/timing_profile.json", image="CS")
+#   amp.timing = timing                      # amp_library records and adapts
+#   wait = timing.wait(ready_key("ec_pnm_stats 8 0 /tmp/EC_8_0.dat"), 2.0)
+#   timing.save()
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+
+DEFAULT_PATH = "./out/timing_profile.json"
+UNKNOWN_FIRMWARE = "unknown"
+
+# Lines such as "SW Version : 16.3.1", "Firmware Version = 2.1" or "Image: FDX_1.2".
+FIRMWARE_PATTERN = re.compile(r"(?:SW|Software|Firmware|FW|Image)[ _]*(?:Version|Ver|Rev)?\s*[:=]\s*(\S+)", re.IGNORECASE)
+
+
+def command_key(command):
+    """Normalises a command for profiling: arguments that are paths become <path>."""
+    return re.sub(r"(?<=\s)/\S*(?=\s|$)", "<path>", " ".join(command.split()))
+
+
+def ready_key(command):
+    """Key for the time a command's result takes to become available after the command returns."""
+    return f"{command_key(command)} [ready]"
+
+
+def firmware_from_output(text):
+    """Returns the first firmware/software version string found in CLI output, or None."""
+    match = FIRMWARE_PATTERN.search(text or "")
+    return match.group(1) if match else None
+
+
+class TimingProfile:
+    """Latency samples for one image, persisted to a JSON file shared by all images and firmwares."""
+    MAX_SAMPLES = 200       # rolling window kept per command
+    MIN_SAMPLES = 5         # samples needed before a percentile replaces the default
+    TIMEOUT_PERCENTILE = 99
+    TIMEOUT_MARGIN = 2.0    # timeout = margin x p99 latency
+    TIMEOUT_FLOOR = 1.0     # seconds; never time out faster than this
+    TIMEOUT_DEFAULT_FRACTION = 0.25     # nor faster than this fraction of the caller's default
+    WAIT_PERCENTILE = 95
+    WAIT_MARGIN = 1.2       # readiness wait = margin x p95 latency
+
+    def __init__(self, path=DEFAULT_PATH, image=None, firmware=None):
+        self.path = path
+        self.image = image or "any"
+        self.firmware = firmware or UNKNOWN_FIRMWARE
+        self.profiles = {}
+        self._new = {}
+        self._relaxed = set()   # keys that timed out this run: back to the caller's default
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.profiles = json.load(f).get('profiles', {})
+        except FileNotFoundError:
+            self.profiles = {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable timing profile {self.path}: {e}")
+            self.profiles = {}
+
+    def set_firmware(self, firmware):
+        if firmware:
+            self.firmware = firmware
+
+    def record(self, command, seconds, key=None):
+        """Adds one observed latency for command (or an explicit key)."""
+        key = key or command_key(command)
+        with self._lock:
+            for samples in (self._samples(self.profiles, self.firmware, key), self._samples(self._new, self.firmware, key)):
+                samples.append(round(float(seconds), 4))
+                del samples[:-self.MAX_SAMPLES]
+
+    def record_timeout(self, command, seconds, key=None):
+        """Records a command that gave up after `seconds` (a lower bound of its latency).
+
+        The sample keeps the percentiles from only ever shrinking, and the key uses the
+        caller's default timeout and wait for the rest of the run.
+        """
+        key = key or command_key(command)
+        self.record(command, seconds, key=key)
+        with self._lock:
+            self._relaxed.add(key)
+        logging.debug(f"'{key}' timed out after {seconds:.2f} s; using the default timeout from now on.")
+
+    def _samples(self, profiles, firmware, key):
+        return profiles.setdefault(self.image, {}).setdefault(firmware, {}).setdefault(key, [])
+
+    def samples(self, key):
+        """Samples for this firmware, or pooled over all firmwares of the image when there are too few."""
+        firmwares = self.profiles.get(self.image, {})
+        samples = firmwares.get(self.firmware, {}).get(key, [])
+        if len(samples) < self.MIN_SAMPLES:
+            samples = [s for profile in firmwares.values() for s in profile.get(key, [])]
+        return samples
+
+    def percentile(self, key, q):
+        samples = self.samples(key)
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        return float(np.percentile(samples, q))
+
+    def timeout(self, command, default, key=None):
+        """Timeout for a command: margin x p99 of observed latency, between the floors and the default."""
+        key = key or command_key(command)
+        p = self.percentile(key, self.TIMEOUT_PERCENTILE)
+        if p is None or key in self._relaxed:
+            return default
+        return min(default, max(self.TIMEOUT_FLOOR, default * self.TIMEOUT_DEFAULT_FRACTION, p * self.TIMEOUT_MARGIN))
+
+    def wait(self, key, default):
+        """Readiness wait (a fixed sleep in the old code): margin x p95 of observed readiness latency."""
+        p = self.percentile(key, self.WAIT_PERCENTILE)
+        if p is None or key in self._relaxed:
+            return default
+        return min(default, p * self.WAIT_MARGIN)
+
+    def histogram(self, command, bins=10, key=None):
+        """Returns (counts, bin_edges) of the latencies recorded for a command."""
+        return np.histogram(self.samples(key or command_key(command)), bins=bins)
+
+    def save(self):
+        """Merges this run's samples into the profile file (other processes may have written it meanwhile)."""
+        with self._lock:
+            if not self._new:
+                return
+            new, self._new = self._new, {}
+        self.load()
+        with self._lock:
+            for image, firmwares in new.items():
+                for firmware, keys in firmwares.items():
+                    for key, samples in keys.items():
+                        merged = self.profiles.setdefault(image, {}).setdefault(firmware, {}).setdefault(key, [])
+                        merged.extend(samples)
+                        del merged[:-self.MAX_SAMPLES]
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': 1, 'profiles': self.profiles}, f)
+            os.replace(tmp_path, self.path)
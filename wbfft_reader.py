@@ -0,0 +1,117 @@
+# WBFFT Dump Reader
+# Version: 1.0
+#
+# Description:
+# Reads the "<frequency>:<amplitude>" text that /wbfft/start_capture writes
+# (also the format of WBFFT-based compensation tables) into float arrays in one
+# vectorised pass, instead of splitting and converting 16384 lines one by one.
+# The result is saved next to the dump as "<dump>.npy", so reprocessing,
+# replotting and channel-power reruns on an existing out/<mac>/<date>/wbfft
+# directory load the binary cache (optionally memory-mapped) and never parse
+# the text again. A cache is only used while the dump still has the size and
+# mtime it was built from; a new download of the dump rebuilds it.
+#
+# Cache layout: a (2, bins + 1) float64 array; column 0 holds the source size and
+# mtime_ns (int64 bit patterns), row 0 the frequencies and row 1 the amplitudes.
+#
+# Usage:
+#   freq, amplitude = wbfft_reader.load("./out/<mac>/<date>/wbfft/WBFFT_North_Port_Input")
+#   python wbfft_reader.py ./out/<mac>/<date>/wbfft      # build caches for every dump in a directory
+
+import argparse
+import glob
+import logging
+import os
+import re
+import tempfile
+
+import numpy as np
+
+CACHE_SUFFIX = ".npy"
+_NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+# A data line is exactly "<number>:<number>"; headers such as "Received 16384 bins" never match.
+_PAIR = re.compile(rf"^[ \t]*({_NUMBER})[ \t]*:[ \t]*({_NUMBER})[ \t]*\r?$", re.MULTILINE)
+
+
+def parse_text(text):
+    """(frequency, amplitude) float64 arrays of every "<number>:<number>" line in text."""
+    lines = [line for line in text.splitlines() if line.count(':') == 1]
+    if not lines:
+        return np.empty(0), np.empty(0)
+    try:
+        # Fast path: every single-colon line is a data line (true of clean dumps).
+        pairs = np.loadtxt(lines, delimiter=':', dtype=np.float64, ndmin=2)
+    except ValueError:
+        # Some single-colon line is not a number pair: keep only the lines that are.
+        pairs = np.array(_PAIR.findall(text), dtype=np.float64).reshape(-1, 2)
+    return pairs[:, 0].copy(), pairs[:, 1].copy()
+
+
+def cache_path(path):
+    return path + CACHE_SUFFIX
+
+
+def _source_key(stat):
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64).view(np.float64)
+
+
+def _read_cache(path, stat, mmap_mode):
+    try:
+        cache = np.load(cache_path(path), mmap_mode=mmap_mode, allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    if cache.ndim != 2 or cache.shape[0] != 2 or cache.shape[1] < 1:
+        return None
+    if not np.array_equal(np.asarray(cache[:, 0]).view(np.int64), _source_key(stat).view(np.int64)):
+        return None
+    return cache[0, 1:], cache[1, 1:]
+
+
+def _write_cache(path, stat, freq, amplitude):
+    cache = np.empty((2, len(freq) + 1), dtype=np.float64)
+    cache[:, 0] = _source_key(stat)
+    cache[0, 1:] = freq
+    cache[1, 1:] = amplitude
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, cache)
+        os.replace(tmp_path, cache_path(path))
+    except OSError as e:
+        logging.warning(f"Could not write WBFFT cache for {path}: {e}")
+
+
+def load(path, use_cache=True, mmap_mode=None):
+    """(frequency, amplitude) arrays of a WBFFT text dump, from its .npy cache when it is current.
+
+    With mmap_mode='r' a cached dump is memory-mapped (read-only views) instead of read.
+    Raises FileNotFoundError if the dump does not exist.
+    """
+    stat = os.stat(path)
+    if use_cache:
+        cached = _read_cache(path, stat, mmap_mode)
+        if cached is not None:
+            logging.debug(f"Loaded {len(cached[0])} WBFFT points from cache {cache_path(path)}")
+            return cached
+    with open(path, 'r') as f:
+        freq, amplitude = parse_text(f.read())
+    if use_cache and len(freq):
+        _write_cache(path, stat, freq, amplitude)
+    return freq, amplitude
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build .npy caches for the WBFFT dumps in a directory.")
+    parser.add_argument('directory', help="Directory of WBFFT dumps, e.g. ./out/<mac>/<date>/wbfft")
+    parser.add_argument('--pattern', default="WBFFT_*", help="Glob of the dumps to cache (default: WBFFT_*).")
+    args = parser.parse_args()
+    for path in sorted(glob.glob(os.path.join(args.directory, args.pattern))):
+        if path.endswith((CACHE_SUFFIX, ".config", ".csv", ".html")) or not os.path.isfile(path):
+            continue
+        freq, _ = load(path)
+        print(f"{path}: {len(freq)} points")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# WBFFT Capture Scheduler
+# Version: 1.1
+# v1.1: The old dumps are deleted before the captures start, and a capture is only
+#       downloaded once its dump exists and has stopped growing (amps with an exec
+#       channel); other amps wait capture_wait per capture started.
+#
+# Description:
+# Runs ds.py's WBFFT captures so the amp is never idle while files download.
+# Captures are configured and started on the interactive shell from the
+# calling thread; as soon as a capture has finished, downloading its dump and
+# post-processing it are handed to a worker thread (its own exec/SCP channels
+# on the same transport) while the next ADC is configured and captures. Worker
+# jobs run one at a time in submission order, so work submitted before the
+# captures (e.g. calibration downloads) is done before the first measurement
+# is processed.
+#
+# On firmware that can queue captures (config 'wbfft_queue_captures'), all
+# captures are started back to back, waited for once and fetched in one
+# stream, so N measurements take about one capture time plus one transfer.
+#
+# Every run writes the same remote dump paths, so the previous dumps are deleted
+# first and a capture is handed to the worker only when its new dump is on the
+# amp with the same size at two consecutive probes (or capture_timeout per
+# capture has passed). Amps that cannot delete or probe files (no exec channel)
+# fall back to a fixed capture_wait per capture started.
+#
+# Usage:
+#   scheduler = CaptureScheduler(amp, channel, transport, queue_captures=config.get('wbfft_queue_captures', False))
+#   scheduler.submit(prepare_calibration)
+#   results = scheduler.run([WbfftCapture(name, config_cmd, remote_base, files), ...], process)
+#   scheduler.close()
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CAPTURE_WAIT = 1.0      # seconds per capture when the dump cannot be probed
+DEFAULT_CAPTURE_TIMEOUT = 10.0  # seconds per capture to wait for a probed dump to be complete
+PROBE_INTERVAL = 0.2            # seconds between dump size probes
+
+
+class WbfftCapture:
+    """One WBFFT measurement: its /wbfft/configuration command, remote dump base and {remote: local} files."""
+    __slots__ = ('name', 'config_command', 'remote_base', 'files')
+
+    def __init__(self, name, config_command, remote_base, files):
+        self.name = name
+        self.config_command = config_command
+        self.remote_base = remote_base
+        self.files = files
+
+
+class CaptureScheduler:
+    """Overlaps WBFFT captures on the amp with downloading and processing of earlier ones."""
+
+    def __init__(self, amp, channel, transport, queue_captures=False, capture_wait=DEFAULT_CAPTURE_WAIT,
+                 capture_timeout=DEFAULT_CAPTURE_TIMEOUT):
+        self.amp = amp
+        self.channel = channel
+        self.transport = transport
+        self.queue_captures = queue_captures
+        self.capture_wait = capture_wait
+        self.capture_timeout = capture_timeout
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wbfft-fetch")
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues background work ahead of any capture submitted later."""
+        return self.pool.submit(fn, *args, **kwargs)
+
+    def _start(self, capture):
+        logging.debug(f"Configuring WBFFT for {capture.name} with command: {capture.config_command}")
+        self.amp.hal_comm(self.channel, capture.config_command, "Success.")
+        logging.debug(f"Starting WBFFT capture for {capture.name}...")
+        self.amp.hal_comm(self.channel, f"/wbfft/start_capture 0 {capture.remote_base}", "Success.")
+
+    def _wait(self, captures, started, cleared):
+        """Returns once the captures' new dumps are complete on the amp (or their time is up)."""
+        paths = [capture.remote_base for capture in captures]
+        sizes = self.amp.file_sizes(self.transport, paths) if cleared else None
+        if sizes is None:
+            time.sleep(max(0.0, started + self.capture_wait * len(captures) - time.time()))
+            return
+        deadline = started + self.capture_timeout * len(captures)
+        previous = {}
+        while incomplete := [c.name for c in captures
+                             if not sizes.get(c.remote_base) or sizes[c.remote_base] != previous.get(c.remote_base)]:
+            if time.time() >= deadline:
+                logging.warning(f"WBFFT dump of {', '.join(incomplete)} not complete after "
+                                f"{deadline - started:.1f} s; downloading what is there.")
+                return
+            previous = sizes
+            time.sleep(PROBE_INTERVAL)
+            sizes = self.amp.file_sizes(self.transport, paths)
+            if sizes is None:
+                return
+
+    def _download(self, files):
+        """fetch_files() with failures logged; returns the entries fetched ({} if the transfer failed)."""
+        try:
+            fetched = self.amp.fetch_files(self.transport, files)
+        except Exception as e:
+            logging.error(f"Download of {', '.join(files)} failed: {e}")
+            fetched = {}
+        for remote in files:
+            if remote not in fetched:
+                logging.error(f"Failed to download {remote}")
+        return fetched
+
+    def _collect(self, captures, process):
+        """Downloads and processes captures; a failure only costs the capture it happens in."""
+        files = {remote: local for capture in captures for remote, local in capture.files.items()}
+        fetched = self._download(files)
+        if len(captures) > 1 and not fetched:
+            # The shared transfer failed outright: try each capture on its own.
+            for capture in captures:
+                fetched.update(self._download(capture.files))
+        results = []
+        for capture in captures:
+            if capture.remote_base not in fetched:
+                # Never process an older dump left at the local path.
+                logging.error(f"Skipping {capture.name}: its WBFFT dump was not downloaded.")
+                results.append(None)
+                continue
+            try:
+                results.append(process(capture, fetched))
+            except Exception as e:
+                logging.error(f"Processing of {capture.name} failed: {e}", exc_info=True)
+                results.append(None)
+        return results
+
+    def run(self, captures, process):
+        """Captures each measurement; process(capture, fetched) runs on the worker after its download.
+
+        Returns the process() results in capture order (None for a capture whose
+        processing failed; the error is logged and the other captures go on).
+        """
+        captures = list(captures)
+        futures = []
+        # Last run's dumps are at the same paths: never let a slow capture hand them over as new.
+        cleared = self.amp.remove_files(self.transport, [path for capture in captures for path in capture.files])
+        if self.queue_captures:
+            started = time.time()
+            for capture in captures:
+                self._start(capture)
+            self._wait(captures, started, cleared)
+            futures.append(self.pool.submit(self._collect, captures, process))
+        else:
+            for capture in captures:
+                started = time.time()
+                self._start(capture)
+                self._wait([capture], started, cleared)
+                futures.append(self.pool.submit(self._collect, [capture], process))
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def close(self):
+        self.pool.shutdown(wait=True)